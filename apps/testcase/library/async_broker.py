@@ -0,0 +1,280 @@
+import asyncio
+import os
+from collections import deque
+from typing import Iterable, Optional
+
+import pika
+from pika.adapters.asyncio_connection import AsyncioConnection
+
+
+class AsyncPublisher:
+    """
+    Publicador com publisher confirms sobre o adaptador asyncio do pika.
+
+    Mantém até `window` publicações aguardando confirmação do broker: cada publish
+    só espera vaga na janela, não a confirmação da anterior, então a vazão não fica
+    presa ao tempo de ida e volta. O resultado de cada mensagem (ack ou nack) chega
+    pelo future devolvido em `publish`. Sem `parameters`, conecta em `host` no vhost
+    `virtual_host` (ou BROKER_VHOST, ou "/"), como o Broker.
+
+    Exemplo:
+        async with AsyncPublisher("brk", "rk") as publisher:
+            delivered = await publisher.publish_many(json.dumps(e) for e in events)
+    """
+    def __init__(
+            self,
+            exchange: str,
+            routing_key: str,
+            host: str = 'localhost',
+            window: int = 1000,
+            persistent: bool = True,
+            parameters: Optional[pika.ConnectionParameters] = None,
+            virtual_host: Optional[str] = None,
+    ):
+        self.exchange = exchange
+        self.routing_key = routing_key
+        self.parameters = parameters or pika.ConnectionParameters(
+            host=host, virtual_host=virtual_host or os.environ.get("BROKER_VHOST", "/"))
+        self.window = window
+        # Propriedades montadas uma vez e reaproveitadas em todas as mensagens
+        self.properties = pika.BasicProperties(delivery_mode=2 if persistent else 1)
+        self.connection = None
+        self.channel = None
+        self._slots = None
+        self._pending: dict[int, asyncio.Future] = {}  # delivery_tag -> future, em ordem de envio
+        self._next_tag = 1
+        self._closed = None
+
+    async def connect(self):
+        loop = asyncio.get_running_loop()
+        opened = loop.create_future()
+        self._closed = loop.create_future()
+        self._slots = asyncio.Semaphore(self.window)
+
+        def on_open_error(connection, error):
+            if not opened.done():
+                opened.set_exception(pika.exceptions.AMQPConnectionError(error))
+
+        def on_close(connection, reason):
+            self._fail_pending(reason)
+            if not opened.done():
+                opened.set_exception(pika.exceptions.AMQPConnectionError(reason))
+            if not self._closed.done():
+                self._closed.set_result(reason)
+
+        def on_channel(channel):
+            self.channel = channel
+            channel.add_on_close_callback(lambda ch, reason: self._on_channel_closed(reason))
+            channel.confirm_delivery(
+                ack_nack_callback=self._on_confirm,
+                callback=lambda frame: opened.done() or opened.set_result(None),
+            )
+
+        self.connection = AsyncioConnection(
+            self.parameters,
+            on_open_callback=lambda connection: connection.channel(on_open_callback=on_channel),
+            on_open_error_callback=on_open_error,
+            on_close_callback=on_close,
+            custom_ioloop=loop,
+        )
+        await opened
+        return self
+
+    def _on_confirm(self, frame):
+        method = frame.method
+        delivered = isinstance(method, pika.spec.Basic.Ack)
+        if method.multiple:
+            tags = [tag for tag in self._pending if tag <= method.delivery_tag]
+        else:
+            tags = [method.delivery_tag] if method.delivery_tag in self._pending else []
+        for tag in tags:
+            future = self._pending.pop(tag)
+            if not future.done():
+                future.set_result(delivered)
+            self._slots.release()
+
+    def _on_channel_closed(self, reason):
+        self._fail_pending(reason)
+
+    def _fail_pending(self, reason):
+        error = pika.exceptions.AMQPError(f"Canal fechado antes da confirmação: {reason}")
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(error)
+            self._slots.release()
+        self._pending.clear()
+
+    async def publish(self, message, routing_key: Optional[str] = None) -> asyncio.Future:
+        """
+        Publica assim que houver vaga na janela.
+
+        Returns:
+            asyncio.Future: Resolve em True (ack) ou False (nack) quando o broker confirmar.
+        """
+        await self._slots.acquire()
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.channel.basic_publish(
+                exchange=self.exchange,
+                routing_key=routing_key or self.routing_key,
+                body=message,
+                properties=self.properties,
+            )
+        except Exception:
+            self._slots.release()
+            raise
+        self._pending[self._next_tag] = future
+        self._next_tag += 1
+        return future
+
+    async def publish_many(self, messages: Iterable, routing_key: Optional[str] = None) -> list[bool]:
+        """Publica todas as mensagens e devolve, na mesma ordem, se cada uma foi confirmada."""
+        futures = [await self.publish(message, routing_key) for message in messages]
+        return list(await asyncio.gather(*futures))
+
+    async def close(self):
+        if self.connection is None or self.connection.is_closed or self.connection.is_closing:
+            return
+        # Espera as confirmações pendentes antes de fechar
+        if self._pending:
+            await asyncio.gather(*self._pending.values(), return_exceptions=True)
+        self.connection.close()
+        await self._closed
+
+    async def __aenter__(self):
+        return await self.connect()
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+class AsyncBroker(AsyncPublisher):
+    """
+    Versão asyncio do library.broker.Broker, para passos async da Suite.
+
+    Mesma interface (publish, publish_many, consume, close), mas nada bloqueia o event
+    loop: o proxy e os leitores de log continuam rodando enquanto se publica ou espera
+    mensagens. O consumo é push (basic_consume com `prefetch`) e as mensagens também
+    podem ser lidas com `async for`.
+
+    Exemplo:
+        async with AsyncBroker("brk", "rk", "my_queue") as broker:
+            await broker.publish(json.dumps({"oi": "tutu pom"}))
+            messages = await broker.consume(10, timeout=5)
+    """
+    def __init__(
+            self,
+            exchange: str,
+            routing_key: str,
+            queue: str,
+            host: str = 'localhost',
+            exchange_type: str = 'direct',
+            queue_args: Optional[dict] = None,
+            prefetch: int = 100,
+            window: int = 1000,
+            virtual_host: Optional[str] = None,
+    ):
+        super().__init__(exchange, routing_key, host=host, window=window, virtual_host=virtual_host)
+        self.queue = queue
+        self.exchange_type = exchange_type
+        self.queue_args = queue_args if queue_args else {}
+        self.prefetch = prefetch
+        self.consumer_buffer = deque()  # (delivery_tag, mensagem) recebidas e ainda não devolvidas
+        self._arrived = None
+        self._waiters = set()
+        self._consumer_tag = None
+
+    def _call(self, method, **kwargs):
+        """Transforma um método de canal com callback em awaitable; falha se o canal fechar."""
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.add(future)
+        future.add_done_callback(self._waiters.discard)
+        method(callback=lambda frame: future.done() or future.set_result(frame), **kwargs)
+        return future
+
+    def _on_channel_closed(self, reason):
+        super()._on_channel_closed(reason)
+        error = pika.exceptions.ChannelClosed(0, str(reason))
+        for future in list(self._waiters):
+            if not future.done():
+                future.set_exception(error)
+        self._consumer_tag = None
+        if self._arrived:
+            self._arrived.set()
+
+    async def connect(self):
+        await super().connect()
+        self._arrived = asyncio.Event()
+
+        await self._call(self.channel.exchange_declare, exchange=self.exchange,
+                         exchange_type=self.exchange_type, durable=True)
+        await self._call(self.channel.queue_declare, queue=self.queue, durable=True, arguments=self.queue_args)
+        await self._call(self.channel.queue_bind, queue=self.queue, exchange=self.exchange,
+                         routing_key=self.routing_key)
+        await self._call(self.channel.basic_qos, prefetch_count=self.prefetch)
+        self._consumer_tag = self.channel.basic_consume(
+            queue=self.queue, on_message_callback=self._on_message, auto_ack=False)
+        return self
+
+    def _on_message(self, channel, method, properties, body):
+        msg = body.decode() if isinstance(body, bytes) else body
+        self.consumer_buffer.append((method.delivery_tag, msg))
+        self._arrived.set()
+
+    async def publish(self, message, routing_key: Optional[str] = None) -> bool:
+        """Publica e espera a confirmação do broker; True se confirmada (ack)."""
+        return await (await super().publish(message, routing_key))
+
+    async def publish_many(self, messages: Iterable, routing_key: Optional[str] = None) -> list[bool]:
+        futures = [await AsyncPublisher.publish(self, message, routing_key) for message in messages]
+        return list(await asyncio.gather(*futures))
+
+    async def consume(self, count: int, timeout: Optional[float] = None) -> list[str]:
+        """
+        Consome até 'count' mensagens, esperando até `timeout` segundos pela chegada.
+
+        Sem timeout devolve só o que já está no buffer. Se a tarefa for cancelada durante
+        a espera, as mensagens já separadas voltam para o buffer e nada é confirmado.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + (timeout or 0)
+        messages, last_tag = [], None
+        try:
+            while True:
+                while self.consumer_buffer and len(messages) < count:
+                    last_tag, msg = self.consumer_buffer.popleft()
+                    messages.append((last_tag, msg))
+                remaining = deadline - loop.time()
+                if len(messages) >= count or remaining <= 0 or self._consumer_tag is None:
+                    break
+                self._arrived.clear()
+                try:
+                    await asyncio.wait_for(self._arrived.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+        except asyncio.CancelledError:
+            self.consumer_buffer.extendleft(reversed(messages))
+            raise
+
+        if last_tag is not None and self.channel.is_open:
+            self.channel.basic_ack(delivery_tag=last_tag, multiple=True)
+        return [msg for _, msg in messages]
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> str:
+        while self._consumer_tag is not None or self.consumer_buffer:
+            messages = await self.consume(1, timeout=3600)
+            if messages:
+                return messages[0]
+        raise StopAsyncIteration
+
+    async def close(self):
+        if self._consumer_tag and self.channel.is_open:
+            tag, self._consumer_tag = self._consumer_tag, None
+            await self._call(self.channel.basic_cancel, consumer_tag=tag)
+        if self._arrived:
+            self._arrived.set()
+        # O que ficou no buffer sem ack volta para a fila quando o canal fecha
+        await super().close()
@@ -1,8 +1,22 @@
+import asyncio
+import atexit
+import json
+import lzma
+import os
+import threading
+import time
+import uuid
+import zlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
 import pika
 import requests
 from requests.auth import HTTPBasicAuth
 from urllib.parse import quote
 
+from library.histogram import LatencyHistogram
+
 def clear_all_queues(
     host: str = "localhost",
     port: int = 5672,
@@ -66,6 +80,206 @@ if __name__ == "__main__":
     from typing import Optional, Dict, Any
 
 
+class ConnectionPool:
+    """
+    Conexões e canais compartilhados por todos os Broker do processo.
+
+    BlockingConnection não é thread-safe, então cada thread tem a sua conexão por
+    servidor. Os canais devolvidos por Broker.close ficam guardados para o próximo
+    Broker, e exchanges, filas e bindings são declarados uma única vez por conexão
+    (cache de topologia): depois do primeiro, criar um Broker não faz nenhuma ida ao
+    servidor.
+    """
+    def __init__(self):
+        self._connections = {}   # (parâmetros, thread) -> BlockingConnection
+        self._idle_channels = {}  # (parâmetros, thread) -> [canais livres]
+        self._declared = {}       # (parâmetros, thread) -> {("exchange"|"queue"|"bind", ...)}
+        self._rpc = {}            # (parâmetros, thread) -> RpcClient
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(parameters: pika.ConnectionParameters):
+        credentials = getattr(parameters.credentials, "username", None)
+        return (parameters.host, parameters.port, parameters.virtual_host, credentials), threading.get_ident()
+
+    def connection(self, parameters: pika.ConnectionParameters):
+        """
+        Conexão desta thread com o servidor, reaberta se tiver caído.
+
+        Uma conexão parada no pool não processa eventos e perde os heartbeats: o broker
+        a derruba, mas is_closed só percebe na próxima leitura. Por isso cada retirada
+        processa os eventos pendentes (process_data_events(0)) antes de devolvê-la.
+        """
+        key = self._key(parameters)
+        connection = self._connections.get(key)
+        if connection is not None and connection.is_open:
+            try:
+                connection.process_data_events(0)
+            except pika.exceptions.AMQPError:
+                connection = None
+        if connection is None or not connection.is_open:
+            connection = pika.BlockingConnection(parameters)
+            with self._lock:
+                self._connections[key] = connection
+                self._idle_channels[key] = []
+                self._declared[key] = set()
+                self._rpc.pop(key, None)
+        return connection
+
+    def rpc_client(self, parameters: pika.ConnectionParameters) -> "RpcClient":
+        """Cliente RPC (fila de respostas exclusiva) da conexão desta thread."""
+        connection = self.connection(parameters)
+        key = self._key(parameters)
+        client = self._rpc.get(key)
+        if client is None or client.channel.is_closed:
+            client = self._rpc[key] = RpcClient(connection)
+        return client
+
+    def acquire(self, parameters: pika.ConnectionParameters):
+        """Devolve (conexão, canal), reaproveitando um canal livre quando houver."""
+        connection = self.connection(parameters)
+        idle = self._idle_channels[self._key(parameters)]
+        while idle:
+            channel = idle.pop()
+            if channel.is_open:
+                return connection, channel
+        return connection, connection.channel()
+
+    def release(self, parameters: pika.ConnectionParameters, channel):
+        key = self._key(parameters)
+        if channel.is_open and key in self._idle_channels and channel not in self._idle_channels[key]:
+            self._idle_channels[key].append(channel)
+
+    def declare(self, parameters: pika.ConnectionParameters, entry: tuple, declare) -> bool:
+        """Chama declare() só se `entry` ainda não foi declarado nesta conexão."""
+        declared = self._declared[self._key(parameters)]
+        if entry in declared:
+            return False
+        declare()
+        declared.add(entry)
+        return True
+
+    def invalidate(self, virtual_host: Optional[str] = None):
+        """Esquece a topologia declarada (de um vhost ou de todos), ex.: depois de apagar filas."""
+        with self._lock:
+            for key, declared in self._declared.items():
+                if virtual_host is None or key[0][2] == virtual_host:
+                    declared.clear()
+
+    def discard(self, virtual_host: str):
+        """Fecha e esquece as conexões de um vhost (ex.: depois de recriá-lo)."""
+        with self._lock:
+            keys = [key for key in self._connections if key[0][2] == virtual_host]
+            connections = [self._connections.pop(key) for key in keys]
+            for key in keys:
+                self._idle_channels.pop(key, None)
+                self._declared.pop(key, None)
+                self._rpc.pop(key, None)
+        for connection in connections:
+            try:
+                if connection.is_open:
+                    connection.close()
+            except pika.exceptions.AMQPError:
+                pass
+
+    def close_all(self):
+        with self._lock:
+            connections = list(self._connections.values())
+            self._connections.clear()
+            self._idle_channels.clear()
+            self._declared.clear()
+            self._rpc.clear()
+        for connection in connections:
+            if connection.is_open:
+                try:
+                    connection.close()
+                except pika.exceptions.AMQPError:
+                    pass
+
+
+# Envelope: várias mensagens num corpo só, comprimido; o header marca o formato
+ENVELOPE_HEADER = "x-envelope"
+_CODECS = {
+    "zlib": (zlib.compress, zlib.decompress),
+    "lzma": (lzma.compress, lzma.decompress),
+}
+
+
+def pack_envelope(messages: list, codec: str = "zlib") -> bytes:
+    compress, _ = _CODECS[codec]
+    items = [msg.decode() if isinstance(msg, bytes) else msg for msg in messages]
+    return compress(json.dumps(items, separators=(",", ":")).encode())
+
+
+def unpack_envelope(properties, body) -> list[str]:
+    """Mensagens contidas no corpo; uma mensagem comum (sem o header) vira uma lista de um item."""
+    headers = getattr(properties, "headers", None) or {}
+    envelope = headers.get(ENVELOPE_HEADER)
+    if envelope is None:
+        return [body.decode() if isinstance(body, bytes) else body]
+    codec = envelope.split("/")[0]
+    if codec not in _CODECS:
+        raise ValueError(f"Envelope com compressão desconhecida: {envelope!r}")
+    _, decompress = _CODECS[codec]
+    return json.loads(decompress(body))
+
+
+class RpcClient:
+    """
+    Request/reply sobre AMQP com uma fila de respostas exclusiva por conexão.
+
+    Cada requisição leva um correlation_id e reply_to apontando para essa fila; a resposta
+    resolve o Future correspondente. Como as esperas só bombeiam a conexão, centenas de
+    requisições podem ficar pendentes ao mesmo tempo.
+    """
+    def __init__(self, connection):
+        self.connection = connection
+        self.channel = connection.channel()
+        result = self.channel.queue_declare(queue="", exclusive=True, auto_delete=True)
+        self.reply_queue = result.method.queue
+        self.channel.basic_consume(queue=self.reply_queue, on_message_callback=self._on_reply, auto_ack=True)
+        self._pending: dict[str, tuple[Future, float, LatencyHistogram]] = {}
+
+    def _on_reply(self, channel, method, properties, body):
+        entry = self._pending.pop(properties.correlation_id, None)
+        if entry is None:
+            return  # resposta atrasada de uma chamada que já expirou
+        future, sent_at, latency = entry
+        latency.record(time.perf_counter() - sent_at)
+        future.set_result(body.decode() if isinstance(body, bytes) else body)
+
+    def request(self, exchange: str, routing_key: str, body, latency: LatencyHistogram) -> Future:
+        correlation_id = uuid.uuid4().hex
+        future = Future()
+        future.correlation_id = correlation_id
+        self._pending[correlation_id] = (future, time.perf_counter(), latency)
+        self.channel.basic_publish(
+            exchange=exchange,
+            routing_key=routing_key,
+            body=body,
+            properties=pika.BasicProperties(reply_to=self.reply_queue, correlation_id=correlation_id),
+        )
+        return future
+
+    def wait(self, futures: list, timeout: float):
+        """Bombeia a conexão até todas as respostas chegarem ou o timeout passar; cancela as que faltarem."""
+        deadline = time.monotonic() + timeout
+        while not all(future.done() for future in futures):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            self.connection.process_data_events(time_limit=remaining)
+        for future in futures:
+            if not future.done():
+                self._pending.pop(future.correlation_id, None)
+                future.cancel()
+
+
+# Pool padrão do processo, fechado na saída do interpretador
+pool = ConnectionPool()
+atexit.register(pool.close_all)
+
+
 class Broker:
     def __init__(
             self,
@@ -75,6 +289,13 @@ class Broker:
             host: str = 'localhost',
             exchange_type: str = 'direct',
             queue_args: Optional[dict[str, any]] = None,
+            prefetch: int = 0,
+            ack_every: int = 100,
+            ack_interval_ms: float = 50,
+            envelope: Optional[str] = None,
+            envelope_size: int = 100,
+            envelope_ms: float = 20,
+            virtual_host: Optional[str] = None,
     ):
         """
         Inicializa o Broker com os parâmetros necessários para conexão com o RabbitMQ.
@@ -86,144 +307,563 @@ class Broker:
             host (str): Endereço do servidor RabbitMQ (padrão: 'localhost').
             exchange_type (str): Tipo do exchange (padrão: 'direct').
             queue_args (Optional[Dict[str, Any]]): Argumentos opcionais para a declaração da fila.
+            prefetch (int): Se > 0, consome em modo push (basic_consume) com esse basic_qos;
+                as mensagens chegam sozinhas no buffer interno. Com 0 usa basic_get.
+            ack_every (int): No modo push, confirma cumulativamente (multiple=True) a cada
+                N mensagens entregues pelo consume.
+            ack_interval_ms (float): ... ou quando a confirmação mais antiga pendente passar
+                desse tempo, o que vier primeiro.
+            envelope (Optional[str]): "zlib" ou "lzma" para juntar até `envelope_size`
+                mensagens (ou `envelope_ms` de espera) num único corpo comprimido, marcado
+                com o header x-envelope. O consume sempre desempacota envelopes, e o ack de
+                um envelope só sai depois que todas as suas mensagens foram entregues.
+            virtual_host (Optional[str]): Vhost do RabbitMQ; sem valor usa a variável de
+                ambiente BROKER_VHOST ou "/" (ver worker_vhost e reset_broker).
         """
         self.exchange = exchange
         self.routing_key = routing_key
         self.queue = queue
         self.host = host
+        self.virtual_host = virtual_host or os.environ.get("BROKER_VHOST", "/")
         self.exchange_type = exchange_type
         self.queue_args = queue_args if queue_args else {}
-        self.consumer_buffer = []  # ‘Buffer’ interno para armazenar mensagens consumidas
-
-        # Cria a conexão e o canal com o RabbitMQ
-        self.connection = pika.BlockingConnection(pika.ConnectionParameters(host=self.host))
-        self.channel = self.connection.channel()
+        self.consumer_buffer = deque()  # ‘Buffer’ interno: (delivery_tag, mensagem) já recebidas
+        self.prefetch = prefetch
+        # Com prefetch, mais de `prefetch` mensagens sem ack travariam a entrega
+        self.ack_every = max(1, min(ack_every, prefetch)) if prefetch else ack_every
+        self.ack_interval = ack_interval_ms / 1000
+        self._consumer_tag = None
+        self._last_tag = None      # maior delivery_tag entregue e ainda não confirmado
+        self._unacked = 0
+        self._unacked_since = None
+        self._properties = pika.BasicProperties(delivery_mode=2)  # Garante que a mensagem seja persistente
+        if envelope is not None and envelope not in _CODECS:
+            raise ValueError(f"Compressão de envelope inválida: {envelope!r}")
+        self.envelope = envelope
+        self.envelope_size = envelope_size
+        self.envelope_interval = envelope_ms / 1000
+        self._envelope_properties = pika.BasicProperties(
+            delivery_mode=2, headers={ENVELOPE_HEADER: f"{envelope}/json"})
+        self._outbox = []
+        self._outbox_since = None
+        self._outbox_timer = None
+        self._publisher = None       # AsyncPublisher do publish_many
+        self._confirm_thread = None  # thread com o event loop desse publicador
+        self.rpc_latency = LatencyHistogram()
 
-        # Declara o exchange somente se ele não existir
-        self._declare_exchange()
+        # Pega a conexão e um canal do pool compartilhado do processo
+        self.parameters = pika.ConnectionParameters(host=self.host, virtual_host=self.virtual_host)
+        self.connection, self.channel = pool.acquire(self.parameters)
 
-        # Declara a fila somente se ela não existir
-        self._declare_queue()
+        # Declara exchange, fila e binding uma única vez por conexão
+        pool.declare(self.parameters, ("exchange", self.exchange), self._declare_exchange)
+        pool.declare(self.parameters, ("queue", self.queue), self._declare_queue)
+        pool.declare(self.parameters, ("bind", self.queue, self.exchange, self.routing_key), self._bind_queue)
 
-        # Realiza o binding entre a fila e o exchange
-        self._bind_queue()
+        if self.prefetch:
+            self._start_consumer()
 
     def _declare_exchange(self):
-        """Declara o exchange somente se ele não existir."""
+        """
+        Declara o exchange (idempotente, uma ida ao servidor).
+
+        Se ele já existe com outros argumentos o broker fecha o canal com
+        PRECONDITION_FAILED; nesse caso o exchange existente é mantido, o conflito é
+        avisado e o Broker passa a usar um canal novo.
+        """
         try:
-            # Tenta declarar o exchange de forma passiva (sem criar, apenas verificando)
             self.channel.exchange_declare(
                 exchange=self.exchange,
                 exchange_type=self.exchange_type,
-                passive=True,  # Modo passivo: verifica se o exchange existe
                 durable=True,
             )
         except pika.exceptions.ChannelClosedByBroker as e:
-            if "NOT_FOUND" in str(e):
-                # Se o exchange não existir, declara-o
-                self.channel.exchange_declare(
-                    exchange=self.exchange,
-                    exchange_type=self.exchange_type,
-                    durable=True,
-                )
-            else:
-                raise e
+            self._reopen_after_conflict(e)
 
     def _declare_queue(self):
-        """Declara a fila somente se ela não existir."""
+        """Declara a fila com os argumentos fornecidos, mantendo a existente (com aviso) se os argumentos forem outros."""
         try:
-            # Tenta declarar a fila de forma passiva (sem criar, apenas verificando)
             self.channel.queue_declare(
                 queue=self.queue,
-                passive=True,  # Modo passivo: verifica se a fila existe
-            )
-        except pika.exceptions.ChannelClosedByBroker as e:
-            if "NOT_FOUND" in str(e):
-                # Se a fila não existir, declara-a com os argumentos fornecidos
-                self.channel.queue_declare(
-                    queue=self.queue,
-                    durable=True,
-                    arguments=self.queue_args,
-                )
-            else:
-                raise e
-
-    def _bind_queue(self):
-        """Realiza o binding entre a fila e o exchange."""
-        try:
-            # Verifica se o binding já existe
-            self.channel.queue_bind(
-                queue=self.queue,
-                exchange=self.exchange,
-                routing_key=self.routing_key,
+                durable=True,
+                arguments=self.queue_args,
             )
         except pika.exceptions.ChannelClosedByBroker as e:
-            if "NOT_FOUND" in str(e):
-                # Se o binding não existir, cria-o
-                self.channel.queue_bind(
-                    queue=self.queue,
-                    exchange=self.exchange,
-                    routing_key=self.routing_key,
-                )
-            else:
-                raise e
+            self._reopen_after_conflict(e)
 
-    def close(self):
-        """Fecha a conexão com o RabbitMQ."""
-        if self.connection and not self.connection.is_closed:
-            self.connection.close()
+    def _reopen_after_conflict(self, error: pika.exceptions.ChannelClosedByBroker):
+        """Troca o canal fechado por um PRECONDITION_FAILED; outros erros sobem."""
+        if error.reply_code != 406:  # PRECONDITION_FAILED
+            raise error
+        print(f"Aviso: declaração conflita com a existente no broker, mantendo a existente: {error.reply_text}")
+        self.channel = self.connection.channel()
 
+    def _bind_queue(self):
+        """Realiza o binding entre a fila e o exchange (idempotente)."""
+        self.channel.queue_bind(
+            queue=self.queue,
+            exchange=self.exchange,
+            routing_key=self.routing_key,
+        )
 
     def publish(self, message: str):
         """
         Publica uma mensagem no exchange utilizando a routing_key configurada.
 
+        No modo envelope a mensagem só sai quando o envelope enche, passa de
+        `envelope_ms` ou em flush()/close(). O prazo é um timer da conexão: ele dispara
+        no próximo publish, consume, sleep ou process_data_events de qualquer Broker
+        desta thread (a BlockingConnection só roda timers enquanto processa eventos).
+
         Args:
             message (str): A mensagem a ser publicada.
         """
+        if self.envelope:
+            self._outbox.append(message)
+            if self._outbox_since is None:
+                self._outbox_since = time.monotonic()
+                self._outbox_timer = self.connection.call_later(self.envelope_interval, self._flush_due)
+            if (len(self._outbox) >= self.envelope_size
+                    or time.monotonic() - self._outbox_since >= self.envelope_interval):
+                self.flush()
+            return
+
         self.channel.basic_publish(
             exchange=self.exchange,
             routing_key=self.routing_key,
             body=message,
-            properties=pika.BasicProperties(delivery_mode=2)  # Garante que a mensagem seja persistente
+            properties=self._properties,
+        )
+
+    def _flush_due(self):
+        self._outbox_timer = None
+        if self.channel.is_open:
+            self.flush()
+
+    def flush(self):
+        """Publica o envelope em formação, se houver."""
+        if self._outbox_timer is not None:
+            self.connection.remove_timeout(self._outbox_timer)
+            self._outbox_timer = None
+        if not self._outbox:
+            return
+        self.channel.basic_publish(
+            exchange=self.exchange,
+            routing_key=self.routing_key,
+            body=pack_envelope(self._outbox, self.envelope),
+            properties=self._envelope_properties,
         )
+        self._outbox = []
+        self._outbox_since = None
+
+    def publish_many(self, messages, window: int = 1000) -> list[bool]:
+        """
+        Publica várias mensagens com publisher confirms, mantendo até `window` sem confirmação.
+
+        Só para código síncrono: a publicação roda num event loop próprio do Broker (numa
+        thread de fundo), com uma conexão asyncio (ver AsyncPublisher) aberta na primeira
+        chamada e reaproveitada nas seguintes até o close(). Num passo async da Suite use
+        `await AsyncBroker(...).publish_many(...)`, que não bloqueia o event loop.
+
+        Returns:
+            list[bool]: Para cada mensagem, na ordem, se o broker confirmou (ack) a entrega.
+
+        Raises:
+            RuntimeError: Se chamado com um event loop rodando nesta thread.
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        else:
+            raise RuntimeError("Broker.publish_many bloquearia o event loop; "
+                               "em código async use await AsyncBroker.publish_many")
+
+        messages = list(messages)
+        envelopes = None
+        if self.envelope:
+            self.flush()
+            envelopes = [messages[i:i + self.envelope_size] for i in range(0, len(messages), self.envelope_size)]
+
+        async def run():
+            publisher = await self._confirming_publisher(window)
+            if envelopes is None:
+                return await publisher.publish_many(messages)
+            delivered = await publisher.publish_many(pack_envelope(chunk, self.envelope) for chunk in envelopes)
+            # O resultado do envelope vale para cada mensagem dentro dele
+            return [ok for ok, chunk in zip(delivered, envelopes) for _ in chunk]
+
+        return asyncio.run_coroutine_threadsafe(run(), self._confirm_loop()).result()
+
+    def _confirm_loop(self):
+        """Event loop de fundo do publish_many, criado na primeira chamada."""
+        if self._confirm_thread is None:
+            loop = asyncio.new_event_loop()
+            self._confirm_thread = threading.Thread(target=loop.run_forever, daemon=True,
+                                                    name=f"broker-confirms-{self.exchange}")
+            self._confirm_thread.loop = loop
+            self._confirm_thread.start()
+        return self._confirm_thread.loop
+
+    async def _confirming_publisher(self, window: int):
+        """AsyncPublisher do loop de fundo, recriado se a janela mudou ou o canal caiu."""
+        from library.async_broker import AsyncPublisher
+
+        publisher = self._publisher
+        if publisher is not None and (publisher.window != window or not publisher.channel.is_open):
+            await publisher.close()
+            publisher = self._publisher = None
+        if publisher is None:
+            publisher = AsyncPublisher(self.exchange, self.routing_key, window=window, parameters=self.parameters)
+            if self.envelope:
+                publisher.properties = self._envelope_properties
+            await publisher.connect()
+            self._publisher = publisher
+        return publisher
+
+    def _close_confirm_loop(self):
+        if self._confirm_thread is None:
+            return
+        loop = self._confirm_thread.loop
+        if self._publisher is not None:
+            try:
+                asyncio.run_coroutine_threadsafe(self._publisher.close(), loop).result(timeout=10)
+            except Exception as e:
+                print(f"Erro ao fechar o publicador com confirms: {e}")
+            self._publisher = None
+        loop.call_soon_threadsafe(loop.stop)
+        self._confirm_thread.join()
+        loop.close()
+        self._confirm_thread = None
+
+    # --- RPC --------------------------------------------------------------
+    def call(self, payload, timeout: float = 5.0) -> str:
+        """
+        Publica `payload` como requisição e espera a resposta (reply_to + correlation_id).
+
+        O tempo de ida e volta fica em `self.rpc_latency`.
 
-    def consume(self, count: int) -> list[str]:
+        Raises:
+            TimeoutError: Se a resposta não chegar em `timeout` segundos.
         """
-        Consome até 'count' mensagens de forma não bloqueante, utilizando o buffer interno.
+        reply = self.call_many([payload], timeout)[0]
+        if reply is None:
+            raise TimeoutError(f"Sem resposta em {timeout}s para a chamada em {self.exchange}/{self.routing_key}")
+        return reply
+
+    def call_many(self, payloads, timeout: float = 5.0) -> list[Optional[str]]:
+        """
+        Publica todas as requisições de uma vez e espera as respostas em paralelo.
+
+        Returns:
+            list[Optional[str]]: Respostas na ordem dos payloads; None para as que não
+            chegaram dentro de `timeout`.
+        """
+        client = pool.rpc_client(self.parameters)
+        futures = [client.request(self.exchange, self.routing_key, payload, self.rpc_latency)
+                   for payload in payloads]
+        client.wait(futures, timeout)
+        return [None if future.cancelled() else future.result() for future in futures]
+
+    # --- consumo ----------------------------------------------------------
+    def _start_consumer(self):
+        """Modo push: o broker empurra até `prefetch` mensagens sem ack para o buffer."""
+        self.channel.basic_qos(prefetch_count=self.prefetch)
+        self._consumer_tag = self.channel.basic_consume(
+            queue=self.queue,
+            on_message_callback=self._on_message,
+            auto_ack=False,
+        )
+
+    def _on_message(self, channel, method, properties, body):
+        self._buffer_delivery(method.delivery_tag, properties, body)
+
+    def _buffer_delivery(self, delivery_tag: int, properties, body):
+        """Coloca no buffer as mensagens da entrega; só a última de um envelope libera o ack."""
+        messages = unpack_envelope(properties, body)
+        for i, msg in enumerate(messages):
+            self.consumer_buffer.append((delivery_tag, msg, i == len(messages) - 1))
+
+    def _delivered(self, delivery_tag: int):
+        """Marca a mensagem como entregue ao chamador; o ack sai em lote depois."""
+        self._last_tag = delivery_tag
+        self._unacked += 1
+        if self._unacked_since is None:
+            self._unacked_since = time.monotonic()
+        if (self._unacked >= self.ack_every
+                or time.monotonic() - self._unacked_since >= self.ack_interval):
+            self.flush_acks()
+
+    def flush_acks(self):
+        """
+        Confirma de uma vez tudo o que já foi entregue pelo consume.
+
+        As entregas num canal têm delivery_tag crescente e o buffer é FIFO, então um único
+        basic_ack(multiple=True) com a última tag cobre exatamente as mensagens já devolvidas.
+        """
+        if self._last_tag is None:
+            return
+        self.channel.basic_ack(delivery_tag=self._last_tag, multiple=True)
+        self._last_tag = None
+        self._unacked = 0
+        self._unacked_since = None
+
+    def consume(self, count: int, timeout: Optional[float] = None) -> list[str]:
+        """
+        Consome até 'count' mensagens, utilizando o buffer interno.
 
         Args:
             count (int): Número máximo de mensagens que se deseja consumir.
+            timeout (Optional[float]): Segundos esperando a chegada de mensagens até
+                completar 'count'. Sem timeout retorna só o que já está disponível.
 
         Returns:
             list: Uma lista com as mensagens consumidas (como strings). Se não houver
                   mensagens suficientes, retorna todas as mensagens disponíveis.
         """
-        messages = []
+        if self.prefetch:
+            return self._consume_push(count, timeout)
 
-        # Primeiro, utiliza as mensagens que eventualmente já estejam no buffer
-        while self.consumer_buffer and len(messages) < count:
-            messages.append(self.consumer_buffer.pop(0))
+        messages = []
+        deadline = time.monotonic() + timeout if timeout else None
 
-        # Em seguida, realiza chamadas não bloqueantes para buscar mais mensagens, se necessário.
         while len(messages) < count:
+            # Primeiro, utiliza as mensagens que eventualmente já estejam no buffer
+            if self.consumer_buffer:
+                delivery_tag, msg, last = self.consumer_buffer.popleft()
+                messages.append(msg)
+                # Confirma (ack) a entrega quando todas as suas mensagens foram devolvidas
+                if last:
+                    self.channel.basic_ack(delivery_tag=delivery_tag)
+                continue
+
             # Usa basic_get com auto_ack=False para buscar mensagens de forma não bloqueante
             method_frame, properties, body = self.channel.basic_get(queue=self.queue, auto_ack=False)
             if method_frame:
-                # Converte o body para string (caso seja bytes)
-                msg = body.decode() if isinstance(body, bytes) else body
-                messages.append(msg)
-                # Confirma (ack) o recebimento da mensagem
-                self.channel.basic_ack(delivery_tag=method_frame.delivery_tag)
+                self._buffer_delivery(method_frame.delivery_tag, properties, body)
+            elif deadline and time.monotonic() < deadline:
+                # Fila momentaneamente vazia: espera um pouco antes de perguntar de novo
+                self.connection.sleep(min(0.05, deadline - time.monotonic()))
             else:
                 # Se a fila estiver vazia, encerra o loop
                 break
 
         return messages
 
+    def _consume_push(self, count: int, timeout: Optional[float]) -> list[str]:
+        messages = []
+        deadline = time.monotonic() + (timeout or 0)
+
+        while len(messages) < count:
+            while self.consumer_buffer and len(messages) < count:
+                delivery_tag, msg, last = self.consumer_buffer.popleft()
+                messages.append(msg)
+                if last:
+                    self._delivered(delivery_tag)
+            if len(messages) >= count:
+                break
+
+            remaining = deadline - time.monotonic()
+            # Antes de esperar, libera o prefetch: sem ack o broker não manda mais nada
+            self.flush_acks()
+            self.connection.process_data_events(time_limit=max(0, remaining))
+            if not self.consumer_buffer and time.monotonic() >= deadline:
+                break
+
+        return messages
 
     def close(self):
         """
-        Encerra a conexão com o RabbitMQ.
+        Devolve o canal ao pool; a conexão continua aberta para os próximos Broker.
+
+        Publica o envelope pendente. No modo push confirma o que já foi entregue e
+        fecha o canal: o que ficou no buffer sem ser devolvido volta para a fila (um
+        envelope entregue pela metade volta inteiro). No modo basic_get as entregas que
+        ainda estão no buffer recebem basic_nack(requeue=True) antes de o canal voltar
+        ao pool; sem isso ficariam sem ack num canal que ninguém mais lê.
         """
-        self.connection.close()
+        self._close_confirm_loop()
+        if self.connection.is_closed or self.channel.is_closed:
+            return
+        self.flush()
+        if self._consumer_tag:
+            self.flush_acks()
+            self.channel.basic_cancel(self._consumer_tag)
+            self._consumer_tag = None
+            self.channel.close()
+            return
+        if self.consumer_buffer:
+            for delivery_tag in sorted({entry[0] for entry in self.consumer_buffer}):
+                self.channel.basic_nack(delivery_tag=delivery_tag, requeue=True)
+            self.consumer_buffer.clear()
+        pool.release(self.parameters, self.channel)
+
+
+# --- reset entre testes -------------------------------------------------------
+
+def worker_vhost(prefix: str = "test") -> str:
+    """Vhost exclusivo do worker de teste atual (pytest-xdist ou, na falta dele, o pid)."""
+    worker = os.environ.get("PYTEST_XDIST_WORKER") or str(os.getpid())
+    return f"{prefix}-{worker}"
+
+
+def recycle_vhost(
+    virtual_host: str,
+    host: str = "localhost",
+    username: str = "guest",
+    password: str = "guest",
+    management_port: int = 15672,
+):
+    """
+    Apaga e recria o vhost pela API de gerenciamento: todas as filas, exchanges e
+    mensagens somem de uma vez, não importa quantas sejam.
+
+    Raises:
+        ValueError: Para o vhost padrão "/", que nunca é recriado.
+        requests.exceptions.HTTPError: Se o usuário não tiver permissão (ex.: sem a tag administrator).
+    """
+    if virtual_host == "/":
+        raise ValueError("O vhost padrão '/' não pode ser recriado; use um vhost por worker (worker_vhost)")
+    auth = HTTPBasicAuth(username, password)
+    base = f"http://{host}:{management_port}/api"
+    vhost = quote(virtual_host, safe='')
+
+    response = requests.delete(f"{base}/vhosts/{vhost}", auth=auth)
+    if response.status_code != 404:
+        response.raise_for_status()
+    requests.put(f"{base}/vhosts/{vhost}", auth=auth).raise_for_status()
+    requests.put(
+        f"{base}/permissions/{vhost}/{quote(username, safe='')}",
+        json={"configure": ".*", "write": ".*", "read": ".*"},
+        auth=auth,
+    ).raise_for_status()
+    # As conexões antigas foram derrubadas pelo servidor junto com o vhost
+    pool.discard(virtual_host)
+
+
+def purge_queues_concurrently(
+    host: str = "localhost",
+    port: int = 5672,
+    username: str = "guest",
+    password: str = "guest",
+    virtual_host: str = "/",
+    management_port: int = 15672,
+    channels: int = 8,
+) -> int:
+    """
+    Limpa todas as filas do vhost dividindo-as entre `channels` conexões em paralelo.
+
+    Todas as filas listadas são limpas: o contador `messages` da API de gerenciamento é
+    uma amostra de alguns segundos atrás e pode mostrar 0 numa fila que acabou de receber
+    mensagens. Limpar uma fila vazia custa quase nada.
+
+    Returns:
+        int: Quantidade de filas limpas.
+    """
+    url = f"http://{host}:{management_port}/api/queues/{quote(virtual_host, safe='')}?columns=name"
+    response = requests.get(url, auth=HTTPBasicAuth(username, password))
+    response.raise_for_status()
+    queues = [q["name"] for q in response.json()]
+    if not queues:
+        return 0
+
+    parameters = pika.ConnectionParameters(
+        host=host,
+        port=port,
+        virtual_host=virtual_host,
+        credentials=pika.PlainCredentials(username, password),
+    )
+
+    def purge(names):
+        connection = pika.BlockingConnection(parameters)
+        try:
+            channel = connection.channel()
+            for name in names:
+                try:
+                    channel.queue_purge(queue=name)
+                except pika.exceptions.ChannelClosedByBroker as e:
+                    if e.reply_code != 404:  # fila apagada entre a listagem e o purge
+                        raise
+                    channel = connection.channel()
+        finally:
+            connection.close()
+
+    workers = max(1, min(channels, len(queues)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(purge, [queues[i::workers] for i in range(workers)]))
+    return len(queues)
+
+
+def reset_broker(
+    host: str = "localhost",
+    port: int = 5672,
+    username: str = "guest",
+    password: str = "guest",
+    virtual_host: Optional[str] = None,
+    management_port: int = 15672,
+    strategy: str = "auto",
+    channels: int = 8,
+) -> str:
+    """
+    Deixa o broker limpo para o próximo teste, do jeito mais rápido que as permissões permitirem.
+
+    Args:
+        virtual_host (Optional[str]): Vhost do worker; sem valor usa BROKER_VHOST ou "/".
+        strategy (str): "vhost" recria o vhost inteiro (recycle_vhost); "purge" limpa as
+            filas em paralelo (purge_queues_concurrently); "clear" usa o clear_all_queues de
+            sempre; "auto" tenta nessa ordem e, se faltar permissão, cai no "clear".
+
+    Returns:
+        str: A estratégia que foi usada ("memory", "vhost", "purge" ou "clear").
+
+    Raises:
+        ValueError: Se a estratégia for desconhecida, ou "vhost" com o vhost padrão "/".
+    """
+    if strategy not in ("auto", "vhost", "purge", "clear"):
+        raise ValueError(f"Estratégia de reset inválida: {strategy!r}")
+    if os.environ.get("BROKER_BACKEND") == "memory":
+        from library.memory_broker import server
+        server.reset()
+        return "memory"
+
+    virtual_host = virtual_host or os.environ.get("BROKER_VHOST", "/")
+    if strategy == "vhost" and virtual_host == "/":
+        raise ValueError('strategy="vhost" não pode recriar o vhost padrão "/"; use um vhost por worker')
+    options = dict(host=host, username=username, password=password, management_port=management_port)
+
+    if strategy in ("auto", "vhost") and virtual_host != "/":
+        try:
+            recycle_vhost(virtual_host, **options)
+            return "vhost"
+        except requests.exceptions.HTTPError:
+            if strategy == "vhost":
+                raise
+
+    if strategy in ("auto", "purge"):
+        try:
+            purge_queues_concurrently(port=port, virtual_host=virtual_host, channels=channels, **options)
+            return "purge"
+        except (requests.exceptions.HTTPError, pika.exceptions.AMQPError):
+            if strategy == "purge":
+                raise
+
+    clear_all_queues(host, port, username, password, virtual_host, management_port)
+    return "clear"
+
+
+def create_broker(*args, backend: Optional[str] = None, **kwargs):
+    """
+    Cria um Broker com o backend escolhido por configuração.
+
+    Args:
+        backend (Optional[str]): "amqp" (RabbitMQ, padrão) ou "memory" (MemoryBroker, sem
+            processo externo). Sem valor, usa a variável de ambiente BROKER_BACKEND.
+        *args, **kwargs: Os mesmos argumentos de Broker.
+    """
+    backend = backend or os.environ.get("BROKER_BACKEND", "amqp")
+    if backend == "memory":
+        from library.memory_broker import MemoryBroker
+        return MemoryBroker(*args, **kwargs)
+    if backend != "amqp":
+        raise ValueError(f"Backend de broker inválido: {backend!r}")
+    return Broker(*args, **kwargs)
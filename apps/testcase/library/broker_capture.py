@@ -0,0 +1,218 @@
+import asyncio
+import json
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Iterable, Optional
+
+import pika
+from pika.adapters.asyncio_connection import AsyncioConnection
+
+
+@dataclass
+class CapturedMessage:
+    routing_key: str
+    body: str
+    payload: object
+    headers: dict
+    received_at: float = field(default_factory=time.time)
+
+
+def _lookup(payload, path: str):
+    """Valor de `path` ("a.b.c") dentro do JSON, ou None se não existir."""
+    value = payload
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+class MessageCapture:
+    """
+    Captura em segundo plano tudo o que passa por um exchange, indexado para asserções.
+
+    Liga uma fila temporária (exclusiva, apagada ao fechar) ao exchange e indexa cada
+    mensagem pelas chaves JSON de `keys` e pela routing key. `wait_for` procura no índice
+    (O(1)) e, se a mensagem ainda não chegou, espera por ela sem polling.
+
+    Exemplo:
+        async with MessageCapture("orders", keys=("order_id", "customer.id")) as capture:
+            ... dispara o fluxo ...
+            message = await capture.wait_for(order_id=42, timeout=5)
+    """
+    def __init__(
+            self,
+            exchange: str,
+            keys: Iterable[str] = (),
+            binding_keys: Iterable[str] = ("#",),
+            host: str = 'localhost',
+            parameters: Optional[pika.ConnectionParameters] = None,
+            virtual_host: Optional[str] = None,
+    ):
+        """
+        Args:
+            keys: Caminhos JSON indexados ("order_id", "customer.id"); em wait_for use
+                "__" no lugar do ponto (customer__id=7).
+            binding_keys: Chaves de binding da fila temporária ("#" pega tudo num exchange
+                topic; em exchanges direct informe as routing keys de interesse).
+            virtual_host: Vhost do RabbitMQ; sem valor usa BROKER_VHOST ou "/", como o
+                Broker (ignorado quando `parameters` é informado).
+        """
+        self.exchange = exchange
+        self.keys = tuple(keys)
+        self.binding_keys = tuple(binding_keys)
+        self.parameters = parameters or pika.ConnectionParameters(
+            host=host, virtual_host=virtual_host or os.environ.get("BROKER_VHOST", "/"))
+        self.messages: list[CapturedMessage] = []
+        self._index: dict[tuple, list[CapturedMessage]] = {}
+        self._waiters: dict[tuple, list[tuple[dict, asyncio.Future]]] = {}
+        self.connection = None
+        self.channel = None
+        self._closed = None
+
+    # --- conexão ---------------------------------------------------------
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        opened = loop.create_future()
+        self._closed = loop.create_future()
+
+        def fail(error):
+            if not opened.done():
+                opened.set_exception(pika.exceptions.AMQPError(error))
+
+        def on_close(connection, reason):
+            fail(reason)
+            self._fail_waiters(reason)
+            if not self._closed.done():
+                self._closed.set_result(reason)
+
+        def on_bound(frame, remaining):
+            if remaining:
+                self.channel.queue_bind(self.queue, self.exchange, routing_key=remaining[0],
+                                        callback=lambda f: on_bound(f, remaining[1:]))
+                return
+            self.channel.basic_consume(self.queue, self._on_message, auto_ack=True,
+                                       callback=lambda f: opened.done() or opened.set_result(None))
+
+        def on_queue(frame):
+            self.queue = frame.method.queue
+            on_bound(frame, list(self.binding_keys))
+
+        def on_channel(channel):
+            self.channel = channel
+            channel.add_on_close_callback(lambda ch, reason: (fail(reason), self._fail_waiters(reason)))
+            channel.queue_declare("", exclusive=True, auto_delete=True, callback=on_queue)
+
+        self.connection = AsyncioConnection(
+            self.parameters,
+            on_open_callback=lambda connection: connection.channel(on_open_callback=on_channel),
+            on_open_error_callback=lambda connection, error: fail(error),
+            on_close_callback=on_close,
+            custom_ioloop=loop,
+        )
+        await opened
+        return self
+
+    async def stop(self):
+        if self.connection is None or self.connection.is_closed or self.connection.is_closing:
+            return
+        self.connection.close()
+        await self._closed
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc_info):
+        await self.stop()
+
+    # --- índice ----------------------------------------------------------
+    @staticmethod
+    def _hashable(value):
+        try:
+            hash(value)
+            return True
+        except TypeError:
+            return False
+
+    def _entries(self, message: CapturedMessage):
+        yield ("routing_key", message.routing_key)
+        for key in self.keys:
+            value = _lookup(message.payload, key)
+            if value is not None and self._hashable(value):
+                yield (key, value)
+
+    def _on_message(self, channel, method, properties, body):
+        text = body.decode() if isinstance(body, bytes) else body
+        try:
+            payload = json.loads(text)
+        except ValueError:
+            payload = None
+        message = CapturedMessage(method.routing_key, text, payload, properties.headers or {})
+        self.messages.append(message)
+
+        for entry in self._entries(message):
+            self._index.setdefault(entry, []).append(message)
+            waiters = self._waiters.get(entry)
+            if not waiters:
+                continue
+            for item in list(waiters):
+                criteria, future = item
+                if not future.done() and self._matches(message, criteria):
+                    future.set_result(message)
+                    waiters.remove(item)
+
+    def _matches(self, message: CapturedMessage, criteria: dict) -> bool:
+        for key, value in criteria.items():
+            actual = message.routing_key if key == "routing_key" else _lookup(message.payload, key)
+            if actual != value:
+                return False
+        return True
+
+    def _fail_waiters(self, reason):
+        error = pika.exceptions.AMQPError(f"Captura encerrada: {reason}")
+        for waiters in self._waiters.values():
+            for _, future in waiters:
+                if not future.done():
+                    future.set_exception(error)
+        self._waiters.clear()
+
+    def find(self, **criteria) -> list[CapturedMessage]:
+        """Mensagens já capturadas que satisfazem todos os critérios."""
+        criteria = self._criteria(criteria)
+        key, value = next(iter(criteria.items()))
+        return [message for message in self._index.get((key, value), []) if self._matches(message, criteria)]
+
+    def _criteria(self, criteria: dict) -> dict:
+        if not criteria:
+            raise ValueError("Informe ao menos um critério, ex.: wait_for(order_id=42)")
+        normalized = {key.replace("__", "."): value for key, value in criteria.items()}
+        for key in normalized:
+            if key != "routing_key" and key not in self.keys:
+                raise ValueError(f"Chave {key!r} não está indexada; inclua-a em keys={self.keys + (key,)}")
+        return normalized
+
+    async def wait_for(self, timeout: float = 5, **criteria) -> CapturedMessage:
+        """
+        Primeira mensagem que satisfaz todos os critérios, esperando até `timeout` segundos.
+
+        Raises:
+            asyncio.TimeoutError: Se nenhuma mensagem correspondente chegar a tempo.
+        """
+        found = self.find(**criteria)
+        if found:
+            return found[0]
+
+        criteria = self._criteria(criteria)
+        entry = next(iter(criteria.items()))
+        future = asyncio.get_running_loop().create_future()
+        waiters = self._waiters.setdefault(entry, [])
+        item = (criteria, future)
+        waiters.append(item)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            if item in waiters:
+                waiters.remove(item)
+            if not waiters:
+                self._waiters.pop(entry, None)
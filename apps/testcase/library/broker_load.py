@@ -0,0 +1,206 @@
+import argparse
+import json
+import random
+import threading
+import time
+from collections import deque
+
+from rich.console import Console
+
+from library.broker import Broker
+from library.histogram import LatencyHistogram
+
+
+def size_sampler(spec, rng: random.Random):
+    """
+    Função que sorteia o tamanho (bytes) de cada mensagem.
+
+    Formatos aceitos:
+        "fixed:512"                 sempre 512 bytes
+        "uniform:100:4000"          uniforme entre 100 e 4000
+        "lognormal:6.5:1.0"         lognormal com mu e sigma (em ln(bytes))
+        [[128, 0.7], [4096, 0.3]]   tamanhos com pesos
+    """
+    if isinstance(spec, (list, tuple)):
+        sizes = [int(size) for size, _ in spec]
+        weights = [float(weight) for _, weight in spec]
+        return lambda: rng.choices(sizes, weights)[0]
+
+    kind, *args = str(spec).split(":")
+    if kind == "fixed":
+        return lambda: int(args[0])
+    if kind == "uniform":
+        low, high = int(args[0]), int(args[1])
+        return lambda: rng.randint(low, high)
+    if kind == "lognormal":
+        mu, sigma = float(args[0]), float(args[1])
+        return lambda: max(1, int(rng.lognormvariate(mu, sigma)))
+    raise ValueError(f"Distribuição de tamanho inválida: {spec!r}")
+
+
+def _message(seq: int, intended_at: float, sent_at: float, size: int) -> bytes:
+    header = json.dumps({"seq": seq, "intended_at": intended_at, "sent_at": sent_at, "pad": ""})
+    # Completa com o padding para a mensagem ter (pelo menos) o tamanho sorteado
+    return (header[:-2] + "x" * max(0, size - len(header)) + '"}').encode()
+
+
+class _TimestampedBroker(Broker):
+    """Broker que anota a hora de chegada de cada mensagem no momento da entrega, não quando o consume retorna."""
+    def __init__(self, *args, **kwargs):
+        self.arrivals = deque()  # na mesma ordem (FIFO) de consumer_buffer
+        super().__init__(*args, **kwargs)
+
+    def _buffer_delivery(self, delivery_tag: int, properties, body):
+        buffered = len(self.consumer_buffer)
+        super()._buffer_delivery(delivery_tag, properties, body)
+        now = time.time()
+        self.arrivals.extend([now] * (len(self.consumer_buffer) - buffered))
+
+
+class LatencyConsumer(threading.Thread):
+    """
+    Consome as mensagens do gerador e mede a latência ponta a ponta.
+
+    `end_to_end` é medida a partir do horário em que a mensagem *deveria* ter saído
+    (intended_at), o que já corrige a omissão coordenada: se o publicador atrasou,
+    o atraso entra na latência. `end_to_end_uncorrected` usa o horário real de envio.
+    A chegada é anotada quando o cliente recebe cada mensagem, então a espera do
+    consume por um lote cheio não entra na medida.
+    Publicador e consumidor precisam de relógios sincronizados se estiverem em máquinas diferentes.
+    """
+    def __init__(self, broker_kwargs: dict, expected: int, idle_timeout: float = 5.0, prefetch: int = 500):
+        super().__init__(daemon=True)
+        self.broker_kwargs = {**broker_kwargs, "prefetch": prefetch}
+        self.expected = expected
+        self.idle_timeout = idle_timeout
+        self.end_to_end = LatencyHistogram()
+        self.end_to_end_uncorrected = LatencyHistogram()
+        self.received = 0
+        self.seen = set()
+        self.duplicates = 0
+        self.ready = threading.Event()
+        self.stop_requested = threading.Event()
+
+    def run(self):
+        broker = _TimestampedBroker(**self.broker_kwargs)
+        self.ready.set()
+        try:
+            last_arrival = time.monotonic()
+            while self.received < self.expected and not self.stop_requested.is_set():
+                messages = broker.consume(500, timeout=0.2)
+                if messages:
+                    last_arrival = time.monotonic()
+                elif time.monotonic() - last_arrival > self.idle_timeout:
+                    break
+                for body in messages:
+                    now = broker.arrivals.popleft()
+                    data = json.loads(body)
+                    if data["seq"] in self.seen:
+                        self.duplicates += 1
+                        continue
+                    self.seen.add(data["seq"])
+                    self.received += 1
+                    self.end_to_end.record(max(0.0, now - data["intended_at"]))
+                    self.end_to_end_uncorrected.record(max(0.0, now - data["sent_at"]))
+        finally:
+            broker.close()
+
+
+def run_load(exchange: str, routing_key: str, queue: str, host: str = "localhost", rate: float = 1000,
+             duration: float = 10, sizes="fixed:256", seed: int = 0, prefetch: int = 500,
+             drain_timeout: float = 5.0, report_path: str = None, console: Console = None) -> dict:
+    """
+    Gerador de carga em malha aberta sobre o Broker.
+
+    As mensagens saem em horários fixos (início + i / rate), independentemente de quanto o
+    publish anterior demorou; se o publicador ficar para trás ele não "pula" mensagens, e o
+    atraso acumulado aparece nas latências. O tempo de cada publish também é registrado com
+    correção de omissão coordenada (LatencyHistogram.record_corrected).
+
+    Returns:
+        dict: Relatório com configuração, contagens, taxa obtida e os histogramas
+        (`publish`, `end_to_end`, `end_to_end_uncorrected`), gravado em `report_path` se informado.
+    """
+    console = console or Console()
+    rng = random.Random(seed)
+    next_size = size_sampler(sizes, rng)
+    broker_kwargs = {"exchange": exchange, "routing_key": routing_key, "queue": queue, "host": host}
+    total = int(rate * duration)
+    interval = 1 / rate
+
+    consumer = LatencyConsumer(broker_kwargs, total, drain_timeout, prefetch)
+    consumer.start()
+    consumer.ready.wait()
+
+    publisher = Broker(**broker_kwargs)
+    publish_latency = LatencyHistogram()
+    sent_bytes = 0
+    start = time.time()
+    try:
+        for seq in range(total):
+            intended_at = start + seq * interval
+            delay = intended_at - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            sent_at = time.time()
+            body = _message(seq, intended_at, sent_at, next_size())
+            publisher.publish(body)
+            publish_latency.record_corrected(time.time() - sent_at, interval)
+            sent_bytes += len(body)
+    finally:
+        publish_seconds = time.time() - start
+        publisher.close()
+
+    consumer.join(duration + drain_timeout * 2)
+    consumer.stop_requested.set()
+
+    report = {
+        "config": {"exchange": exchange, "routing_key": routing_key, "queue": queue, "host": host,
+                   "rate": rate, "duration": duration, "sizes": sizes, "seed": seed, "prefetch": prefetch},
+        "sent": total,
+        "received": consumer.received,
+        "lost": total - consumer.received,
+        "duplicates": consumer.duplicates,
+        "achieved_rate": total / publish_seconds if publish_seconds else 0.0,
+        "mb_sent": sent_bytes / 1024 / 1024,
+        "publish": publish_latency.to_dict(),
+        "end_to_end": consumer.end_to_end.to_dict(),
+        "end_to_end_uncorrected": consumer.end_to_end_uncorrected.to_dict(),
+    }
+
+    e2e = consumer.end_to_end
+    console.print(
+        f"[bold]{total:,} enviadas a {report['achieved_rate']:,.0f}/s (alvo {rate:,.0f}/s), "
+        f"{consumer.received:,} recebidas, {report['lost']:,} perdidas[/bold]"
+    )
+    console.print(
+        "ponta a ponta: " + ", ".join(f"p{p:g}={e2e.percentile(p) * 1000:.2f} ms" for p in (50, 90, 99, 99.9))
+        + f", max={(e2e.max or 0) / 1000:.2f} ms"
+    )
+
+    if report_path:
+        with open(report_path, "w") as f:
+            json.dump(report, f, indent=2)
+        console.print(f"[dim]Relatório: {report_path}[/dim]")
+    return report
+
+
+# Exemplo de uso:
+# python -m library.broker_load --exchange brk --routing-key rk --queue load_queue --rate 5000 \
+#     --duration 30 --sizes lognormal:6:1 --report load.json
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gerador de carga para o Broker")
+    parser.add_argument("--exchange", required=True)
+    parser.add_argument("--routing-key", required=True)
+    parser.add_argument("--queue", required=True)
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--rate", type=float, default=1000, help="mensagens por segundo")
+    parser.add_argument("--duration", type=float, default=10, help="segundos")
+    parser.add_argument("--sizes", default="fixed:256", help="fixed:N | uniform:A:B | lognormal:MU:SIGMA")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--prefetch", type=int, default=500)
+    parser.add_argument("--report", default=None, help="arquivo JSON do relatório")
+    args = parser.parse_args()
+
+    run_load(args.exchange, args.routing_key, args.queue, args.host, args.rate, args.duration,
+             args.sizes, args.seed, args.prefetch, report_path=args.report)
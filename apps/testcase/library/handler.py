@@ -1,12 +1,428 @@
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+# Códigos dos pedidos especiais enviados no lugar da StartupMessage
+SSL_REQUEST = 80877103
+GSSENC_REQUEST = 80877104
+CANCEL_REQUEST = 80877102
+PROTOCOL_V3 = 196608
+
+# Mensagens que só contamos/ignoramos: o corpo é pulado sem ser montado
+_SKIPPED_CLIENT = {ord("d")}              # CopyData
+_SKIPPED_SERVER = {ord("D"), ord("d")}    # DataRow, CopyData
+_MAX_MESSAGE = 1 << 30
+
+
+@dataclass
+class PgQueryEvent:
+    """Resultado de um comando observado no tráfego entre a aplicação e o Postgres."""
+    kind: str                        # "simple" (Query) ou "extended" (Parse/Bind/Execute)
+    sql: Optional[str]
+    statement: Optional[str] = None  # nome do prepared statement ("" = sem nome)
+    portal: Optional[str] = None
+    params: int = 0
+    columns: list = field(default_factory=list)
+    rows: int = 0
+    command_tag: Optional[str] = None
+    error: Optional[dict] = None     # campos do ErrorResponse: severity, code, message...
+    suspended: bool = False          # Execute com limite de linhas (PortalSuspended)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    connection: Optional[str] = None
+
+    @property
+    def duration(self) -> Optional[float]:
+        if self.started_at is None or self.finished_at is None:
+            return None
+        return self.finished_at - self.started_at
+
+
+class _MessageStream:
+    """
+    Pedaços ainda não decodificados de um sentido da conexão.
+
+    Os pedaços ficam numa deque de memoryview e são consumidos no lugar: uma mensagem
+    inteira dentro de um pedaço vira só um slice. Apenas a mensagem que atravessa a
+    fronteira entre pedaços é copiada, e só ela. O que sobra no fim de um feed é
+    copiado se o pedaço não for imutável, porque o proxy reaproveita seus buffers.
+    """
+    def __init__(self):
+        self.chunks: deque[memoryview] = deque()
+        self.available = 0
+        self.skip = 0   # bytes do corpo de uma mensagem pulada que ainda não chegaram
+
+    def push(self, chunk):
+        view = chunk if isinstance(chunk, memoryview) else memoryview(chunk)
+        if len(view):
+            self.chunks.append(view)
+            self.available += len(view)
+
+    def peek(self, n: int) -> bytes:
+        first = self.chunks[0]
+        if len(first) >= n:
+            return first[:n].tobytes()
+        out = bytearray()
+        for chunk in self.chunks:
+            out += chunk[:n - len(out)]
+            if len(out) >= n:
+                break
+        return bytes(out)
+
+    def read(self, n: int) -> memoryview:
+        first = self.chunks[0]
+        if len(first) >= n:
+            self._advance(n)
+            return first[:n]
+        out = bytearray(n)
+        filled = 0
+        while filled < n:
+            chunk = self.chunks[0]
+            size = min(len(chunk), n - filled)
+            out[filled:filled + size] = chunk[:size]
+            filled += size
+            self._advance(size)
+        return memoryview(out)
+
+    def discard(self, n: int) -> int:
+        dropped = 0
+        while self.chunks and dropped < n:
+            size = min(len(self.chunks[0]), n - dropped)
+            self._advance(size)
+            dropped += size
+        return dropped
+
+    def _advance(self, n: int):
+        first = self.chunks[0]
+        if n >= len(first):
+            self.chunks.popleft()
+        else:
+            self.chunks[0] = first[n:]
+        self.available -= n
+
+    def retain(self):
+        """Copia o que sobrou e ainda aponta para buffers do chamador."""
+        for i, chunk in enumerate(self.chunks):
+            if not isinstance(chunk.obj, bytes):
+                self.chunks[i] = memoryview(chunk.tobytes())
+
+
+def _cstring(view: memoryview, pos: int) -> tuple[str, int]:
+    """Lê uma string terminada em \\0 a partir de `pos`; devolve (texto, posição seguinte)."""
+    step = 256
+    end = pos
+    while True:
+        window = view[end:end + step].tobytes()
+        found = window.find(b"\0")
+        if found >= 0:
+            end += found
+            return view[pos:end].tobytes().decode("utf-8", "replace"), end + 1
+        if end + step >= len(view):
+            return view[pos:].tobytes().decode("utf-8", "replace"), len(view)
+        end += step
+
+
+def _int16(view: memoryview, pos: int) -> int:
+    return int.from_bytes(view[pos:pos + 2], "big", signed=True)
+
+
+def _int32(view: memoryview, pos: int) -> int:
+    return int.from_bytes(view[pos:pos + 4], "big", signed=True)
+
+
+def _rows_from_tag(tag: str) -> Optional[int]:
+    """Linhas afetadas informadas no CommandComplete ("INSERT 0 5", "UPDATE 3", "SELECT 10")."""
+    last = tag.rsplit(" ", 1)[-1]
+    return int(last) if last.isdigit() else None
+
+
+class PgWireDecoder:
+    """
+    Decodificador incremental do protocolo v3 do PostgreSQL, para uma conexão.
+
+    Recebe os bytes dos dois sentidos em pedaços arbitrários (feed_client/feed_server)
+    e emite um PgQueryEvent por comando concluído: CommandComplete, EmptyQueryResponse,
+    PortalSuspended ou ErrorResponse. Cobre startup (inclusive SSLRequest/GSSENCRequest
+    e CancelRequest), query simples e estendida (Parse/Bind/Execute/Sync, com pipeline),
+    RowDescription, DataRow (apenas contadas, sem montar o corpo) e erros.
+
+    Se a conexão passar a usar TLS, ou se bytes se perderem, a decodificação para
+    (`active` fica False) em vez de interpretar lixo.
+    """
+    def __init__(self, on_event: Callable[[PgQueryEvent], None], connection: Optional[str] = None):
+        self.on_event = on_event
+        self.connection = connection
+        self.client = _MessageStream()
+        self.server = _MessageStream()
+        self.active = True
+        self.startup = True              # o cliente ainda não mandou a StartupMessage
+        self._awaiting_ssl_answer = False
+        self.parameters: dict[str, str] = {}   # user, database, application_name...
+        self.statements: dict[str, tuple[str, int]] = {}  # nome -> (sql, parâmetros)
+        self.portals: dict[str, tuple[str, str, int]] = {}  # nome -> (statement, sql, parâmetros)
+        # Comandos aguardando resposta, com o número do ciclo (Query ou Sync) a que pertencem
+        self.pending: deque[tuple[int, PgQueryEvent]] = deque()
+        self._cycles_sent = 0
+        self._cycles_done = 0
+        self._last_parsed: Optional[tuple[int, str]] = None  # (ciclo, sql) do último Parse
+        self.last_error: Optional[dict] = None   # último ErrorResponse, mesmo os sem comando (ex.: autenticação)
+
+    # --- entrada ---------------------------------------------------------
+    def feed_client(self, chunk, now: Optional[float] = None):
+        if self.active:
+            self._feed(self.client, chunk, self._client_message, _SKIPPED_CLIENT, now)
+
+    def feed_server(self, chunk, now: Optional[float] = None):
+        if self.active:
+            self._feed(self.server, chunk, self._server_message, _SKIPPED_SERVER, now)
+
+    def data_dropped(self):
+        """Bytes se perderam (ex.: tap descartou pedaços): não dá mais para seguir o fluxo."""
+        self.stop()
+
+    def stop(self):
+        self.active = False
+        self.client = _MessageStream()
+        self.server = _MessageStream()
+        self.pending.clear()
+
+    def _feed(self, stream: _MessageStream, chunk, handle, skipped: set, now: Optional[float]):
+        now = time.perf_counter() if now is None else now
+        stream.push(chunk)
+        try:
+            self._drain(stream, handle, skipped, now)
+        except (ValueError, IndexError) as e:
+            print(f"PgWireDecoder: protocolo inesperado ({e}); decodificação interrompida")
+            self.stop()
+            return
+        if self.active:
+            stream.retain()
+
+    def _drain(self, stream: _MessageStream, handle, skipped: set, now: float):
+        while self.active:
+            if stream.skip:
+                stream.skip -= stream.discard(stream.skip)
+                if stream.skip:
+                    return
+
+            if stream is self.server and self._awaiting_ssl_answer:
+                if stream.available < 1:
+                    return
+                answer = stream.read(1).tobytes()
+                self._awaiting_ssl_answer = False
+                if answer in (b"S", b"G"):
+                    # Daqui em diante o tráfego é cifrado
+                    self.stop()
+                    return
+                continue
+
+            if stream is self.client and self.startup:
+                if stream.available < 4:
+                    return
+                length = int.from_bytes(stream.peek(4), "big")
+                if length < 8 or length > _MAX_MESSAGE:
+                    raise ValueError(f"StartupMessage com tamanho {length}")
+                if stream.available < length:
+                    return
+                self._startup_message(stream.read(length)[4:])
+                continue
+
+            if stream.available < 5:
+                return
+            header = stream.peek(5)
+            kind = header[0]
+            length = int.from_bytes(header[1:5], "big")
+            if length < 4 or length > _MAX_MESSAGE:
+                raise ValueError(f"mensagem {chr(kind)!r} com tamanho {length}")
+
+            if kind in skipped:
+                stream.discard(5)
+                stream.skip = length - 4
+                handle(kind, None, now)
+                continue
+
+            if stream.available < 1 + length:
+                return
+            handle(kind, stream.read(1 + length)[5:], now)
+
+    # --- cliente ---------------------------------------------------------
+    def _startup_message(self, body: memoryview):
+        code = _int32(body, 0)
+        if code in (SSL_REQUEST, GSSENC_REQUEST):
+            self._awaiting_ssl_answer = True
+            return
+        if code == CANCEL_REQUEST:
+            self.stop()
+            return
+        if code != PROTOCOL_V3:
+            raise ValueError(f"versão de protocolo {code >> 16}.{code & 0xFFFF}")
+        pos = 4
+        while pos < len(body) - 1:
+            name, pos = _cstring(body, pos)
+            if not name:
+                break
+            value, pos = _cstring(body, pos)
+            self.parameters[name] = value
+        self.startup = False
+        self._cycles_sent += 1   # a autenticação termina com o primeiro ReadyForQuery
+
+    def _client_message(self, kind: int, body: Optional[memoryview], now: float):
+        if kind == ord("Q"):
+            sql, _ = _cstring(body, 0)
+            self.pending.append((self._cycles_sent, PgQueryEvent("simple", sql, started_at=now,
+                                                                 connection=self.connection)))
+            self._cycles_sent += 1
+        elif kind == ord("P"):
+            name, pos = _cstring(body, 0)
+            sql, pos = _cstring(body, pos)
+            self.statements[name] = (sql, _int16(body, pos))
+            self._last_parsed = (self._cycles_sent, sql)
+        elif kind == ord("B"):
+            portal, pos = _cstring(body, 0)
+            statement, pos = _cstring(body, pos)
+            pos += 2 + 2 * _int16(body, pos)   # formatos dos parâmetros
+            params = _int16(body, pos)
+            sql = self.statements.get(statement, (None, 0))[0]
+            self.portals[portal] = (statement, sql, params)
+        elif kind == ord("E"):
+            portal, _ = _cstring(body, 0)
+            statement, sql, params = self.portals.get(portal, (None, None, 0))
+            self.pending.append((self._cycles_sent, PgQueryEvent("extended", sql, statement=statement, portal=portal,
+                                                                 params=params, started_at=now,
+                                                                 connection=self.connection)))
+        elif kind in (ord("S"), ord("F")):
+            # Sync e FunctionCall (ex.: large objects) terminam com um ReadyForQuery
+            self._cycles_sent += 1
+        elif kind == ord("C"):
+            target, name = chr(body[0]), _cstring(body, 1)[0]
+            (self.statements if target == "S" else self.portals).pop(name, None)
+        elif kind == ord("X"):
+            self.stop()
+
+    # --- servidor --------------------------------------------------------
+    def _server_message(self, kind: int, body: Optional[memoryview], now: float):
+        if kind == ord("D"):
+            current = self._current()
+            if current:
+                current.rows += 1
+        elif kind == ord("T"):
+            current = self._current()
+            if current:
+                count, pos, columns = _int16(body, 0), 2, []
+                for _ in range(count):
+                    name, pos = _cstring(body, pos)
+                    columns.append(name)
+                    pos += 18   # tabela, coluna, tipo, tamanho, typmod, formato
+                current.columns = columns
+        elif kind == ord("C"):
+            tag, _ = _cstring(body, 0)
+            event = self._complete(now)
+            if event:
+                event.command_tag = tag
+                reported = _rows_from_tag(tag)
+                if reported is not None and not event.rows:
+                    event.rows = reported
+                self.on_event(event)
+        elif kind == ord("I"):
+            event = self._complete(now)
+            if event:
+                event.command_tag = ""
+                self.on_event(event)
+        elif kind == ord("s"):
+            event = self._complete(now)
+            if event:
+                event.suspended = True
+                self.on_event(event)
+        elif kind == ord("E"):
+            self.last_error = self._error_fields(body)
+            event = self._complete(now)
+            if event is None:
+                if not self._last_parsed or self._last_parsed[0] != self._cycles_done:
+                    # Erro fora de um comando (autenticação, conexão encerrada...): não vira evento
+                    return
+                # Erro no Parse/Bind, antes de qualquer Execute: não há latência a medir
+                event = PgQueryEvent("extended", self._last_parsed[1], finished_at=now, connection=self.connection)
+            event.error = self.last_error
+            self.on_event(event)
+        elif kind == ord("Z"):
+            # Fim do ciclo: a query simples termina aqui e os Executes que o servidor pulou
+            # depois de um erro (até o Sync) são descartados
+            while self.pending and self.pending[0][0] <= self._cycles_done:
+                self.pending.popleft()
+            self._cycles_done += 1
+            if self._cycles_done > self._cycles_sent:
+                # Mais ReadyForQuery do que ciclos contados no cliente (alguma mensagem que
+                # termina ciclo escapou da contagem): o servidor está ocioso, ressincroniza
+                self._cycles_done = self._cycles_sent
+
+    def _current(self) -> Optional[PgQueryEvent]:
+        """Comando do ciclo que o servidor está respondendo agora, se houver."""
+        if self.pending and self.pending[0][0] == self._cycles_done:
+            return self.pending[0][1]
+        return None
+
+    def _complete(self, now: float) -> Optional[PgQueryEvent]:
+        """Fecha o comando em andamento e devolve o evento; a query simples continua pendente até o ReadyForQuery."""
+        if not self.pending or self.pending[0][0] != self._cycles_done:
+            return None
+        head = self.pending[0][1]
+        if head.kind == "extended":
+            self.pending.popleft()
+            head.finished_at = now
+            return head
+        # Query simples com vários comandos: um evento por comando, o próximo começa agora
+        event = PgQueryEvent("simple", head.sql, columns=head.columns, rows=head.rows,
+                             started_at=head.started_at, finished_at=now, connection=self.connection)
+        head.columns, head.rows, head.started_at = [], 0, now
+        return event
+
+    @staticmethod
+    def _error_fields(body: memoryview) -> dict:
+        names = {"S": "severity", "V": "severity", "C": "code", "M": "message", "D": "detail",
+                 "H": "hint", "P": "position", "W": "where"}
+        fields, pos = {}, 0
+        while pos < len(body) and body[pos]:
+            code = chr(body[pos])
+            value, pos = _cstring(body, pos + 1)
+            fields[names.get(code, code)] = value
+        return fields
+
+
+def _address(address) -> str:
+    if isinstance(address, tuple) and len(address) >= 2:
+        return f"{address[0]}:{address[1]}"
+    return str(address)
+
+
 class PostgresFacade:
-    def __init__(self, src, dst):
+    """
+    Facade do ProxyServer que decodifica o tráfego PostgreSQL de cada conexão.
+
+    Passe a classe ou uma instância em binary_facades; o proxy chama for_connection a
+    cada conexão para ter um decodificador próprio. Os eventos (PgQueryEvent) vão para
+    `on_event`, ou para a deque compartilhada `events` se nenhum callback for dado.
+    Os tempos dos eventos vêm de time.perf_counter() na chegada de cada pedaço.
+    """
+    timestamped = True   # no modo tap o proxy informa quando leu o pedaço
+    def __init__(self, src=None, dst=None, on_event: Optional[Callable[[PgQueryEvent], None]] = None,
+                 max_events: int = 10_000):
         self.src = src
         self.dst = dst
+        self.events = deque(maxlen=max_events)
+        self.on_event = on_event or self.events.append
+        self.decoder = PgWireDecoder(self.on_event, connection=f"{_address(src)}->{_address(dst)}" if src else None)
+
+    def for_connection(self, src, dst) -> "PostgresFacade":
+        facade = PostgresFacade(src, dst, on_event=self.on_event)
+        facade.events = self.events
+        return facade
+
+    def on_client_data_received(self, buffer: bytes, received_at: Optional[float] = None):
+        self.decoder.feed_client(buffer, received_at)
 
-    def on_client_data_received(self, buffer: bytes):
-        # Implement connection logic here
-        pass
+    def on_server_data_received(self, buffer: bytes, received_at: Optional[float] = None):
+        self.decoder.feed_server(buffer, received_at)
 
-    def on_server_data_received(self, buffer: bytes):
-        # Implement disconnection logic here
-        pass
+    def on_data_dropped(self, direction: str, nbytes: int):
+        self.decoder.data_dropped()
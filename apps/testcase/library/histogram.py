@@ -0,0 +1,100 @@
+import math
+
+
+class LatencyHistogram:
+    """
+    Histograma de latências no estilo HDR (log-linear), com memória fixa.
+
+    Os valores são guardados em microssegundos inteiros. Cada potência de 2 é dividida
+    em 2^(sub_bucket_bits - 1) faixas iguais (o bit mais alto da mantissa é sempre 1),
+    então o erro relativo de qualquer percentil fica abaixo de 1 / 2^(sub_bucket_bits - 1)
+    (7 bits ≈ 1,6%), independente da escala.
+    """
+    def __init__(self, sub_bucket_bits: int = 7):
+        self.sub_bucket_bits = sub_bucket_bits
+        self.counts: dict[int, int] = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    # --- índices ---------------------------------------------------------
+    def _index(self, value: int) -> int:
+        shift = max(0, value.bit_length() - self.sub_bucket_bits)
+        return (shift << self.sub_bucket_bits) | (value >> shift)
+
+    def _upper_value(self, index: int) -> int:
+        shift = index >> self.sub_bucket_bits
+        mantissa = index & ((1 << self.sub_bucket_bits) - 1)
+        return ((mantissa + 1) << shift) - 1
+
+    # --- gravação --------------------------------------------------------
+    def record(self, seconds: float, count: int = 1):
+        """Registra uma latência em segundos."""
+        value = max(0, int(round(seconds * 1_000_000)))
+        index = self._index(value)
+        self.counts[index] = self.counts.get(index, 0) + count
+        self.count += count
+        self.total += value * count
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def record_corrected(self, seconds: float, expected_interval: float):
+        """
+        Registra a latência corrigindo a omissão coordenada.
+
+        Se a resposta demorou mais que o intervalo esperado entre requisições, as
+        requisições que deveriam ter saído nesse meio tempo também são registradas,
+        com as latências que teriam sofrido.
+        """
+        self.record(seconds)
+        if expected_interval <= 0:
+            return
+        missing = seconds - expected_interval
+        while missing >= expected_interval:
+            self.record(missing)
+            missing -= expected_interval
+
+    def merge(self, other: "LatencyHistogram"):
+        if other.sub_bucket_bits != self.sub_bucket_bits:
+            raise ValueError("Histogramas com resoluções diferentes")
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+    # --- leitura ---------------------------------------------------------
+    def percentile(self, p: float) -> float:
+        """Valor (em segundos) abaixo do qual estão p% das amostras."""
+        if not self.count:
+            return 0.0
+        target = max(1, math.ceil(self.count * p / 100))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                return min(self._upper_value(index), self.max) / 1_000_000
+        return self.max / 1_000_000
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count / 1_000_000 if self.count else 0.0
+
+    def summary(self, percentiles=(50, 90, 95, 99, 99.9)) -> dict:
+        return {
+            "count": self.count,
+            "min": (self.min or 0) / 1_000_000,
+            "mean": self.mean,
+            "max": (self.max or 0) / 1_000_000,
+            **{f"p{p:g}": self.percentile(p) for p in percentiles},
+        }
+
+    def to_dict(self) -> dict:
+        """Resumo + distribuição completa ([limite superior em µs, contagem]) para relatórios JSON."""
+        return {
+            **self.summary(),
+            "buckets": [[self._upper_value(index), self.counts[index]] for index in sorted(self.counts)],
+        }
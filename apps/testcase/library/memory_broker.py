@@ -0,0 +1,292 @@
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from library.histogram import LatencyHistogram
+
+
+@dataclass
+class _Message:
+    body: str
+    routing_key: str
+    expires_at: Optional[float] = None
+    redelivered: bool = False
+
+
+class _MemoryQueue:
+    """Fila com os argumentos x-message-ttl, x-max-length, x-max-length-bytes e x-overflow."""
+    def __init__(self, name: str, arguments: Optional[dict] = None):
+        arguments = arguments or {}
+        self.name = name
+        self.messages: deque[_Message] = deque()
+        self.ttl = arguments.get("x-message-ttl")
+        self.max_length = arguments.get("x-max-length")
+        self.max_bytes = arguments.get("x-max-length-bytes")
+        self.overflow = arguments.get("x-overflow", "drop-head")
+        self.nbytes = 0
+
+    def _size(self, message: _Message) -> int:
+        return len(message.body)
+
+    def expire(self, now: float):
+        # Como o TTL é da fila, as mensagens vencem na ordem em que chegaram
+        while self.messages and self.messages[0].expires_at is not None and self.messages[0].expires_at <= now:
+            self.nbytes -= self._size(self.messages.popleft())
+
+    def _full(self, extra: int) -> bool:
+        return ((self.max_length is not None and len(self.messages) + 1 > self.max_length)
+                or (self.max_bytes is not None and self.nbytes + extra > self.max_bytes))
+
+    def put(self, message: _Message, now: float) -> bool:
+        self.expire(now)
+        size = self._size(message)
+        if self._full(size):
+            if self.overflow in ("reject-publish", "reject-publish-dlx"):
+                return False
+            while self.messages and self._full(size):
+                self.nbytes -= self._size(self.messages.popleft())
+            if self._full(size):
+                return False
+        if self.ttl is not None:
+            message.expires_at = now + self.ttl / 1000
+        self.messages.append(message)
+        self.nbytes += size
+        return True
+
+    def get(self, now: float) -> Optional[_Message]:
+        self.expire(now)
+        if not self.messages:
+            return None
+        message = self.messages.popleft()
+        self.nbytes -= self._size(message)
+        return message
+
+    def requeue(self, messages):
+        """Devolve mensagens não confirmadas para o início da fila, marcadas como reentregues."""
+        for message in reversed(messages):
+            message.redelivered = True
+            self.messages.appendleft(message)
+            self.nbytes += self._size(message)
+
+
+def _topic_matches(binding: tuple, key: tuple) -> bool:
+    """Casa uma routing key com a chave de binding de um exchange topic (* = uma palavra, # = zero ou mais)."""
+    if not binding:
+        return not key
+    head, rest = binding[0], binding[1:]
+    if head == "#":
+        return any(_topic_matches(rest, key[i:]) for i in range(len(key) + 1))
+    if not key:
+        return False
+    return (head == "*" or head == key[0]) and _topic_matches(rest, key[1:])
+
+
+class MemoryServer:
+    """
+    Estado de um "RabbitMQ" em memória: exchanges, filas e bindings do processo.
+
+    Compartilhado por todos os MemoryBroker (como um servidor real); `reset()` apaga tudo
+    entre testes. O lado servidor de um RPC (quem responde ao MemoryBroker.call) é
+    registrado com `respond`.
+    """
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.reset()
+
+    def reset(self):
+        with self.condition:
+            self.exchanges: dict[str, str] = {"": "direct"}
+            self.bindings: dict[str, list[tuple[str, str]]] = {"": []}
+            self.queues: dict[str, _MemoryQueue] = {}
+            self.responders: dict[tuple[str, str], Callable] = {}
+
+    def exchange_declare(self, exchange: str, exchange_type: str = "direct"):
+        with self.condition:
+            if exchange_type not in ("direct", "topic", "fanout"):
+                raise ValueError(f"Tipo de exchange não suportado em memória: {exchange_type!r}")
+            # Como no RabbitMQ, redeclarar com outro tipo mantém o exchange existente
+            self.exchanges.setdefault(exchange, exchange_type)
+            self.bindings.setdefault(exchange, [])
+
+    def queue_declare(self, queue: str, arguments: Optional[dict] = None):
+        with self.condition:
+            if queue not in self.queues:
+                self.queues[queue] = _MemoryQueue(queue, arguments)
+
+    def queue_bind(self, queue: str, exchange: str, routing_key: str):
+        with self.condition:
+            binding = (queue, routing_key)
+            if binding not in self.bindings[exchange]:
+                self.bindings[exchange].append(binding)
+
+    def respond(self, exchange: str, routing_key: str, handler: Callable):
+        """Registra `handler(requisição) -> resposta` para as chamadas RPC em exchange/routing_key."""
+        with self.condition:
+            self.responders[(exchange, routing_key)] = handler
+
+    def queue_purge(self, queue: str):
+        with self.condition:
+            purged = self.queues[queue]
+            count = len(purged.messages)
+            purged.messages.clear()
+            purged.nbytes = 0
+            return count
+
+    def _matches(self, exchange_type: str, binding_key: str, routing_key: str) -> bool:
+        if exchange_type == "fanout":
+            return True
+        if exchange_type == "direct":
+            return binding_key == routing_key
+        return _topic_matches(tuple(binding_key.split(".")), tuple(routing_key.split(".")))
+
+    def publish(self, exchange: str, routing_key: str, body) -> bool:
+        """Roteia a mensagem; False se nenhuma fila aceitou (sem rota ou reject-publish)."""
+        if isinstance(body, bytes):
+            body = body.decode()
+        with self.condition:
+            now = time.monotonic()
+            if exchange == "":
+                targets = [routing_key] if routing_key in self.queues else []
+            else:
+                exchange_type = self.exchanges[exchange]
+                targets = {queue for queue, key in self.bindings[exchange]
+                           if self._matches(exchange_type, key, routing_key)}
+            accepted = [self.queues[queue].put(_Message(body, routing_key), now) for queue in targets]
+            if any(accepted):
+                self.condition.notify_all()
+            return bool(accepted) and all(accepted)
+
+    def get(self, queue: str) -> Optional[_Message]:
+        with self.condition:
+            return self.queues[queue].get(time.monotonic())
+
+
+# Servidor padrão do processo
+server = MemoryServer()
+
+
+class MemoryBroker:
+    """
+    Substituto em memória do library.broker.Broker, com a mesma interface.
+
+    Suporta exchanges direct, topic e fanout, filas com TTL e tamanho máximo, acks
+    e reentrega (`recover`). Serve para suites unitárias que não precisam de um
+    RabbitMQ de verdade; escolha com create_broker(..., backend="memory") ou
+    BROKER_BACKEND=memory. Opções só de AMQP (ex.: envelope) são aceitas e ignoradas.
+    RPC (call/call_many) é respondido por quem se registrou em MemoryServer.respond.
+    """
+    def __init__(
+            self,
+            exchange: str,
+            routing_key: str,
+            queue: str,
+            host: str = 'localhost',
+            exchange_type: str = 'direct',
+            queue_args: Optional[dict] = None,
+            prefetch: int = 0,
+            ack_every: int = 100,
+            ack_interval_ms: float = 50,
+            server: MemoryServer = server,
+            **_ignored,
+    ):
+        self.exchange = exchange
+        self.routing_key = routing_key
+        self.queue = queue
+        self.host = host
+        self.exchange_type = exchange_type
+        self.queue_args = queue_args if queue_args else {}
+        self.prefetch = prefetch
+        self.ack_every = max(1, min(ack_every, prefetch)) if prefetch else 1
+        self.ack_interval = ack_interval_ms / 1000
+        self.server = server
+        self._unacked: list[_Message] = []
+        self._unacked_since = None
+        self.rpc_latency = LatencyHistogram()
+
+        server.exchange_declare(exchange, exchange_type)
+        server.queue_declare(queue, self.queue_args)
+        server.queue_bind(queue, exchange, routing_key)
+
+    def publish(self, message: str):
+        self.server.publish(self.exchange, self.routing_key, message)
+
+    def publish_many(self, messages, window: int = 1000) -> list[bool]:
+        return [self.server.publish(self.exchange, self.routing_key, message) for message in messages]
+
+    # --- RPC --------------------------------------------------------------
+    def call(self, payload, timeout: float = 5.0) -> str:
+        """
+        Envia `payload` ao responder registrado e devolve a resposta.
+
+        Raises:
+            TimeoutError: Se ninguém responde em exchange/routing_key.
+        """
+        reply = self.call_many([payload], timeout)[0]
+        if reply is None:
+            raise TimeoutError(f"Sem resposta em {timeout}s para a chamada em {self.exchange}/{self.routing_key}")
+        return reply
+
+    def call_many(self, payloads, timeout: float = 5.0) -> list[Optional[str]]:
+        """
+        Como Broker.call_many. Sem responder registrado as requisições vão para as filas
+        (como no RabbitMQ) e o resultado é None para cada uma, sem esperar o timeout.
+        """
+        with self.server.condition:
+            handler = self.server.responders.get((self.exchange, self.routing_key))
+        replies = []
+        for payload in payloads:
+            if handler is None:
+                self.server.publish(self.exchange, self.routing_key, payload)
+                replies.append(None)
+                continue
+            started = time.perf_counter()
+            reply = handler(payload.decode() if isinstance(payload, bytes) else payload)
+            self.rpc_latency.record(time.perf_counter() - started)
+            replies.append(reply.decode() if isinstance(reply, bytes) else reply)
+        return replies
+
+    def _delivered(self, message: _Message):
+        self._unacked.append(message)
+        if self._unacked_since is None:
+            self._unacked_since = time.monotonic()
+        if (len(self._unacked) >= self.ack_every
+                or time.monotonic() - self._unacked_since >= self.ack_interval):
+            self.flush_acks()
+
+    def flush_acks(self):
+        self._unacked.clear()
+        self._unacked_since = None
+
+    def recover(self):
+        """Devolve à fila as mensagens entregues e ainda não confirmadas (basic.recover)."""
+        with self.server.condition:
+            self.server.queues[self.queue].requeue(self._unacked)
+            self.server.condition.notify_all()
+        self._unacked = []
+        self._unacked_since = None
+
+    def consume(self, count: int, timeout: Optional[float] = None) -> list[str]:
+        """Consome até 'count' mensagens, esperando até `timeout` segundos pela chegada."""
+        messages = []
+        deadline = time.monotonic() + (timeout or 0)
+        with self.server.condition:
+            while len(messages) < count:
+                message = self.server.queues[self.queue].get(time.monotonic())
+                if message is not None:
+                    messages.append(message.body)
+                    self._delivered(message)
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.flush_acks()
+                self.server.condition.wait(remaining)
+        return messages
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush_acks()
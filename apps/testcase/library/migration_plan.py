@@ -0,0 +1,191 @@
+import datetime
+import statistics
+
+from rich.console import Console
+from rich.table import Table
+
+from library.migration_report import load_run_reports
+from library.migrator import connect
+
+# Vazão assumida quando não há nenhum relatório anterior para comparar
+DEFAULT_MB_PER_SECOND = 10.0
+
+
+def _table_stats(cursor, table, exclude_columns):
+    cursor.execute("""
+        SELECT c.reltuples::bigint,
+               pg_relation_size(c.oid),
+               pg_total_relation_size(c.oid)
+        FROM pg_class c
+        WHERE c.oid = %s::regclass;
+    """, (table,))
+    rows, heap_bytes, total_bytes = cursor.fetchone()
+    # reltuples = -1: tabela nunca analisada (PG 14+); a contagem fica desconhecida
+    rows_known = rows >= 0
+    rows = max(rows, 0)
+
+    # Fração da largura média da linha que fica para trás com exclude_columns
+    cursor.execute("""
+        SELECT attname, avg_width FROM pg_stats WHERE tablename = %s;
+    """, (table,))
+    widths = dict(cursor.fetchall())
+    full_width = sum(widths.values())
+    excluded_width = sum(width for column, width in widths.items() if column in exclude_columns)
+    kept = 1 - excluded_width / full_width if full_width else 1.0
+
+    return {
+        "rows": rows,
+        "rows_known": rows_known,
+        "heap_bytes": heap_bytes,
+        "total_bytes": total_bytes,
+        "avg_row_bytes": heap_bytes / rows if rows else 0,
+        "kept_fraction": kept,
+    }
+
+
+def _full_runs(reports):
+    """Execuções bem-sucedidas de cópia completa; as do modo delta copiam só a diferença e inflariam a vazão."""
+    return [run for run in reports if run.get("status") == "ok" and run.get("mode", "full") == "full"]
+
+
+def _history(reports, table):
+    """Vazões (linhas/s, MB/s), lote escolhido e tempo de rebuild das cópias completas da tabela."""
+    runs = [run["tables"][table] for run in _full_runs(reports)
+            if table in run.get("tables", {})
+            and run["tables"][table].get("rows_per_second")]
+    if not runs:
+        return None
+    rebuilds = [run["rebuild"]["seconds"] for run in runs if run.get("rebuild")]
+    return {
+        "runs": len(runs),
+        "rows_per_second": statistics.median(run["rows_per_second"] for run in runs),
+        "mb_per_second": statistics.median(run["mb_per_second"] for run in runs),
+        "batch_size": runs[-1].get("batching", {}).get("batch_size"),
+        "rebuild_seconds": statistics.median(rebuilds) if rebuilds else None,
+    }
+
+
+def _fallback_mb_per_second(reports):
+    """Mediana de MB/s de todas as tabelas já migradas, para tabelas sem histórico próprio."""
+    rates = [stats["mb_per_second"] for run in _full_runs(reports)
+             for stats in run.get("tables", {}).values() if stats.get("mb_per_second")]
+    return statistics.median(rates) if rates else DEFAULT_MB_PER_SECOND
+
+
+def plan_postgres_migration(source_pg, tables, exclude_columns=None, report_dir=".migration_reports",
+                            batch_size=1000, max_batch_bytes=16 * 1024 * 1024, transform_processes=0,
+                            defer_indexes=False, rebuild_workers=4, deadline=None, console=None):
+    """
+    Estima a migração sem tocar no destino (dry-run).
+
+    Lê `pg_class.reltuples` e `pg_total_relation_size` da origem e a vazão histórica das
+    cópias completas em `report_dir`, e imprime por tabela e no total: tempo estimado,
+    tamanho esperado no destino, paralelismo e particionamento em lotes. Tabela nunca
+    analisada (reltuples = -1) é estimada só pelo tamanho e marcada como "linhas ?".
+
+    Args:
+        deadline (str | datetime.time): Horário limite (ex.: "08:00"); avisa se a
+            migração, começando agora, terminaria depois dele.
+
+    Returns:
+        dict: {"tables": {...}, "total_seconds", "total_destiny_bytes", "finish_at"}
+    """
+    console = console or Console()
+    exclude_columns = exclude_columns or []
+    reports = load_run_reports(report_dir) if report_dir else []
+    fallback_rate = _fallback_mb_per_second(reports)
+
+    plan = {"tables": {}}
+    with connect(source_pg) as conn:
+        cur = conn.cursor()
+        for table in tables:
+            stats = _table_stats(cur, table, exclude_columns)
+            history = _history(reports, table)
+
+            megabytes = stats["heap_bytes"] * stats["kept_fraction"] / 1024 / 1024
+            if history and stats["rows_known"]:
+                seconds = stats["rows"] / history["rows_per_second"]
+                basis = f"histórico ({history['runs']} execuções)"
+            elif history:
+                seconds = megabytes / history["mb_per_second"]
+                basis = f"histórico ({history['runs']} execuções, por tamanho)"
+            else:
+                seconds = megabytes / fallback_rate
+                basis = f"{fallback_rate:.1f} MB/s"
+            if not stats["rows_known"]:
+                basis += "; sem ANALYZE, linhas desconhecidas"
+
+            row_bytes = stats["avg_row_bytes"] * stats["kept_fraction"]
+            planned_batch = (history or {}).get("batch_size") or batch_size
+            if row_bytes:
+                planned_batch = min(planned_batch, max(1, int(max_batch_bytes / row_bytes)))
+
+            rebuild_seconds = (history or {}).get("rebuild_seconds") if defer_indexes else None
+            plan["tables"][table] = {
+                **stats,
+                "estimated_seconds": seconds,
+                "basis": basis,
+                "batch_size": planned_batch,
+                "batches": -(-stats["rows"] // planned_batch) if stats["rows"] else (0 if stats["rows_known"] else None),
+                "destiny_bytes": int(stats["total_bytes"] * stats["kept_fraction"]),
+                "rebuild_seconds": rebuild_seconds,
+            }
+
+    # As tabelas são copiadas uma de cada vez; os rebuilds rodam em paralelo no final
+    rebuilds = sorted((t["rebuild_seconds"] or 0 for t in plan["tables"].values()), reverse=True)
+    rebuild_total = sum(rebuilds[::max(1, rebuild_workers)]) if rebuilds else 0
+    plan["total_seconds"] = sum(t["estimated_seconds"] for t in plan["tables"].values()) + rebuild_total
+    plan["total_destiny_bytes"] = sum(t["destiny_bytes"] for t in plan["tables"].values())
+    finish_at = datetime.datetime.now() + datetime.timedelta(seconds=plan["total_seconds"])
+    plan["finish_at"] = finish_at.isoformat(timespec="minutes")
+    plan["parallelism"] = {
+        "tables": 1,
+        "pipeline_stages": 3 if transform_processes else 2,
+        "transform_processes": transform_processes,
+        "rebuild_workers": rebuild_workers if defer_indexes else 0,
+    }
+
+    _print_plan(console, plan)
+
+    if deadline is not None:
+        if isinstance(deadline, str):
+            deadline = datetime.time.fromisoformat(deadline)
+        limit = datetime.datetime.combine(datetime.date.today(), deadline)
+        if limit < datetime.datetime.now():
+            limit += datetime.timedelta(days=1)
+        plan["fits_deadline"] = finish_at <= limit
+        if not plan["fits_deadline"]:
+            console.print(f"[bold red]Atenção: término previsto às {finish_at:%H:%M}, depois de {deadline:%H:%M}![/bold red]")
+
+    return plan
+
+
+def _print_plan(console, plan):
+    grid = Table(title="Plano de migração")
+    for column in ("tabela", "linhas", "origem", "destino", "lote", "lotes", "tempo", "base"):
+        grid.add_column(column, justify="left" if column in ("tabela", "base") else "right")
+
+    for table, item in plan["tables"].items():
+        grid.add_row(
+            table,
+            f"{item['rows']:,}" if item["rows_known"] else "?",
+            f"{item['total_bytes'] / 1024 / 1024:,.1f} MB",
+            f"{item['destiny_bytes'] / 1024 / 1024:,.1f} MB",
+            f"{item['batch_size']:,}",
+            f"{item['batches']:,}" if item["batches"] is not None else "?",
+            str(datetime.timedelta(seconds=int(item["estimated_seconds"]))),
+            item["basis"],
+        )
+    console.print(grid)
+
+    parallelism = plan["parallelism"]
+    console.print(
+        f"Paralelismo: {parallelism['tables']} tabela por vez, {parallelism['pipeline_stages']} estágios no pipeline"
+        + (f", {parallelism['transform_processes']} processos de transformação" if parallelism["transform_processes"] else "")
+        + (f", {parallelism['rebuild_workers']} conexões de rebuild" if parallelism["rebuild_workers"] else "")
+    )
+    console.print(
+        f"[bold]Total: {datetime.timedelta(seconds=int(plan['total_seconds']))}, "
+        f"{plan['total_destiny_bytes'] / 1024 / 1024:,.1f} MB no destino, "
+        f"término previsto {plan['finish_at'].replace('T', ' ')}[/bold]"
+    )
@@ -0,0 +1,181 @@
+import datetime
+import glob
+import json
+import os
+import time
+
+from rich.live import Live
+from rich.table import Table
+
+from library.histogram import LatencyHistogram
+
+
+class TableProgress:
+    """Contadores de uma tabela durante a migração."""
+    def __init__(self, name: str, estimated_rows: int = 0):
+        self.name = name
+        self.estimated_rows = max(0, int(estimated_rows or 0))
+        self.rows = 0
+        self.bytes = 0
+        self.batches = 0
+        self.active_workers = 0
+        self.status = "aguardando"
+        self.started_at = None
+        self.finished_at = None
+        self.latency = LatencyHistogram()
+
+    def start(self):
+        self.status = "copiando"
+        self.started_at = time.perf_counter()
+
+    def finish(self, status: str = "ok"):
+        self.status = status
+        self.finished_at = time.perf_counter()
+
+    def batch_done(self, rows: int, nbytes: int, seconds: float):
+        self.rows += rows
+        self.bytes += nbytes
+        self.batches += 1
+        self.latency.record(seconds)
+
+    @property
+    def elapsed(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.perf_counter()) - self.started_at
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def mb_per_second(self) -> float:
+        return self.bytes / 1024 / 1024 / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def eta(self):
+        """Segundos restantes pela estimativa de linhas (pg_class.reltuples), ou None se não dá para estimar."""
+        if self.finished_at is not None:
+            return 0.0
+        remaining = self.estimated_rows - self.rows
+        if remaining <= 0 or not self.rows_per_second:
+            return None
+        return remaining / self.rows_per_second
+
+    def to_dict(self) -> dict:
+        return {
+            "status": self.status,
+            "rows": self.rows,
+            "estimated_rows": self.estimated_rows,
+            "bytes": self.bytes,
+            "batches": self.batches,
+            "seconds": round(self.elapsed, 3),
+            "rows_per_second": round(self.rows_per_second, 1),
+            "mb_per_second": round(self.mb_per_second, 3),
+            "batch_latency": self.latency.to_dict(),
+        }
+
+
+def _format_seconds(seconds) -> str:
+    if seconds is None:
+        return "—"
+    seconds = int(seconds)
+    return f"{seconds // 3600:d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+class MigrationDashboard:
+    """
+    Painel `Live` do rich com o andamento de todas as tabelas.
+
+    Substitui o print por lote: o painel é redesenhado em taxa fixa (`refresh_per_second`)
+    independentemente de quantos lotes terminam, então tabelas de linhas pequenas não
+    gastam tempo escrevendo no terminal.
+    """
+    def __init__(self, console, refresh_per_second: float = 4):
+        self.console = console
+        self.refresh_per_second = refresh_per_second
+        self.tables: dict[str, TableProgress] = {}
+        self._live = None
+
+    def table(self, name: str, estimated_rows: int = 0) -> TableProgress:
+        if name not in self.tables:
+            self.tables[name] = TableProgress(name, estimated_rows)
+        return self.tables[name]
+
+    def render(self) -> Table:
+        grid = Table(title="Migração", expand=False)
+        for column in ("tabela", "status", "linhas", "linhas/s", "MB/s", "ETA", "p50 ms", "p95 ms", "p99 ms"):
+            grid.add_column(column, justify="left" if column in ("tabela", "status") else "right")
+
+        for progress in self.tables.values():
+            latency = progress.latency
+            grid.add_row(
+                progress.name,
+                progress.status,
+                f"{progress.rows:,}" + (f" / {progress.estimated_rows:,}" if progress.estimated_rows else ""),
+                f"{progress.rows_per_second:,.0f}",
+                f"{progress.mb_per_second:.2f}",
+                _format_seconds(progress.eta),
+                f"{latency.percentile(50) * 1000:.1f}",
+                f"{latency.percentile(95) * 1000:.1f}",
+                f"{latency.percentile(99) * 1000:.1f}",
+            )
+
+        workers = sum(progress.active_workers for progress in self.tables.values())
+        grid.caption = f"workers ativos: {workers}"
+        return grid
+
+    def __enter__(self):
+        # get_renderable faz o Live redesenhar a partir dos contadores, sem update() por lote
+        self._live = Live(get_renderable=self.render, console=self.console,
+                          refresh_per_second=self.refresh_per_second, transient=False)
+        self._live.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._live.__exit__(*exc_info)
+        self._live = None
+
+    def to_dict(self) -> dict:
+        return {name: progress.to_dict() for name, progress in self.tables.items()}
+
+
+# --- relatórios de execução ---------------------------------------------------
+
+def write_run_report(report: dict, report_dir: str = ".migration_reports") -> str:
+    """Grava o relatório como JSON em `report_dir/run-<timestamp>.json` e devolve o caminho."""
+    os.makedirs(report_dir, exist_ok=True)
+    # Microssegundos no nome: duas execuções no mesmo segundo não se sobrescrevem
+    stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+    path = os.path.join(report_dir, f"run-{stamp}.json")
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2, default=str)
+    return path
+
+
+def load_run_reports(report_dir: str = ".migration_reports") -> list[dict]:
+    """Relatórios anteriores, do mais antigo para o mais recente."""
+    reports = []
+    for path in sorted(glob.glob(os.path.join(report_dir, "run-*.json"))):
+        try:
+            with open(path) as f:
+                reports.append(json.load(f))
+        except (OSError, json.JSONDecodeError):
+            continue
+    return reports
+
+
+def print_trend(console, report: dict, previous: list[dict]):
+    """Compara linhas/s de cada tabela com a última execução que também a migrou."""
+    for table, stats in report.get("tables", {}).items():
+        before = next(
+            (run["tables"][table] for run in reversed(previous)
+             if table in run.get("tables", {}) and run["tables"][table].get("rows_per_second")),
+            None,
+        )
+        now = stats.get("rows_per_second")
+        if not before or not now:
+            continue
+        change = (now - before["rows_per_second"]) / before["rows_per_second"] * 100
+        colour = "green" if change >= 0 else "red"
+        console.print(f"[blue]{table}[/blue] → {now:,.0f} linhas/s ([{colour}]{change:+.1f}%[/{colour}] vs. execução anterior)")
@@ -0,0 +1,159 @@
+import asyncio
+import json
+import sys
+
+from rich.console import Console
+
+from library.migrator import connect, primary_key, source_columns, pk_ranges, range_predicate, range_digest
+
+
+def _row_expression(columns):
+    return f"ROW({', '.join(columns)})"
+
+
+def _split_point(cursor, table, pk, lo, hi, count):
+    """PK do meio do intervalo (a linha de posição count/2), ou None se não dá para dividir."""
+    where, params = range_predicate(pk, lo, hi)
+    cursor.execute(
+        f"SELECT {', '.join(pk)} FROM {table} WHERE {where} ORDER BY {', '.join(pk)} OFFSET %s LIMIT 1;",
+        params + [count // 2],
+    )
+    row = cursor.fetchone()
+    if row is None or tuple(row) == lo:
+        return None
+    return tuple(row)
+
+
+def _row_hashes(cursor, table, pk, lo, hi, expression):
+    where, params = range_predicate(pk, lo, hi)
+    cursor.execute(
+        f"SELECT {', '.join(pk)}, md5(({expression})::text) FROM {table} t WHERE {where};",
+        params,
+    )
+    return {tuple(row[:-1]): row[-1] for row in cursor.fetchall()}
+
+
+class _Worker:
+    """Par de conexões (origem, destino) usado por uma tarefa de verificação."""
+    def __init__(self, source_pg, destiny_pg):
+        self.src = connect(source_pg)
+        self.dest = connect(destiny_pg)
+        self.src.autocommit = True
+        self.dest.autocommit = True
+        self.src_cur = self.src.cursor()
+        self.dest_cur = self.dest.cursor()
+
+    def close(self):
+        self.src.close()
+        self.dest.close()
+
+
+async def _verify_table(loop, console, workers, table, pk, expression, chunks, leaf_rows):
+    ranges = await loop.run_in_executor(None, pk_ranges, workers[0].src_cur, table, pk, chunks)
+    result = {"ranges": len(ranges), "mismatched_ranges": 0, "missing": [], "extra": [], "different": []}
+
+    async def both(worker, fn, *args):
+        return await asyncio.gather(
+            loop.run_in_executor(None, fn, worker.src_cur, *args),
+            loop.run_in_executor(None, fn, worker.dest_cur, *args),
+        )
+
+    async def bisect(worker, lo, hi, src_count, dest_count):
+        # Intervalo pequeno o bastante: compara linha a linha
+        larger = max(src_count, dest_count)
+        side = worker.src_cur if src_count >= dest_count else worker.dest_cur
+        mid = None
+        if larger > leaf_rows:
+            mid = await loop.run_in_executor(None, _split_point, side, table, pk, lo, hi, larger)
+
+        if mid is None:
+            src_rows, dest_rows = await both(worker, _row_hashes, table, pk, lo, hi, expression)
+            result["missing"].extend(key for key in src_rows if key not in dest_rows)
+            result["extra"].extend(key for key in dest_rows if key not in src_rows)
+            result["different"].extend(
+                key for key, digest in src_rows.items() if key in dest_rows and dest_rows[key] != digest
+            )
+            return
+
+        for sub_lo, sub_hi in ((lo, mid), (mid, hi)):
+            (src_n, src_digest), (dest_n, dest_digest) = await both(
+                worker, range_digest, table, pk, sub_lo, sub_hi, expression)
+            if (src_n, src_digest) != (dest_n, dest_digest):
+                await bisect(worker, sub_lo, sub_hi, src_n, dest_n)
+
+    pending = asyncio.Queue()
+    for bounds in ranges:
+        pending.put_nowait(bounds)
+
+    async def run(worker):
+        while not pending.empty():
+            lo, hi = pending.get_nowait()
+            (src_n, src_digest), (dest_n, dest_digest) = await both(
+                worker, range_digest, table, pk, lo, hi, expression)
+            if (src_n, src_digest) != (dest_n, dest_digest):
+                result["mismatched_ranges"] += 1
+                await bisect(worker, lo, hi, src_n, dest_n)
+
+    await asyncio.gather(*(run(worker) for worker in workers))
+
+    result["ok"] = not (result["missing"] or result["extra"] or result["different"])
+    if result["ok"]:
+        console.print(f"[blue]{table}[/blue] → [green]OK[/green] ({len(ranges)} intervalos)")
+    else:
+        console.print(
+            f"[blue]{table}[/blue] → [red]divergente[/red]: {result['mismatched_ranges']}/{len(ranges)} intervalos, "
+            f"{len(result['missing'])} faltando, {len(result['extra'])} sobrando, "
+            f"{len(result['different'])} diferentes"
+        )
+    return result
+
+
+async def verify_postgres_tables_async(source_pg, destiny_pg, tables, chunks=64, leaf_rows=1000, workers=4,
+                                       exclude_columns=None):
+    """
+    Confere se origem e destino têm os mesmos dados, sem trazer as tabelas para o Python.
+
+    Cada tabela é dividida em `chunks` intervalos de PK; para cada intervalo os dois
+    servidores calculam, em paralelo e só em SQL, a contagem e um hash de linhas que não
+    depende da ordem. Os intervalos divergentes são divididos ao meio até terem no máximo
+    `leaf_rows` linhas, e só então as PKs e o md5 de cada linha são comparados.
+
+    Args:
+        exclude_columns (list): Colunas que ficam fora do hash (as mesmas excluídas na migração).
+        workers (int): Quantidade de pares de conexões verificando intervalos ao mesmo tempo.
+
+    Returns:
+        dict: {tabela: {"ok", "ranges", "mismatched_ranges", "missing", "extra", "different"}},
+        com as PKs faltando no destino, sobrando no destino e com conteúdo diferente.
+    """
+    console = Console()
+    loop = asyncio.get_event_loop()
+    exclude_columns = exclude_columns or []
+
+    pool = [await loop.run_in_executor(None, _Worker, source_pg, destiny_pg) for _ in range(max(1, workers))]
+    report = {}
+    try:
+        for table in tables:
+            cur = pool[0].src_cur
+            pk = primary_key(cur, table)
+            if not pk:
+                raise ValueError(f"Table '{table}' has no primary key in source database; verify needs one")
+            expression = _row_expression(source_columns(cur, table, exclude_columns))
+            report[table] = await _verify_table(loop, console, pool, table, pk, expression, chunks, leaf_rows)
+    finally:
+        for worker in pool:
+            worker.close()
+    return report
+
+
+# Exemplo de uso: python -m library.migration_verify config.json
+# config.json: {"source": {...}, "destiny": {...}, "tables": [...], "exclude_columns": [...]}
+if __name__ == "__main__":
+    with open(sys.argv[1]) as f:
+        config = json.load(f)
+
+    result = asyncio.run(verify_postgres_tables_async(
+        config["source"], config["destiny"], config["tables"],
+        exclude_columns=config.get("exclude_columns"),
+    ))
+    sys.exit(0 if all(table["ok"] for table in result.values()) else 1)
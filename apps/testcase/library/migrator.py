@@ -1,12 +1,1294 @@
+import abc
 import asyncio
+import datetime
+import hashlib
+import json
+import os
 import pdb
+import re
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
 
 import psycopg2
 import psycopg2.extras
 from rich.console import Console
 
+from library.migration_report import MigrationDashboard, load_run_reports, print_trend, write_run_report
+
+
+def connect(config):
+    return psycopg2.connect(
+        dbname=config["dbname"],
+        user=config["user"],
+        password=config["password"],
+        host=config["host"],
+        port=config.get("port", 5432)
+    )
+
+
+def table_exists(cursor, table_name):
+    cursor.execute("""
+        SELECT EXISTS (
+            SELECT FROM information_schema.tables
+            WHERE table_name = %s
+        );
+    """, (table_name,))
+    return cursor.fetchone()[0]
+
+
+def copy_table_schema(src_cursor, dest_cursor, table):
+    src_cursor.execute(f"""
+        SELECT column_name, data_type, is_nullable, character_maximum_length
+        FROM information_schema.columns
+        WHERE table_name = %s
+        ORDER BY ordinal_position;
+    """, (table,))
+    columns = src_cursor.fetchall()
+    if not columns:
+        raise ValueError(f"Table '{table}' does not exist in source database")
+
+    column_defs = []
+    for col in columns:
+        colname, datatype, nullable, char_len = col
+        if datatype == "character varying" and char_len:
+            datatype = f"VARCHAR({char_len})"
+        elif datatype == "character":
+            datatype = "CHAR"
+        elif datatype == "integer":
+            datatype = "INTEGER"
+        elif datatype == "timestamp without time zone":
+            datatype = "TIMESTAMP"
+
+        null_clause = "" if nullable == "YES" else "NOT NULL"
+        column_defs.append(f"{colname} {datatype} {null_clause}")
+
+    create_stmt = f"CREATE TABLE {table} (\n  {', '.join(column_defs)}\n);"
+    dest_cursor.execute(create_stmt)
+
+
+def source_columns(cursor, table, exclude_columns=()):
+    """Lista as colunas da tabela (na ordem física), sem as colunas excluídas."""
+    cursor.execute("""
+        SELECT column_name
+        FROM information_schema.columns
+        WHERE table_name = %s
+        ORDER BY ordinal_position;
+    """, (table,))
+    columns = [row[0] for row in cursor.fetchall()]
+    if not columns:
+        raise ValueError(f"Table '{table}' does not exist in source database")
+    return [col for col in columns if col not in exclude_columns]
+
+
+def primary_key(cursor, table):
+    """Retorna as colunas da chave primária da tabela, na ordem da constraint."""
+    cursor.execute("""
+        SELECT a.attname
+        FROM pg_index i
+        JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+        WHERE i.indrelid = %s::regclass AND i.indisprimary
+        ORDER BY array_position(i.indkey::int2[], a.attnum);
+    """, (table,))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def estimate_rows(cursor, table):
+    """Quantidade de linhas estimada pelo planner (pg_class.reltuples), sem varrer a tabela."""
+    cursor.execute("SELECT greatest(reltuples, 0)::bigint FROM pg_class WHERE oid = %s::regclass;", (table,))
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+# --- intervalos de chave primária ---------------------------------------
+# Um intervalo é um par (lo, hi) de tuplas com valores da PK, fechado embaixo
+# e aberto em cima. None em qualquer ponta significa "sem limite", de modo que
+# o primeiro e o último intervalo também cobrem chaves que só existem no destino.
+
+def pk_ranges(cursor, table, pk, chunks):
+    """Divide a tabela em até `chunks` intervalos de PK com quantidades parecidas de linhas."""
+    cols = ", ".join(pk)
+    cursor.execute(f"SELECT count(*) FROM {table};")
+    total = cursor.fetchone()[0]
+    step = max(1, -(-total // max(1, chunks)))
+
+    cursor.execute(f"""
+        SELECT {cols} FROM (
+            SELECT {cols}, row_number() OVER (ORDER BY {cols}) - 1 AS __rn FROM {table}
+        ) s
+        WHERE __rn %% %s = 0 AND __rn > 0
+        ORDER BY {cols};
+    """, (step,))
+    bounds = [tuple(row) for row in cursor.fetchall()]
+
+    edges = [None] + bounds + [None]
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def range_predicate(pk, lo, hi):
+    """Monta o WHERE (e os parâmetros) que seleciona as linhas do intervalo [lo, hi)."""
+    row = f"({', '.join(pk)})"
+    marks = f"({', '.join(['%s'] * len(pk))})"
+    clauses, params = [], []
+    if lo is not None:
+        clauses.append(f"{row} >= {marks}")
+        params.extend(lo)
+    if hi is not None:
+        clauses.append(f"{row} < {marks}")
+        params.extend(hi)
+    return (" AND ".join(clauses) or "TRUE"), params
+
+
+def range_digest(cursor, table, pk, lo, hi, expression=None):
+    """
+    Calcula (count, hash) do intervalo inteiramente no servidor.
+
+    O hash é a soma dos primeiros 64 bits do md5 de cada linha, portanto não
+    depende da ordem em que o banco devolve as linhas.
+    """
+    expression = expression or f"ROW({', '.join(pk)})"
+    where, params = range_predicate(pk, lo, hi)
+    cursor.execute(f"""
+        SELECT count(*),
+               coalesce(sum(('x' || substr(md5(({expression})::text), 1, 16))::bit(64)::bigint::numeric), 0)
+        FROM {table} t
+        WHERE {where};
+    """, params)
+    count, digest = cursor.fetchone()
+    return count, str(digest)
+
+
+def range_keys(cursor, table, pk, lo, hi):
+    """Lista as PKs presentes no intervalo."""
+    where, params = range_predicate(pk, lo, hi)
+    cursor.execute(f"SELECT {', '.join(pk)} FROM {table} WHERE {where};", params)
+    return {tuple(row) for row in cursor.fetchall()}
+
+
+# --- modo delta -----------------------------------------------------------
+
+def load_watermarks(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_watermarks(path, watermarks):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(watermarks, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _watermark_expression(column):
+    # xmin é o id da transação que gravou a versão da linha; funciona em qualquer
+    # tabela comum, mas dá a volta a cada 2^32 transações (ver _xmin_wrapped).
+    if column == "xmin":
+        return "xmin::text::bigint"
+    return column
+
+
+def _xmin_wrapped(cursor, watermark):
+    # xmax do snapshot = próximo xid; ao contrário de txid_current() não aloca xid, então
+    # funciona numa réplica (hot standby). txid_current_snapshot é o pg_current_snapshot de antes do 13
+    cursor.execute("SELECT mod(txid_snapshot_xmax(txid_current_snapshot()), 4294967296);")
+    return cursor.fetchone()[0] < watermark
+
+
+def _serialize_watermark(value):
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return value
+
+
+def _upsert_query(table, colnames, pk, rows="VALUES %s"):
+    updates = [f"{col} = EXCLUDED.{col}" for col in colnames if col not in pk]
+    conflict = f"ON CONFLICT ({', '.join(pk)}) DO " + ("UPDATE SET " + ", ".join(updates) if updates else "NOTHING")
+    return f"INSERT INTO {table} ({', '.join(colnames)}) {rows} {conflict}"
+
+
+# --- pipeline origem → destino --------------------------------------------
+
+class ByteBudgetQueue:
+    """
+    Fila assíncrona limitada pelo volume de bytes em memória, não pelo número de lotes.
+
+    O espaço de um lote só é devolvido com `release`, depois que o consumidor terminou
+    de gravá-lo; assim o teto cobre os lotes na fila e também o que está sendo escrito.
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        self._items = deque()
+        self._closed = False
+        self._waiters = []
+
+    def _wake(self):
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    async def _wait(self):
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        finally:
+            self._waiters.remove(waiter)
+
+    async def put(self, item, size):
+        # Um lote maior que o teto passa sozinho; do contrário a fila travaria para sempre
+        while self.used_bytes and self.used_bytes + size > self.max_bytes:
+            await self._wait()
+        self._items.append((item, size))
+        self.used_bytes += size
+        self._wake()
+
+    async def get(self):
+        """Retorna (item, size), ou None quando a fila foi fechada e esvaziada."""
+        while not self._items:
+            if self._closed:
+                return None
+            await self._wait()
+        return self._items.popleft()
+
+    def release(self, size):
+        self.used_bytes -= size
+        self._wake()
+
+    def close(self):
+        self._closed = True
+        self._wake()
+
+
+def batch_nbytes(rows):
+    """Estimativa barata do tamanho de um lote: texto e binário pelo comprimento, o resto como 8 bytes."""
+    total = 0
+    for row in rows:
+        for value in row:
+            if isinstance(value, (str, bytes, bytearray, memoryview)):
+                total += len(value)
+            elif value is not None:
+                total += 8
+    return total
+
+
+class AdaptiveBatchSizer:
+    """
+    Ajusta o tamanho do lote de uma tabela com AIMD (aumento aditivo, redução multiplicativa).
+
+    Cada lote observado informa linhas, bytes e segundos. Enquanto o lote fica abaixo de
+    `target_seconds` e o próximo caberia em `max_batch_bytes`, o tamanho cresce `increase`
+    linhas; quando passa de algum dos dois, é multiplicado por `decrease`.
+    Com min_size == max_size o tamanho fica fixo.
+    """
+    def __init__(self, initial, target_seconds=1.0, max_batch_bytes=16 * 1024 * 1024,
+                 min_size=50, max_size=200_000, increase=None, decrease=0.5):
+        self.initial = initial
+        self.size = max(min_size, min(max_size, initial))
+        self.target_seconds = target_seconds
+        self.max_batch_bytes = max_batch_bytes
+        self.min_size = min(min_size, self.size)
+        self.max_size = max(max_size, self.size)
+        self.increase = increase or initial
+        self.decrease = decrease
+        self.batches = 0
+        self.rows = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.largest = self.size
+        self.smallest = self.size
+
+    def observe(self, rows, nbytes, seconds):
+        if not rows:
+            return
+        self.batches += 1
+        self.rows += rows
+        self.bytes += nbytes
+        self.seconds += seconds
+
+        row_bytes = nbytes / rows
+        grown = self.size + self.increase
+        if seconds > self.target_seconds or row_bytes * self.size > self.max_batch_bytes:
+            self.size = max(self.min_size, int(self.size * self.decrease))
+        elif row_bytes * grown <= self.max_batch_bytes:
+            self.size = min(self.max_size, grown)
+
+        self.largest = max(self.largest, self.size)
+        self.smallest = min(self.smallest, self.size)
+
+    def report(self):
+        return {
+            "initial_batch_size": self.initial,
+            "batch_size": self.size,
+            "min_batch_size": self.smallest,
+            "max_batch_size": self.largest,
+            "batches": self.batches,
+            "rows": self.rows,
+            "bytes": self.bytes,
+            "avg_row_bytes": round(self.bytes / self.rows, 1) if self.rows else None,
+            "seconds": round(self.seconds, 3),
+        }
+
+
+async def _run_stages(*stages):
+    """Roda os estágios juntos; se um falhar, cancela os outros em vez de deixá-los presos na fila."""
+    tasks = [asyncio.ensure_future(stage) for stage in stages]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+@dataclass
+class _Batch:
+    columns: list
+    rows: list
+    fetch_seconds: float
+    watermark: object = None
+    oversized: list = None
+
+
+async def _pipelined_copy(loop, src_conn, cursor_name, query, params, columns, sizer, max_inflight_bytes,
+                          write_batch, transform=None, watermark_last=False, progress=None,
+                          oversized_last=False, on_snapshot=None):
+    """
+    Lê a consulta da origem em lotes enquanto `write_batch(batch)` grava o lote anterior.
+
+    O produtor busca o lote N+1 enquanto o consumidor grava o lote N; quando os lotes
+    pendentes passam de `max_inflight_bytes` o produtor espera (backpressure). O tamanho
+    de cada lote vem de `sizer`, que recebe o tempo da etapa mais lenta (leitura ou escrita).
+
+    Com `transform(columns, rows) -> (columns, rows)` um estágio intermediário transforma
+    o lote inteiro entre a leitura e a escrita. Com `watermark_last` a última coluna da
+    consulta é separada das linhas e vai em `batch.watermark` (valor do último registro).
+    Com `oversized_last` a última coluna restante (ver WideColumnPlan) vira `batch.oversized`,
+    uma lista de (índice da linha, colunas grandes demais que vieram vazias).
+    Com `on_snapshot` a leitura roda em REPEATABLE READ e o id do snapshot exportado
+    (pg_export_snapshot) é passado a ele antes da consulta, para outra conexão ler
+    exatamente os mesmos dados.
+    Cada lote gravado é contabilizado em `progress` (TableProgress do painel).
+    """
+    fetched = ByteBudgetQueue(max_inflight_bytes)
+    # Os bytes só são devolvidos a `fetched` depois da escrita, então `ready` não precisa de teto próprio
+    ready = ByteBudgetQueue(float("inf")) if transform else fetched
+
+    async def produce():
+        # Cursor nomeado: o servidor entrega a consulta aos poucos, sem OFFSET
+        src_cur = src_conn.cursor(name=cursor_name)
+        src_cur.itersize = sizer.size
+        try:
+            if on_snapshot:
+                await loop.run_in_executor(None, _export_snapshot, src_conn, on_snapshot)
+            await loop.run_in_executor(None, src_cur.execute, query, params)
+            while True:
+                started = time.perf_counter()
+                rows = await loop.run_in_executor(None, src_cur.fetchmany, sizer.size)
+                if not rows:
+                    break
+                batch = _Batch(list(columns), rows, time.perf_counter() - started)
+                if watermark_last:
+                    batch.watermark = batch.rows[-1][-1]
+                    batch.rows = [row[:-1] for row in batch.rows]
+                if oversized_last:
+                    batch.oversized = [(idx, row[-1]) for idx, row in enumerate(batch.rows) if row[-1]]
+                    batch.rows = [row[:-1] for row in batch.rows]
+                await fetched.put(batch, batch_nbytes(rows))
+        finally:
+            fetched.close()
+            src_cur.close()
+            src_conn.commit()
+
+    async def transform_stage():
+        try:
+            while True:
+                entry = await fetched.get()
+                if entry is None:
+                    return
+                batch, size = entry
+                batch.columns, batch.rows = await transform(batch.columns, batch.rows)
+                await ready.put(batch, size)
+        finally:
+            ready.close()
+
+    async def consume():
+        total = 0
+        while True:
+            entry = await ready.get()
+            if entry is None:
+                return total
+            batch, size = entry
+            started = time.perf_counter()
+            try:
+                await write_batch(batch)
+            finally:
+                fetched.release(size)
+                if ready is not fetched:
+                    ready.release(size)
+            write_seconds = time.perf_counter() - started
+            sizer.observe(len(batch.rows), size, max(batch.fetch_seconds, write_seconds))
+            if progress:
+                progress.batch_done(len(batch.rows), size, write_seconds)
+            total += len(batch.rows)
+
+    async def tracked(stage):
+        if progress:
+            progress.active_workers += 1
+        try:
+            return await stage
+        finally:
+            if progress:
+                progress.active_workers -= 1
+
+    stages = [produce(), transform_stage(), consume()] if transform else [produce(), consume()]
+    *_, total_copied = await _run_stages(*(tracked(stage) for stage in stages))
+    return total_copied
+
+
+def _export_snapshot(conn, on_snapshot):
+    """Abre uma transação REPEATABLE READ em `conn` e entrega o id do seu snapshot."""
+    conn.commit()  # SET TRANSACTION precisa ser o primeiro comando da transação
+    with conn.cursor() as cur:
+        cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ;")
+        cur.execute("SELECT pg_export_snapshot();")
+        on_snapshot(cur.fetchone()[0])
+
+
+# --- colunas largas (bytea, text, json) -----------------------------------
+
+# Tipos que podem ser lidos aos pedaços com substring() e o valor provisório gravado no lugar
+_STREAMABLE_TYPES = {
+    "bytea": "'\\x'::bytea",
+    "text": "''::text",
+    "character varying": "''::text",
+    "json": "'null'::json",
+    "jsonb": "'null'::jsonb",
+}
+
+
+def column_profile(cursor, table, columns):
+    """{coluna: (tipo, largura média em bytes segundo pg_stats)} para as colunas pedidas."""
+    cursor.execute("""
+        SELECT c.column_name, c.data_type, coalesce(s.avg_width, 8)
+        FROM information_schema.columns c
+        LEFT JOIN pg_stats s
+          ON s.schemaname = c.table_schema AND s.tablename = c.table_name
+         AND s.attname = c.column_name AND NOT s.inherited
+        WHERE c.table_name = %s;
+    """, (table,))
+    profile = {name: (data_type, width) for name, data_type, width in cursor.fetchall()}
+    return {column: profile.get(column, ("unknown", 8)) for column in columns}
+
+
+class WideColumnPlan:
+    """
+    Leitura com memória limitada para tabelas com colunas bytea/text/json grandes.
+
+    O SELECT principal troca cada valor maior que `oversize_bytes` por um valor provisório
+    (vazio) e informa, numa coluna extra, quais colunas vieram assim. Um lote com valores
+    desses é gravado primeiro numa tabela temporária; os valores são copiados da origem
+    em pedaços de `chunk_bytes` com substring(), montados nela com um UPDATE ... FROM por
+    coluna e o lote segue para o destino num único INSERT ... SELECT. Nenhum valor inteiro
+    passa pela memória do worker e o destino não precisa de índice na PK (que pode estar
+    adiada ou ainda não existir na staging). Os pedaços são lidos numa conexão própria
+    com a origem, já que a conexão principal está com o cursor nomeado do produtor aberto,
+    mas no snapshot exportado pelo produtor (use_snapshot): a linha é a mesma que o SELECT
+    principal viu, mesmo que tenha sido alterada ou apagada depois.
+    """
+    def __init__(self, columns, profile, pk, oversize_bytes, chunk_bytes, source_config=None):
+        self.columns = columns
+        self.pk = pk
+        self.pk_indexes = [columns.index(col) for col in pk]
+        self.oversize_bytes = oversize_bytes
+        self.chunk_bytes = chunk_bytes
+        self.source_config = source_config
+        self.types = {col: profile[col][0] for col in columns}
+        self.streamable = [col for col in columns if self.types[col] in _STREAMABLE_TYPES and col not in pk]
+        self._source_conn = None
+
+    @classmethod
+    def build(cls, profile, columns, pk, oversize_bytes, chunk_bytes, source_config=None):
+        """Plano para a tabela, ou None se não há colunas largas ou a PK não está entre as colunas lidas."""
+        if not pk or any(col not in columns for col in pk):
+            return None
+        plan = cls(columns, profile, pk, oversize_bytes, chunk_bytes, source_config)
+        return plan if plan.streamable else None
+
+    def _length(self, column):
+        cast = "" if self.types[column] in ("bytea", "text", "character varying") else "::text"
+        return f"octet_length({column}{cast})"
+
+    def select_list(self):
+        expressions = []
+        for column in self.columns:
+            if column in self.streamable:
+                expressions.append(
+                    f"CASE WHEN {self._length(column)} > {int(self.oversize_bytes)} "
+                    f"THEN {_STREAMABLE_TYPES[self.types[column]]} ELSE {column} END AS {column}"
+                )
+            else:
+                expressions.append(column)
+        flags = ", ".join(
+            f"CASE WHEN {self._length(column)} > {int(self.oversize_bytes)} THEN '{column}' END"
+            for column in self.streamable
+        )
+        expressions.append(f"array_remove(ARRAY[{flags}]::text[], NULL) AS __oversized")
+        return ", ".join(expressions)
+
+    def use_snapshot(self, snapshot_id):
+        """
+        Passa a ler no snapshot exportado pelo produtor (chamado antes da consulta dele).
+
+        A importação é feita já, enquanto a transação que exportou está aberta; a
+        transação da conexão própria fica aberta entre os lotes, presa a esse snapshot.
+        """
+        with self._source_cursor() as cur:
+            self._source_conn.rollback()
+            cur.execute("SET TRANSACTION SNAPSHOT %s;", (snapshot_id,))
+
+    def _source_cursor(self):
+        if self._source_conn is None:
+            self._source_conn = connect(self.source_config)
+            self._source_conn.set_session(isolation_level="REPEATABLE READ", readonly=True)
+        return self._source_conn.cursor()
+
+    def close(self):
+        if self._source_conn is not None:
+            self._source_conn.close()
+            self._source_conn = None
+
+    def stream_value(self, src_cur, dest_cur, table, column, key, row_number):
+        """Copia um valor grande em pedaços da origem para __migrator_chunks."""
+        binary = self.types[column] == "bytea"
+        # substring() em texto conta caracteres; com até 4 bytes por caractere o pedaço fica <= chunk_bytes
+        step = self.chunk_bytes if binary else max(1, self.chunk_bytes // 4)
+        source = column if self.types[column] in ("bytea", "text", "character varying") else f"{column}::text"
+        where = f"({', '.join(self.pk)}) = ({', '.join(['%s'] * len(self.pk))})"
+
+        number, offset = 0, 1
+        while True:
+            src_cur.execute(f"SELECT substring({source} from %s for %s) FROM {table} WHERE {where};",
+                            [offset, step] + list(key))
+            row = src_cur.fetchone()
+            chunk = row[0] if row else None
+            if not chunk:
+                if number == 0:
+                    # O valor provisório iria para o destino como se fosse o real
+                    raise RuntimeError(f"{table}.{column}: valor grande da chave {key} não foi encontrado na origem")
+                break
+            dest_cur.execute(f"INSERT INTO __migrator_chunks (r, col, n, {'b' if binary else 't'}) "
+                             f"VALUES (%s, %s, %s, %s);", (row_number, column, number, chunk))
+            number += 1
+            offset += step
+
+    def write_batch(self, dest_cur, table, target, batch, upsert_pk=None):
+        """
+        Grava um lote com valores grandes (ver a classe). Com `upsert_pk` o INSERT final
+        vira upsert, como no modo delta. O commit fica com quem chama.
+        """
+        columns = ", ".join(batch.columns)
+        dest_cur.execute(f"CREATE TEMP TABLE __migrator_rows ON COMMIT DROP AS "
+                         f"SELECT {columns} FROM {target} WITH NO DATA;")
+        dest_cur.execute("ALTER TABLE __migrator_rows ADD COLUMN __r int;")
+        dest_cur.execute("CREATE TEMP TABLE __migrator_chunks (r int, col text, n int, t text, b bytea) "
+                         "ON COMMIT DROP;")
+        psycopg2.extras.execute_values(dest_cur, f"INSERT INTO __migrator_rows ({columns}, __r) VALUES %s",
+                                       [tuple(row) + (idx,) for idx, row in enumerate(batch.rows)],
+                                       page_size=len(batch.rows))
+
+        streamed = set()
+        with self._source_cursor() as src_cur:
+            for idx, oversized in batch.oversized:
+                key = [batch.rows[idx][i] for i in self.pk_indexes]
+                for column in oversized:
+                    self.stream_value(src_cur, dest_cur, table, column, key, idx)
+                    streamed.add(column)
+
+        for column in streamed:
+            aggregate = ("string_agg(b, ''::bytea ORDER BY n)" if self.types[column] == "bytea"
+                         else f"string_agg(t, '' ORDER BY n)::{self.types[column]}")
+            dest_cur.execute(f"UPDATE __migrator_rows d SET {column} = c.v "
+                             f"FROM (SELECT r, {aggregate} AS v FROM __migrator_chunks WHERE col = %s GROUP BY r) c "
+                             f"WHERE d.__r = c.r;", (column,))
+
+        rows = f"SELECT {columns} FROM __migrator_rows ORDER BY __r"
+        if upsert_pk:
+            dest_cur.execute(_upsert_query(target, batch.columns, upsert_pk, rows=rows))
+        else:
+            dest_cur.execute(f"INSERT INTO {target} ({columns}) {rows};")
+
+
+def estimated_row_bytes(profile, wide_plan):
+    """Largura média da linha lida, contando no máximo `oversize_bytes` para as colunas transmitidas aos pedaços."""
+    total = 0
+    for column, (data_type, width) in profile.items():
+        if wide_plan and column in wide_plan.streamable:
+            width = min(width, wide_plan.oversize_bytes)
+        total += width
+    return max(1, total)
+
+
+# --- transformações de lote ------------------------------------------------
+# Uma transformação recebe (tabela, colunas, linhas) e devolve (colunas, linhas).
+# As classes abaixo são picklable, então também rodam no pool de processos.
+
+def apply_transforms(transforms, table, columns, rows):
+    for transform in transforms:
+        columns, rows = transform(table, columns, rows)
+    return columns, rows
+
+
+class RenameColumns:
+    """Renomeia colunas no destino: RenameColumns({"nome_antigo": "nome_novo"})."""
+    def __init__(self, mapping):
+        self.mapping = mapping
+
+    def __call__(self, table, columns, rows):
+        return [self.mapping.get(col, col) for col in columns], rows
+
+
+class _ColumnTransform(abc.ABC):
+    def __init__(self, columns):
+        self.columns = columns
+
+    @abc.abstractmethod
+    def convert(self, column, value):
+        """Novo valor da coluna; só é chamado para valores diferentes de NULL."""
+
+    def __call__(self, table, columns, rows):
+        targets = [(idx, col) for idx, col in enumerate(columns) if col in self.columns]
+        if not targets:
+            return columns, rows
+        converted = []
+        for row in rows:
+            row = list(row)
+            for idx, col in targets:
+                if row[idx] is not None:
+                    row[idx] = self.convert(col, row[idx])
+            converted.append(row)
+        return columns, converted
+
+
+class MaskColumns(_ColumnTransform):
+    """Troca o valor das colunas (exceto NULL) por `mask`."""
+    def __init__(self, columns, mask="***"):
+        super().__init__(columns)
+        self.mask = mask
+
+    def convert(self, column, value):
+        return self.mask
+
+
+class HashColumns(_ColumnTransform):
+    """Troca o valor das colunas pelo sha256 (hex) de `salt + valor`; útil para PII."""
+    def __init__(self, columns, salt=""):
+        super().__init__(columns)
+        self.salt = salt
+
+    def convert(self, column, value):
+        data = value if isinstance(value, bytes) else str(value).encode()
+        return hashlib.sha256(self.salt.encode() + data).hexdigest()
+
+
+class CoerceColumns(_ColumnTransform):
+    """Converte colunas com uma função por coluna: CoerceColumns({"valor": float})."""
+    def __init__(self, casts):
+        super().__init__(casts)
+        self.casts = casts
+
+    def convert(self, column, value):
+        return self.casts[column](value)
+
+
+def _table_transforms(transforms, table):
+    if isinstance(transforms, dict):
+        return transforms.get(table, [])
+    return transforms or []
+
+
+def _transform_runner(loop, transforms, table, executor):
+    """Estágio de transformação da tabela, ou None quando ela não tem transformações."""
+    if not transforms:
+        return None
+
+    async def transform(columns, rows):
+        return await loop.run_in_executor(executor, apply_transforms, transforms, table, columns, rows)
+
+    return transform
+
+
+async def _copy_table_full(loop, console, src_conn, dest_conn, table, columns, sizer, max_inflight_bytes,
+                           transform=None, progress=None, target=None, wide_plan=None):
+    dest_cur = dest_conn.cursor()
+    target = target or table
+
+    async def write_batch(batch):
+        if wide_plan and batch.oversized:
+            await loop.run_in_executor(None, wide_plan.write_batch, dest_cur, table, target, batch)
+        else:
+            placeholders = ','.join(['%s'] * len(batch.columns))
+            insert_query = f"INSERT INTO {target} ({', '.join(batch.columns)}) VALUES ({placeholders})"
+            await loop.run_in_executor(None, dest_cur.executemany, insert_query, batch.rows)
+        await loop.run_in_executor(None, dest_conn.commit)
+
+    # Projeção no servidor: colunas excluídas nem chegam a sair da origem
+    select_list = wide_plan.select_list() if wide_plan else ', '.join(columns)
+    query = f"SELECT {select_list} FROM {table};"
+    try:
+        return await _pipelined_copy(loop, src_conn, f"full_{table}", query, None, columns, sizer,
+                                     max_inflight_bytes, write_batch, transform, progress=progress,
+                                     oversized_last=bool(wide_plan),
+                                     on_snapshot=wide_plan.use_snapshot if wide_plan else None)
+    finally:
+        if wide_plan:
+            wide_plan.close()
+
+
+async def _copy_table_delta(loop, console, src_conn, dest_conn, table, columns, pk, sizer,
+                            watermark_column, watermarks, watermark_file, max_inflight_bytes, transform=None,
+                            progress=None, wide_plan=None):
+    expression = _watermark_expression(watermark_column)
+    watermark = watermarks.get(table)
+
+    if watermark is not None and watermark_column == "xmin":
+        with src_conn.cursor() as cur:
+            if _xmin_wrapped(cur, watermark):
+                console.print(f"[yellow]{table}: xmin deu a volta, refazendo o delta completo...[/yellow]")
+                watermark = None
+
+    # Linhas com a coluna NULL ficam fora da ordem da marca (o ORDER BY as põe no fim e
+    # a marca do lote viraria None); elas vão numa passada própria, só na carga inicial
+    where, params = f"WHERE {expression} IS NOT NULL", []
+    if watermark is not None:
+        # >=: linhas empatadas com a marca são relidas (o upsert é idempotente), senão um
+        # lote que caiu no meio de um empate perderia as linhas restantes para sempre
+        where, params = f"{where} AND {expression} >= %s", [watermark]
+
+    dest_cur = dest_conn.cursor()
+
+    async def write_batch(batch):
+        # As transformações podem renomear colunas, então a query sai das colunas do lote
+        if wide_plan and batch.oversized:
+            await loop.run_in_executor(None, wide_plan.write_batch, dest_cur, table, table, batch, pk)
+        else:
+            upsert_query = _upsert_query(table, batch.columns, pk)
+            await loop.run_in_executor(
+                None,
+                lambda: psycopg2.extras.execute_values(dest_cur, upsert_query, batch.rows, page_size=len(batch.rows)),
+            )
+        await loop.run_in_executor(None, dest_conn.commit)
+
+        # Só avança a marca depois do commit: se cair no meio, o próximo run repete o lote
+        if batch.watermark is not None:
+            watermarks[table] = _serialize_watermark(batch.watermark)
+            save_watermarks(watermark_file, watermarks)
+
+    select_list = wide_plan.select_list() if wide_plan else ', '.join(columns)
+    query = f"SELECT {select_list}, {expression} AS __watermark FROM {table} {where} ORDER BY {expression};"
+    try:
+        copied = await _pipelined_copy(loop, src_conn, f"delta_{table}", query, params, columns, sizer,
+                                       max_inflight_bytes, write_batch, transform, watermark_last=True,
+                                       progress=progress, oversized_last=bool(wide_plan),
+                                       on_snapshot=wide_plan.use_snapshot if wide_plan else None)
+        if watermark is None and watermark_column != "xmin":
+            # Mudanças futuras nessas linhas não aparecem na marca: só a carga inicial as copia
+            query = f"SELECT {select_list}, NULL AS __watermark FROM {table} WHERE {expression} IS NULL;"
+            nulls = await _pipelined_copy(loop, src_conn, f"delta_null_{table}", query, [], columns, sizer,
+                                          max_inflight_bytes, write_batch, transform, watermark_last=True,
+                                          progress=progress, oversized_last=bool(wide_plan),
+                                          on_snapshot=wide_plan.use_snapshot if wide_plan else None)
+            if nulls:
+                console.print(f"[yellow]{table}: {nulls} linhas com {watermark_column} NULL copiadas; "
+                              f"alterações nelas não entram nos próximos deltas[/yellow]")
+            copied += nulls
+        return copied
+    finally:
+        if wide_plan:
+            wide_plan.close()
+
+
+async def _remove_tombstones(loop, console, src_conn, dest_conn, table, pk, chunks):
+    """
+    Remove do destino as chaves que não existem mais na origem.
+
+    Compara o hash das PKs por intervalo nos dois servidores em paralelo e só
+    baixa as chaves dos intervalos que divergem.
+    """
+    src_cur = src_conn.cursor()
+    dest_cur = dest_conn.cursor()
+
+    ranges = await loop.run_in_executor(None, pk_ranges, src_cur, table, pk, chunks)
+
+    deleted = 0
+    for lo, hi in ranges:
+        src_digest, dest_digest = await asyncio.gather(
+            loop.run_in_executor(None, range_digest, src_cur, table, pk, lo, hi),
+            loop.run_in_executor(None, range_digest, dest_cur, table, pk, lo, hi),
+        )
+        if src_digest == dest_digest:
+            continue
+
+        src_keys, dest_keys = await asyncio.gather(
+            loop.run_in_executor(None, range_keys, src_cur, table, pk, lo, hi),
+            loop.run_in_executor(None, range_keys, dest_cur, table, pk, lo, hi),
+        )
+        missing = list(dest_keys - src_keys)
+        if not missing:
+            continue
+
+        delete_query = f"DELETE FROM {table} WHERE ({', '.join(pk)}) IN (VALUES %s)"
+        await loop.run_in_executor(
+            None,
+            lambda: psycopg2.extras.execute_values(dest_cur, delete_query, missing),
+        )
+        deleted += len(missing)
+
+    src_conn.commit()
+    await loop.run_in_executor(None, dest_conn.commit)
+    if deleted:
+        console.print(f"[blue]{table}[/blue] → Deleted [red]{deleted}[/red] tombstones")
+    return deleted
+
+
+# --- índices e constraints adiados ----------------------------------------
+
+def capture_deferrable_objects(cursor, table, keep_primary_key=False):
+    """
+    Captura as definições de índices e constraints (exceto FK) da tabela de destino.
+
+    Ficam de fora as constraints usadas por alguma FK (derrubá-las exigiria CASCADE)
+    e, com `keep_primary_key`, a PK, que o modo delta usa no ON CONFLICT.
+    """
+    cursor.execute("""
+        SELECT c.conname, pg_get_constraintdef(c.oid)
+        FROM pg_constraint c
+        WHERE c.conrelid = %s::regclass
+          AND c.contype IN ('p', 'u', 'c', 'x')
+          AND NOT (%s AND c.contype = 'p')
+          AND NOT EXISTS (
+              SELECT 1 FROM pg_constraint f WHERE f.contype = 'f' AND f.conindid = c.conindid AND c.conindid <> 0
+          )
+        ORDER BY c.contype = 'p' DESC, c.conname;
+    """, (table, keep_primary_key))
+    constraints = cursor.fetchall()
+
+    # Índices que sustentam constraints voltam junto com a constraint
+    cursor.execute("""
+        SELECT format('%%I.%%I', i.schemaname, i.indexname), i.indexdef
+        FROM pg_indexes i
+        WHERE format('%%I.%%I', i.schemaname, i.tablename)::regclass = %s::regclass
+          AND NOT EXISTS (
+              SELECT 1 FROM pg_constraint c
+              WHERE c.conindid = format('%%I.%%I', i.schemaname, i.indexname)::regclass
+          )
+        ORDER BY i.indexname;
+    """, (table,))
+    indexes = cursor.fetchall()
+
+    return {"constraints": constraints, "indexes": indexes}
+
+
+def drop_deferred_objects(cursor, table, deferred):
+    for name, _ in deferred["indexes"]:
+        cursor.execute(f"DROP INDEX {name};")
+    for name, _ in deferred["constraints"]:
+        cursor.execute(f"ALTER TABLE {table} DROP CONSTRAINT {_quote_ident(name)};")
+
+
+def _rebuild_table_objects(destiny_pg, table, deferred, maintenance_work_mem):
+    """Recria constraints e índices de uma tabela numa conexão própria; devolve (segundos, falhas)."""
+    failures = []
+    started = time.perf_counter()
+    conn = connect(destiny_pg)
+    try:
+        conn.autocommit = True
+        cur = conn.cursor()
+        cur.execute("SET maintenance_work_mem = %s;", (maintenance_work_mem,))
+
+        statements = [f"ALTER TABLE {table} ADD CONSTRAINT {_quote_ident(name)} {definition};"
+                      for name, definition in deferred["constraints"]]
+        statements += [f"{definition};" for _, definition in deferred["indexes"]]
+        for statement in statements:
+            try:
+                cur.execute(statement)
+            except psycopg2.Error as error:
+                failures.append((statement, str(error).strip()))
+    finally:
+        conn.close()
+    return time.perf_counter() - started, failures
+
+
+async def rebuild_deferred_objects(loop, console, destiny_pg, deferred_by_table, workers=4,
+                                   maintenance_work_mem="512MB"):
+    """
+    Recria em paralelo (uma conexão por tabela) tudo o que foi derrubado antes da carga.
+
+    Returns:
+        dict: {tabela: {"seconds": float, "failures": [(sql, erro), ...]}}
+    """
+    results = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            table: loop.run_in_executor(executor, _rebuild_table_objects, destiny_pg, table, deferred,
+                                        maintenance_work_mem)
+            for table, deferred in deferred_by_table.items()
+        }
+        for table, future in futures.items():
+            try:
+                seconds, failures = await future
+            except Exception as error:
+                seconds, failures = 0.0, [("<connect>", str(error))]
+            results[table] = {"seconds": round(seconds, 3), "failures": failures}
+
+            for statement, error in failures:
+                console.print(f"[red]{table}: falha ao recriar → {statement}\n  {error}[/red]")
+            if not failures:
+                console.print(f"[blue]{table}[/blue] → Índices e constraints recriados em {seconds:.2f}s")
+    return results
+
+
+# --- carga em tabela de staging UNLOGGED -----------------------------------
+
+_IDENT = r'"(?:[^"]|"")*"|[^."\s]+'
+_TABLE_NAME = re.compile(rf"^(?:(?P<schema>{_IDENT})\.)?(?P<name>{_IDENT})$")
+
+
+def _quote_ident(name):
+    """Cita um nome cru (como está no catálogo) uma única vez, como o quote_ident do Postgres."""
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _split_table(table):
+    """("schema" já citado ou None, nome cru) de "tabela", "schema.tabela" ou 'schema."Tabela"'."""
+    match = _TABLE_NAME.match(table.strip())
+    if not match:
+        raise ValueError(f"Nome de tabela inválido: {table!r}")
+    name = match["name"]
+    name = name[1:-1].replace('""', '"') if name.startswith('"') else name.lower()
+    return match["schema"], name
+
+
+def _qualified(schema, name):
+    return f"{schema}.{_quote_ident(name)}" if schema else _quote_ident(name)
+
+
+def _suffixed(name, suffix):
+    # Identificadores do Postgres têm no máximo 63 bytes
+    return name[:63 - len(suffix)] + suffix
+
+
+def staging_name(table):
+    schema, name = _split_table(table)
+    return _qualified(schema, _suffixed(name, "__staging"))
+
+
+_INDEX_DEF = re.compile(rf"^(CREATE (?:UNIQUE )?INDEX )(?:{_IDENT})( ON (?:ONLY )?)(?:(?:{_IDENT})\.)?(?:{_IDENT})( .*)$", re.S)
+
+
+def capture_table_objects(cursor, table):
+    """
+    Lê tudo o que a tabela de staging precisa herdar da tabela atual.
+
+    `LIKE ... INCLUDING DEFAULTS` já cobre colunas, defaults e NOT NULL; aqui ficam
+    constraints (inclusive FKs de saída), índices avulsos, FKs de outras tabelas
+    apontando para esta, sequences das colunas serial/identity e GRANTs. Nomes de
+    constraints, índices e colunas vêm crus, como estão no catálogo.
+    """
+    cursor.execute("""
+        SELECT c.conname, pg_get_constraintdef(c.oid), c.contype
+        FROM pg_constraint c
+        WHERE c.conrelid = %s::regclass AND c.contype IN ('p', 'u', 'c', 'x', 'f')
+        ORDER BY c.contype = 'p' DESC, c.contype = 'f', c.conname;
+    """, (table,))
+    constraints = cursor.fetchall()
+
+    cursor.execute("""
+        SELECT c.confrelid = c.conrelid, c.conrelid::regclass::text, c.conname, pg_get_constraintdef(c.oid)
+        FROM pg_constraint c
+        WHERE c.confrelid = %s::regclass AND c.contype = 'f';
+    """, (table,))
+    incoming = [row[1:] for row in cursor.fetchall() if not row[0]]
+
+    cursor.execute("""
+        SELECT i.indexname, i.indexdef
+        FROM pg_indexes i
+        WHERE format('%%I.%%I', i.schemaname, i.tablename)::regclass = %s::regclass
+          AND NOT EXISTS (
+              SELECT 1 FROM pg_constraint c
+              WHERE c.conindid = format('%%I.%%I', i.schemaname, i.indexname)::regclass
+          );
+    """, (table,))
+    indexes = cursor.fetchall()
+
+    cursor.execute("""
+        SELECT s.oid::regclass::text, a.attname, d.deptype
+        FROM pg_depend d
+        JOIN pg_class s ON s.oid = d.objid AND s.relkind = 'S'
+        JOIN pg_attribute a ON a.attrelid = d.refobjid AND a.attnum = d.refobjsubid
+        WHERE d.refobjid = %s::regclass AND d.deptype IN ('a', 'i');
+    """, (table,))
+    sequences = cursor.fetchall()
+
+    cursor.execute("""
+        SELECT g.grantee, g.privilege_type
+        FROM information_schema.role_table_grants g
+        JOIN pg_class t ON t.oid = %s::regclass
+        JOIN pg_namespace n ON n.oid = t.relnamespace
+        WHERE g.table_schema = n.nspname AND g.table_name = t.relname AND g.grantee <> current_user;
+    """, (table,))
+    grants = cursor.fetchall()
+
+    cursor.execute("""
+        SELECT DISTINCT v.oid::regclass::text
+        FROM pg_depend d
+        JOIN pg_rewrite r ON r.oid = d.objid
+        JOIN pg_class v ON v.oid = r.ev_class
+        WHERE d.refobjid = %s::regclass AND v.oid <> %s::regclass;
+    """, (table, table))
+    views = [row[0] for row in cursor.fetchall()]
+
+    return {"constraints": constraints, "incoming": incoming, "indexes": indexes,
+            "sequences": sequences, "grants": grants, "views": views}
+
+
+def prepare_staging_table(cursor, table):
+    """Cria a cópia UNLOGGED vazia (sem índices nem constraints) onde a carga vai acontecer."""
+    objects = capture_table_objects(cursor, table)
+    if objects["views"]:
+        raise ValueError(f"Table '{table}' is used by views ({', '.join(objects['views'])}); "
+                         f"the staging swap would drop them")
+
+    staging = staging_name(table)
+    cursor.execute(f"DROP TABLE IF EXISTS {staging};")
+    cursor.execute(f"CREATE UNLOGGED TABLE {staging} (LIKE {table} INCLUDING DEFAULTS INCLUDING IDENTITY "
+                   f"INCLUDING GENERATED INCLUDING STORAGE);")
+    for grantee, privilege in objects["grants"]:
+        grantee = grantee if grantee == "PUBLIC" else _quote_ident(grantee)
+        cursor.execute(f"GRANT {privilege} ON {staging} TO {grantee};")
+    return objects
+
+
+def staging_build_plan(table, objects):
+    """
+    Constraints e índices da tabela, renomeados e apontados para a staging (formato de rebuild_deferred_objects).
+
+    FKs ficam de fora: apontariam para tabelas que ainda vão ser trocadas (e o DROP ...
+    CASCADE da tabela antiga as derrubaria); elas são criadas depois de todas as trocas.
+    Índices cuja definição não dá para reapontar para a staging vão em "verbatim": o
+    pg_get_indexdef original é reexecutado depois da troca, já com o nome da tabela final.
+    """
+    staging = staging_name(table)
+    constraints = [(_suffixed(name, "__stg"), definition)
+                   for name, definition, contype in objects["constraints"] if contype != "f"]
+
+    indexes, verbatim = [], []
+    for name, definition in objects["indexes"]:
+        match = _INDEX_DEF.match(definition)
+        if not match:
+            verbatim.append(definition)
+            continue
+        create, on, rest = match.groups()
+        renamed = _quote_ident(_suffixed(name, "__stg"))
+        indexes.append((renamed, f"{create}{renamed}{on}{staging}{rest}"))
+    return {"constraints": constraints, "indexes": indexes, "verbatim": verbatim}
+
+
+def swap_staging_table(cursor, table, objects):
+    """
+    Troca a tabela atual pela staging (só renomeações; deve rodar na transação da troca).
+
+    A tabela antiga é removida com CASCADE, o que derruba as FKs que saíam dela e as de
+    outras tabelas apontando para ela; restore_foreign_keys as recria depois que todas
+    as tabelas foram trocadas.
+    """
+    schema, name = _split_table(table)
+    old = _suffixed(name, "__old")
+
+    # Sequences de colunas serial pertencem à tabela antiga e sumiriam com ela
+    for sequence, column, deptype in objects["sequences"]:
+        if deptype == "a":
+            cursor.execute(f"ALTER SEQUENCE {sequence} OWNED BY NONE;")
+
+    cursor.execute(f"ALTER TABLE {table} RENAME TO {_quote_ident(old)};")
+    cursor.execute(f"ALTER TABLE {staging_name(table)} RENAME TO {_quote_ident(name)};")
+    cursor.execute(f"DROP TABLE {_qualified(schema, old)} CASCADE;")
+
+    for constraint, _, contype in objects["constraints"]:
+        if contype != "f":
+            cursor.execute(f"ALTER TABLE {table} RENAME CONSTRAINT {_quote_ident(_suffixed(constraint, '__stg'))} "
+                           f"TO {_quote_ident(constraint)};")
+    for index, _ in objects["indexes"]:
+        cursor.execute(f"ALTER INDEX {_qualified(schema, _suffixed(index, '__stg'))} RENAME TO {_quote_ident(index)};")
+
+    for sequence, column, deptype in objects["sequences"]:
+        if deptype == "a":
+            cursor.execute(f"ALTER SEQUENCE {sequence} OWNED BY {table}.{_quote_ident(column)};")
+        else:
+            # Identity: a staging ganhou uma sequence nova, que precisa continuar de onde os dados param
+            column_sql = _quote_ident(column)
+            cursor.execute(f"SELECT setval(pg_get_serial_sequence(%s, %s), coalesce(max({column_sql}), 1), "
+                           f"max({column_sql}) IS NOT NULL) FROM {table};", (table, column))
+
+
+def restore_foreign_keys(cursor, staged):
+    """
+    Recria NOT VALID as FKs das tabelas trocadas e as que apontavam para elas.
+
+    Roda depois de todas as trocas, então a ordem das tabelas (e FKs entre tabelas em
+    staging) não importa. Devolve [(tabela, constraint)] a validar fora do lock.
+    """
+    cursor.execute("SELECT unnest(%s::regclass[])::text;", (list(staged),))
+    staged_names = {row[0] for row in cursor.fetchall()}
+
+    to_validate = []
+    for table, objects in staged.items():
+        for name, definition, contype in objects["constraints"]:
+            if contype == "f":
+                cursor.execute(f"ALTER TABLE {table} ADD CONSTRAINT {_quote_ident(name)} {definition} NOT VALID;")
+                to_validate.append((table, name))
+        for referencing, name, definition in objects["incoming"]:
+            # FKs entre tabelas em staging já entram acima, como FKs de saída
+            if referencing in staged_names:
+                continue
+            cursor.execute(f"ALTER TABLE {referencing} ADD CONSTRAINT {_quote_ident(name)} {definition} NOT VALID;")
+            to_validate.append((referencing, name))
+    return to_validate
+
+
+def drop_staging_table(cursor, table):
+    cursor.execute(f"DROP TABLE IF EXISTS {staging_name(table)};")
+
+
+async def _finish_staging(loop, console, dest_conn, destiny_pg, staged, set_logged, rebuild_workers,
+                          maintenance_work_mem, report):
+    """
+    Constrói índices/constraints nas stagings (em paralelo), opcionalmente SET LOGGED, e
+    troca todas as tabelas numa única transação curta.
+    """
+    plans = {staging_name(table): staging_build_plan(table, objects) for table, objects in staged.items()}
+    built = await rebuild_deferred_objects(loop, console, destiny_pg, plans, rebuild_workers, maintenance_work_mem)
+    failed = [staging for staging, result in built.items() if result["failures"]]
+    if failed:
+        raise RuntimeError(f"Falha ao criar índices/constraints em: {', '.join(failed)}")
+
+    dest_cur = dest_conn.cursor()
+    if set_logged:
+        for table in staged:
+            await loop.run_in_executor(None, dest_cur.execute, f"ALTER TABLE {staging_name(table)} SET LOGGED;")
+            await loop.run_in_executor(None, dest_conn.commit)
+    else:
+        console.print(f"[bold red]ATENÇÃO: {', '.join(staged)} continuam UNLOGGED depois da troca. "
+                      f"Um crash do Postgres TRUNCA essas tabelas e nada vai para as réplicas; "
+                      f"use set_logged=True ou rode ALTER TABLE ... SET LOGGED.[/bold red]")
+
+    def swap():
+        # Leitores continuam vendo os dados antigos até o COMMIT
+        try:
+            for table in sorted(staged):
+                dest_cur.execute(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE;")
+            for table, objects in staged.items():
+                swap_staging_table(dest_cur, table, objects)
+            to_validate = restore_foreign_keys(dest_cur, staged)
+            dest_conn.commit()
+        except Exception:
+            dest_conn.rollback()
+            raise
+        return to_validate
+
+    started = time.perf_counter()
+    to_validate = await loop.run_in_executor(None, swap)
+    swap_seconds = round(time.perf_counter() - started, 3)
+
+    # Índices que staging_build_plan não soube reapontar: recriados como eram, já na tabela final
+    for plan in plans.values():
+        for definition in plan["verbatim"]:
+            console.print(f"[yellow]Recriando depois da troca: {definition}[/yellow]")
+            await loop.run_in_executor(None, dest_cur.execute, f"{definition};")
+            await loop.run_in_executor(None, dest_conn.commit)
+
+    for referencing, name in to_validate:
+        await loop.run_in_executor(None, dest_cur.execute,
+                                   f"ALTER TABLE {referencing} VALIDATE CONSTRAINT {_quote_ident(name)};")
+        await loop.run_in_executor(None, dest_conn.commit)
+
+    for table in staged:
+        report["tables"].setdefault(table, {})["staging"] = {
+            "build_seconds": built[staging_name(table)]["seconds"],
+            "swap_seconds": swap_seconds,
+            "validated_foreign_keys": sum(1 for referencing, _ in to_validate if referencing == table),
+            "replayed_indexes": len(plans[staging_name(table)]["verbatim"]),
+            "logged": set_logged,
+        }
+        console.print(f"[blue]{table}[/blue] → staging trocada pela tabela atual")
+
+
 async def migrate_postgres_tables_async(source_pg, destiny_pg, tables, batch_size=1000, truncate_before=False,
-                                        exclude_columns=None, sql_pre_commit = None, sql_pos_commit = None):
+                                        exclude_columns=None, sql_pre_commit = None, sql_pos_commit = None,
+                                        mode="full", watermark_column="updated_at",
+                                        watermark_file=".migration_watermarks.json",
+                                        detect_deletes=False, tombstone_chunks=64,
+                                        max_inflight_bytes=64 * 1024 * 1024,
+                                        adaptive_batch=True, target_batch_seconds=1.0,
+                                        max_batch_bytes=16 * 1024 * 1024,
+                                        defer_indexes=False, rebuild_workers=4, maintenance_work_mem="512MB",
+                                        transforms=None, transform_processes=0,
+                                        report_dir=".migration_reports", refresh_per_second=4,
+                                        staging=False, set_logged=False,
+                                        worker_byte_budget=256 * 1024 * 1024,
+                                        oversize_value_bytes=8 * 1024 * 1024,
+                                        stream_chunk_bytes=256 * 1024):
+    """
+    Copia as tabelas da origem para o destino.
+
+    Args:
+        mode (str): "full" copia tudo; "delta" copia só as linhas acima da marca
+            d'água salva em `watermark_file` e aplica com INSERT ... ON CONFLICT;
+            "plan" só estima tempo e tamanho (ver migration_plan) e devolve o plano.
+        watermark_column (str | dict): Coluna usada como marca d'água ("xmin" para
+            usar o id de transação da linha). Aceita um dict {tabela: coluna}.
+        detect_deletes (bool): No modo delta, remove do destino as chaves que
+            sumiram da origem, comparando o hash das PKs em `tombstone_chunks` intervalos.
+        max_inflight_bytes (int): Teto de memória dos lotes lidos e ainda não gravados;
+            a leitura do próximo lote acontece enquanto o anterior é gravado.
+        adaptive_batch (bool): Ajusta o lote por tabela (AIMD) a partir de `batch_size`,
+            mirando `target_batch_seconds` por lote sem passar de `max_batch_bytes`.
+        defer_indexes (bool): Derruba índices e constraints (exceto FK) do destino antes
+            da carga e os recria depois, mesmo se a carga falhar, em `rebuild_workers`
+            conexões paralelas com `maintenance_work_mem` ajustado.
+        exclude_columns (list): Colunas que ficam fora do SELECT na origem.
+        transforms (list | dict): Transformações aplicadas a cada lote inteiro antes da
+            escrita (ver RenameColumns, MaskColumns, HashColumns, CoerceColumns); um dict
+            {tabela: [...]} define transformações por tabela.
+        transform_processes (int): Se > 0, as transformações rodam num pool de processos
+            (precisam ser picklable); senão rodam numa thread.
+        report_dir (str): Onde gravar o relatório JSON da execução (None para não gravar);
+            os relatórios anteriores da pasta servem de comparação no final.
+        refresh_per_second (float): Taxa de atualização do painel de andamento.
+        staging (bool): No modo "full", carrega numa cópia UNLOGGED de cada tabela
+            (sem WAL durante a carga), cria os índices nela e troca pela tabela atual com
+            renomeações numa transação curta; leitores veem os dados antigos até a troca.
+            Triggers, policies e comentários da tabela antiga não são copiados.
+        set_logged (bool): Roda ALTER TABLE ... SET LOGGED na staging antes da troca. Sem
+            ele a tabela final fica UNLOGGED (truncada num crash, fora das réplicas) e a
+            migração avisa isso no console.
+        worker_byte_budget (int): Teto de memória por tabela em cópia; lote e bytes em voo
+            são limitados a partir da largura média das colunas (pg_stats), então tabelas
+            de linhas largas passam a usar lotes pequenos automaticamente.
+        oversize_value_bytes (int): Valores bytea/text/json maiores que isso não vêm no
+            lote: são copiados depois, em pedaços de `stream_chunk_bytes` via substring().
+            Exige PK entre as colunas copiadas e fica desligado quando há `transforms`,
+            para que valores mascarados nunca sejam gravados crus.
+
+    Returns:
+        dict: Relatório da execução: vazão, latência dos lotes e tamanho de lote escolhido
+        para cada tabela.
+    """
     if exclude_columns is None:
       exclude_columns = []
 
@@ -15,131 +1297,195 @@ async def migrate_postgres_tables_async(source_pg, destiny_pg, tables, batch_siz
 
     if sql_pos_commit is None:
         sql_pos_commit = []
+
+    if mode not in ("full", "delta", "plan"):
+        raise ValueError(f"Modo de migração inválido: {mode!r}")
+    if staging and mode != "full":
+        raise ValueError("staging só funciona no modo 'full'")
+    if truncate_before and mode == "delta":
+        raise ValueError("truncate_before não combina com o modo 'delta' (apagaria o que as marcas d'água já copiaram)")
     console = Console()
 
+    if mode == "plan":
+        from library.migration_plan import plan_postgres_migration
+        return plan_postgres_migration(source_pg, tables, exclude_columns, report_dir, batch_size, max_batch_bytes,
+                                       transform_processes, defer_indexes, rebuild_workers, console=console)
+
     if destiny_pg["host"] != "localhost":
         raise Exception("opa meu patrão, acho que você trocou os parâmetros ein?!")
 
-    def connect(config):
-        return psycopg2.connect(
-            dbname=config["dbname"],
-            user=config["user"],
-            password=config["password"],
-            host=config["host"],
-            port=config.get("port", 5432)
-        )
+    loop = asyncio.get_event_loop()
+    report = {
+        "mode": mode,
+        "started_at": datetime.datetime.now().isoformat(),
+        "source": {"host": source_pg["host"], "dbname": source_pg["dbname"]},
+        "destiny": {"host": destiny_pg["host"], "dbname": destiny_pg["dbname"]},
+        "tables": {},
+    }
 
-    def table_exists(cursor, table_name):
-        cursor.execute("""
-            SELECT EXISTS (
-                SELECT FROM information_schema.tables
-                WHERE table_name = %s
-            );
-        """, (table_name,))
-        return cursor.fetchone()[0]
-
-    def copy_table_schema(src_cursor, dest_cursor, table):
-        src_cursor.execute(f"""
-            SELECT column_name, data_type, is_nullable, character_maximum_length
-            FROM information_schema.columns
-            WHERE table_name = %s
-            ORDER BY ordinal_position;
-        """, (table,))
-        columns = src_cursor.fetchall()
-        if not columns:
-            raise ValueError(f"Table '{table}' does not exist in source database")
-
-        column_defs = []
-        for col in columns:
-            colname, datatype, nullable, char_len = col
-            if datatype == "character varying" and char_len:
-                datatype = f"VARCHAR({char_len})"
-            elif datatype == "character":
-                datatype = "CHAR"
-            elif datatype == "integer":
-                datatype = "INTEGER"
-            elif datatype == "timestamp without time zone":
-                datatype = "TIMESTAMP"
-
-            null_clause = "" if nullable == "YES" else "NOT NULL"
-            column_defs.append(f"{colname} {datatype} {null_clause}")
-
-        create_stmt = f"CREATE TABLE {table} (\n  {', '.join(column_defs)}\n);"
-        dest_cursor.execute(create_stmt)
+    def plan_table(table, colnames, pk):
+        """(sizer, bytes em voo, WideColumnPlan | None) respeitando `worker_byte_budget`."""
+        profile = column_profile(src_cur, table, colnames)
+        src_conn.commit()
+        wide_plan = None
+        if not _table_transforms(transforms, table):
+            wide_plan = WideColumnPlan.build(profile, colnames, pk, oversize_value_bytes, stream_chunk_bytes,
+                                             source_pg)
 
-    loop = asyncio.get_event_loop()
+        # Metade do orçamento para o lote sendo lido, a outra metade para os que esperam gravação
+        batch_bytes = min(max_batch_bytes, worker_byte_budget // 2)
+        inflight = min(max_inflight_bytes, worker_byte_budget)
+        initial = max(1, min(batch_size, batch_bytes // estimated_row_bytes(profile, wide_plan)))
+        if initial < batch_size:
+            console.print(f"[yellow]{table}: linhas largas, lote inicial {initial}[/yellow]")
+        if wide_plan:
+            console.print(f"[yellow]{table}: valores acima de {oversize_value_bytes // 1024} KB em "
+                          f"{', '.join(wide_plan.streamable)} serão copiados em pedaços[/yellow]")
 
-    with connect(source_pg) as src_conn, connect(destiny_pg) as dest_conn:
-        src_cur = src_conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        dest_cur = dest_conn.cursor()
+        if not adaptive_batch:
+            sizer = AdaptiveBatchSizer(initial, min_size=initial, max_size=initial)
+        else:
+            sizer = AdaptiveBatchSizer(initial, target_seconds=target_batch_seconds, max_batch_bytes=batch_bytes,
+                                       min_size=min(50, initial))
+        return sizer, inflight, wide_plan
 
-        dest_cur.execute("SET session_replication_role = 'replica';")
-        dest_conn.commit()
+    previous_reports = load_run_reports(report_dir) if report_dir else []
+    dashboard = MigrationDashboard(console, refresh_per_second)
+    status = "failed"
+    try:
+        with dashboard, connect(source_pg) as src_conn, connect(destiny_pg) as dest_conn:
+            src_cur = src_conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+            dest_cur = dest_conn.cursor()
 
-        for sql_stmt in sql_pre_commit:
-            dest_cur.execute(sql_stmt)
+            dest_cur.execute("SET session_replication_role = 'replica';")
             dest_conn.commit()
 
-
-        for table in tables:
-            if not table_exists(dest_cur, table):
-                console.print(f"[blue]Tabela {table} não existe. Criando no banco de destino...[/blue]")
-                copy_table_schema(src_cur, dest_cur, table)
+            for sql_stmt in sql_pre_commit:
+                dest_cur.execute(sql_stmt)
                 dest_conn.commit()
 
-        if truncate_before:
+
             for table in tables:
-                if table_exists(dest_cur, table):
-                    console.print(f"[yellow]Truncating {table}...[/yellow]")
-                    dest_cur.execute(f"TRUNCATE TABLE {table} CASCADE;")
-            dest_conn.commit()
+                if not table_exists(dest_cur, table):
+                    console.print(f"[blue]Tabela {table} não existe. Criando no banco de destino...[/blue]")
+                    copy_table_schema(src_cur, dest_cur, table)
+                    dest_conn.commit()
 
-        for table in tables:
-            offset = 0
-            total_copied = 0
-            while True:
-                src_cur.execute(f"SELECT * FROM {table} OFFSET %s LIMIT %s;", (offset, batch_size))
+            if truncate_before and not staging:
+                for table in tables:
+                    if table_exists(dest_cur, table):
+                        console.print(f"[yellow]Truncating {table}...[/yellow]")
+                        dest_cur.execute(f"TRUNCATE TABLE {table} CASCADE;")
+                dest_conn.commit()
 
+            staged = {}
+            if staging:
+                for table in tables:
+                    staged[table] = prepare_staging_table(dest_cur, table)
+                dest_conn.commit()
 
-                rows = src_cur.fetchall()
-                if not rows:
-                    break
+            deferred = {}
+            if defer_indexes and not staging:
+                for table in tables:
+                    deferred[table] = capture_deferrable_objects(dest_cur, table, keep_primary_key=(mode == "delta"))
+                    drop_deferred_objects(dest_cur, table, deferred[table])
+                    console.print(f"[yellow]{table}: {len(deferred[table]['indexes'])} índices e "
+                                  f"{len(deferred[table]['constraints'])} constraints adiados[/yellow]")
+                dest_conn.commit()
 
-                # 1. identificar a posição de onde quero remover
+            if mode == "full":
+                for table in tables:
+                    dashboard.table(table, estimate_rows(src_cur, table))
+                src_conn.commit()
 
+            transform_executor = ProcessPoolExecutor(transform_processes) if transform_processes else None
+            load_failed = True
+            try:
+                if mode == "delta":
+                    watermarks = load_watermarks(watermark_file)
+                    for table in tables:
+                        pk = primary_key(dest_cur, table)
+                        if not pk:
+                            raise ValueError(f"Table '{table}' has no primary key in destination database; delta mode needs one")
 
-                colnames = []
-                idx_to_be_removed = []
-                for idx, desc in enumerate(src_cur.description):
-                    if desc[0] not in exclude_columns:
-                        colnames.append(desc[0])
-                        continue
+                        column = watermark_column.get(table, "updated_at") if isinstance(watermark_column, dict) else watermark_column
+                        colnames = source_columns(src_cur, table, exclude_columns)
+                        src_conn.commit()
 
-                    idx_to_be_removed.append(idx)
+                        sizer, inflight, wide_plan = plan_table(table, colnames, pk)
+                        transform = _transform_runner(loop, _table_transforms(transforms, table), table,
+                                                      transform_executor)
+                        progress = dashboard.table(table)
+                        progress.start()
+                        await _copy_table_delta(loop, console, src_conn, dest_conn, table, colnames, pk, sizer,
+                                                column, watermarks, watermark_file, inflight, transform,
+                                                progress, wide_plan)
+                        progress.finish()
+                        report["tables"].setdefault(table, {})["batching"] = sizer.report()
+                        if detect_deletes:
+                            report["tables"][table]["deleted"] = await _remove_tombstones(
+                                loop, console, src_conn, dest_conn, table, pk, tombstone_chunks)
 
-                for row in rows:
-                    for idx in idx_to_be_removed:
-                        del row[idx]
+                else:
+                    for table in tables:
+                        colnames = source_columns(src_cur, table, exclude_columns)
+                        pk = primary_key(src_cur, table)
+                        src_conn.commit()
 
-                placeholders = ','.join(['%s'] * len(colnames))
-                insert_query = f"INSERT INTO {table} ({', '.join(colnames)}) VALUES ({placeholders})"
+                        sizer, inflight, wide_plan = plan_table(table, colnames, pk)
+                        transform = _transform_runner(loop, _table_transforms(transforms, table), table,
+                                                      transform_executor)
+                        progress = dashboard.table(table)
+                        progress.start()
+                        await _copy_table_full(loop, console, src_conn, dest_conn, table, colnames, sizer,
+                                               inflight, transform, progress,
+                                               target=staging_name(table) if staging else None,
+                                               wide_plan=wide_plan)
+                        progress.finish()
+                        report["tables"].setdefault(table, {})["batching"] = sizer.report()
 
-                try:
-                    await loop.run_in_executor(None, dest_cur.executemany, insert_query, rows)
-                    await loop.run_in_executor(None, dest_conn.commit)
-                except Exception as error:
-                    query = dest_cur.mogrify(insert_query, row).decode('utf-8')
-                    raise error
+                    if staged:
+                        await _finish_staging(loop, console, dest_conn, destiny_pg, staged, set_logged,
+                                              rebuild_workers, maintenance_work_mem, report)
+                load_failed = False
+            finally:
+                if transform_executor:
+                    transform_executor.shutdown(cancel_futures=True)
+                if staged and load_failed:
+                    dest_conn.rollback()
+                    for table in staged:
+                        drop_staging_table(dest_cur, table)
+                    dest_conn.commit()
+                if deferred:
+                    if load_failed:
+                        # Solta os locks da transação abortada, senão os ALTER TABLE das outras conexões esperam para sempre
+                        dest_conn.rollback()
+                    rebuilt = await rebuild_deferred_objects(loop, console, destiny_pg, deferred, rebuild_workers,
+                                                             maintenance_work_mem)
+                    for table, result in rebuilt.items():
+                        report["tables"].setdefault(table, {})["rebuild"] = result
+                    failed = [table for table, result in rebuilt.items() if result["failures"]]
+                    if failed and not load_failed:
+                        raise RuntimeError(f"Falha ao recriar índices/constraints de: {', '.join(failed)}")
 
-                offset += batch_size
-                total_copied += len(rows)
-                console.print(f"[blue]{table}[/blue] → Copied [green]{total_copied}[/green] rows...")
+            for sql_stmt in sql_pos_commit:
+                dest_cur.execute(sql_stmt)
+                dest_conn.commit()
 
-        for sql_stmt in sql_pos_commit:
-            dest_cur.execute(sql_stmt)
+            dest_cur.execute("SET session_replication_role = 'origin';")
             dest_conn.commit()
-
-        dest_cur.execute("SET session_replication_role = 'origin';")
-        dest_conn.commit()
+        status = "ok"
+    finally:
+        for table, progress in dashboard.tables.items():
+            if progress.started_at is not None and progress.finished_at is None:
+                progress.finish("interrompida")
+            report["tables"].setdefault(table, {}).update(progress.to_dict())
+        report["status"] = status
+        report["finished_at"] = datetime.datetime.now().isoformat()
+        report_path = write_run_report(report, report_dir) if report_dir else None
 
     console.print("[bold green]Migration completed successfully![/bold green]")
+    print_trend(console, report, previous_reports)
+    if report_path:
+        console.print(f"[dim]Relatório da execução: {report_path}[/dim]")
+    return report
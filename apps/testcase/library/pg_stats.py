@@ -0,0 +1,169 @@
+import asyncio
+import json
+import re
+from functools import lru_cache
+from typing import Optional
+
+from rich.console import Console
+from rich.live import Live
+from rich.table import Table
+
+from library.handler import PgQueryEvent, PostgresFacade
+from library.histogram import LatencyHistogram
+
+_TOKEN = re.compile(r"""
+      (?P<comment>--[^\n]*|/\*.*?\*/)
+    | (?P<dollar>\$(?P<tag>(?:[A-Za-z_]\w*)?)\$.*?\$(?P=tag)\$)
+    | (?P<string>(?<![\w"])(?:[Ee]'(?:[^'\\]|\\.|'')*'|[BbXxNn]?'(?:[^']|'')*'))
+    | (?P<ident>"(?:[^"]|"")*"|[A-Za-z_][\w$]*)
+    | (?P<param>\$\d+)
+    | (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+    | (?P<space>\s+)
+""", re.S | re.X)
+_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+
+
+def _token(match: re.Match) -> str:
+    kind = match.lastgroup if match.lastgroup != "tag" else "dollar"
+    if kind in ("dollar", "string", "number"):
+        return "?"
+    if kind in ("comment", "space"):
+        return " "
+    return match.group()
+
+
+@lru_cache(maxsize=4096)
+def normalize_sql(sql: Optional[str]) -> str:
+    """
+    Texto do comando sem os literais, para agrupar execuções da mesma consulta.
+
+    Strings ('...', E'...', $$...$$) e números viram "?", listas de literais "(?, ?, ?)"
+    viram "(?, ...)", comentários somem e os espaços são compactados. Parâmetros da
+    query estendida ($1, $2...) e identificadores ficam como estão.
+    """
+    if sql is None:
+        return "<desconhecido>"
+    text = _TOKEN.sub(_token, sql)
+    text = _LIST.sub("(?, ...)", text)
+    return " ".join(text.split()).rstrip(";").rstrip()
+
+
+class QueryStats:
+    """Latências e linhas de um comando normalizado."""
+    def __init__(self, statement: str):
+        self.statement = statement
+        self.latency = LatencyHistogram()
+        self.rows = 0
+        self.errors = 0
+        self.connections: set[str] = set()
+
+    def record(self, event: PgQueryEvent):
+        # Erro no Parse/Bind não tem duração: conta só como erro
+        if event.duration is not None:
+            self.latency.record(event.duration)
+        self.rows += event.rows
+        if event.error:
+            self.errors += 1
+        if event.connection:
+            self.connections.add(event.connection)
+
+    def summary(self) -> dict:
+        return {
+            "statement": self.statement,
+            "calls": self.latency.count,
+            "total_seconds": self.latency.total / 1_000_000,
+            "rows": self.rows,
+            "rows_per_call": self.rows / self.latency.count if self.latency.count else 0.0,
+            "errors": self.errors,
+            "connections": len(self.connections),
+            **{key: value for key, value in self.latency.summary((50, 95, 99)).items() if key != "count"},
+        }
+
+
+class PgStatsCollector:
+    """
+    Estatísticas por comando a partir do tráfego PostgreSQL que passa pelo ProxyServer,
+    no lugar do pg_stat_statements em ambientes de teste.
+
+    Cada PgQueryEvent (ver handler.PgWireDecoder) entra no histograma do seu comando
+    normalizado. A latência é a do servidor vista pelo proxy, medida em cada conexão do
+    Query/Execute até o CommandComplete (ou o erro).
+
+    Exemplo:
+        stats = PgStatsCollector()
+        proxy = ProxyServer(5433, "localhost", 5432, binary_facades=[stats.facade()])
+        suite.on_finish(lambda: stats.dump("pg_stats.json"))
+    """
+    def __init__(self):
+        self.statements: dict[str, QueryStats] = {}
+        self.ignored = 0   # eventos sem duração e sem erro
+
+    def facade(self) -> PostgresFacade:
+        """Facade para binary_facades; cria um decodificador por conexão."""
+        return PostgresFacade(on_event=self.record)
+
+    def record(self, event: PgQueryEvent):
+        if event.duration is None and not event.error:
+            self.ignored += 1
+            return
+        statement = normalize_sql(event.sql)
+        stats = self.statements.get(statement)
+        if stats is None:
+            stats = self.statements[statement] = QueryStats(statement)
+        stats.record(event)
+
+    def reset(self):
+        self.statements.clear()
+        self.ignored = 0
+
+    # --- leitura ---------------------------------------------------------
+    def snapshot(self, sort: str = "total_seconds", top: Optional[int] = None) -> list[dict]:
+        """Resumo atual de cada comando, do maior para o menor em `sort`."""
+        rows = sorted((stats.summary() for stats in self.statements.values()),
+                      key=lambda row: row[sort], reverse=True)
+        return rows[:top] if top else rows
+
+    def table(self, sort: str = "total_seconds", top: int = 20) -> Table:
+        table = Table(title="PostgreSQL por comando", expand=True)
+        table.add_column("comando", overflow="fold", ratio=1)
+        for column in ("calls", "total ms", "p50 ms", "p95 ms", "p99 ms", "rows", "erros"):
+            table.add_column(column, justify="right", no_wrap=True)
+        for row in self.snapshot(sort, top):
+            table.add_row(
+                row["statement"],
+                f"{row['calls']:,}",
+                f"{row['total_seconds'] * 1000:,.1f}",
+                f"{row['p50'] * 1000:.2f}",
+                f"{row['p95'] * 1000:.2f}",
+                f"{row['p99'] * 1000:.2f}",
+                f"{row['rows']:,}",
+                f"{row['errors']:,}" if row["errors"] else "",
+            )
+        return table
+
+    async def live(self, interval: float = 1.0, top: int = 15, console: Console = None):
+        """Mostra a tabela atualizada a cada `interval` segundos até a tarefa ser cancelada."""
+        with Live(self.table(top=top), console=console, refresh_per_second=4) as live:
+            while True:
+                await asyncio.sleep(interval)
+                live.update(self.table(top=top))
+
+    def report(self) -> dict:
+        return {
+            "statements": [
+                {**stats.summary(), "latency": stats.latency.to_dict()}
+                for stats in sorted(self.statements.values(), key=lambda s: s.latency.total, reverse=True)
+            ],
+            "ignored_events": self.ignored,
+        }
+
+    def dump(self, path: str, console: Console = None, top: int = 20) -> dict:
+        """Grava o relatório JSON em `path` e imprime a tabela dos comandos mais custosos."""
+        report = self.report()
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+        console = console or Console()
+        if self.statements:
+            console.print(self.table(top=top))
+        console.print(f"[dim]Relatório PostgreSQL: {path} ({len(self.statements)} comandos)[/dim]")
+        return report
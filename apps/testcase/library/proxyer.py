@@ -1,6 +1,10 @@
 import asyncio
+import inspect
+import os
+import sys
 
 import socket
+import time
 import psutil  # você pode instalar via: pip install psutil
 
 def is_port_in_use(port: int, host="localhost") -> bool:
@@ -39,25 +43,363 @@ def ensure_port_is_free(port: int, host="localhost"):
         print(f"Porta {port} está livre!")
 
 
+class _BufferPool:
+    """
+    Buffers pré-alocados de um sentido do relay, reaproveitados entre leituras.
+
+    Um buffer cujo conteúdo não coube inteiro no socket de destino pode continuar
+    referenciado pelo transporte; ele só volta a ser usado quando o buffer de escrita
+    do destino esvazia. Se todos estiverem ocupados, o pool cresce (limitado, na
+    prática, pelo high watermark que pausa a leitura).
+    """
+    def __init__(self, size: int, count: int):
+        self.size = size
+        self.free = [memoryview(bytearray(size)) for _ in range(count)]
+        self.in_flight = []
+
+    def take(self) -> memoryview:
+        return self.free.pop() if self.free else memoryview(bytearray(self.size))
+
+    def recycle(self, buffer: memoryview):
+        self.free.append(buffer)
+
+    def retire(self, buffer: memoryview):
+        self.in_flight.append(buffer)
+
+    def release_in_flight(self):
+        if self.in_flight:
+            self.free.extend(self.in_flight)
+            self.in_flight.clear()
+
+
+class _RelayProtocol(asyncio.BufferedProtocol):
+    """
+    Um lado do relay (cliente ou servidor de destino) sobre BufferedProtocol.
+
+    O loop lê direto num buffer do pool (get_buffer/buffer_updated), as facades recebem
+    um memoryview desse buffer e o mesmo memoryview é escrito no transporte do outro
+    lado. Se o socket aceita tudo na hora não há cópia nenhuma; o que sobra fica no
+    transporte (copiado ou referenciado, conforme a versão do Python), e por isso o
+    buffer só é reaproveitado depois que o buffer de escrita do destino esvazia.
+    Quando ele passa do high watermark, a leitura deste lado é pausada até ele descer
+    ao low watermark.
+    """
+    def __init__(self, proxy: "ProxyServer", direction: str):
+        self.proxy = proxy
+        self.direction = direction
+        self.buffers = _BufferPool(proxy.buffer_size, proxy.buffer_count)
+        self.peer: "_RelayProtocol" = None
+        self.transport = None
+        self.facades = ()   # facades da conexão, compartilhadas pelos dois lados
+        self.closed = proxy.event_loop.create_future()
+        self._buffer = None
+        self._pauses = 0
+        self.eof = False    # este lado já mandou FIN (e ele foi repassado ao outro)
+
+    # --- controle de leitura ------------------------------------------------
+    def pause(self):
+        self._pauses += 1
+        if self._pauses == 1 and self.transport and not self.transport.is_closing():
+            self.transport.pause_reading()
+
+    def resume(self):
+        self._pauses -= 1
+        if self._pauses == 0 and self.transport and not self.transport.is_closing():
+            self.transport.resume_reading()
+
+    # --- callbacks do asyncio ----------------------------------------------
+    def connection_made(self, transport):
+        self.transport = transport
+        transport.set_write_buffer_limits(high=self.proxy.high_watermark, low=self.proxy.low_watermark)
+        # Nenhum lado lê antes de os dois estarem ligados
+        self.pause()
+        if self.direction == "client":
+            self.facades = self.proxy._connection_facades(transport.get_extra_info("peername"))
+            self.proxy.event_loop.create_task(self.proxy._connect_upstream(self))
+
+    def get_buffer(self, sizehint):
+        if not self.peer.transport.get_write_buffer_size():
+            self.buffers.release_in_flight()
+        self._buffer = self.buffers.take()
+        return self._buffer
+
+    def buffer_updated(self, nbytes):
+        buffer, self._buffer = self._buffer, None
+        chunk = buffer[:nbytes]
+        if self.proxy.tap is not None:
+            # Modo tap: repassa já; se a fila estiver cheia (política "block"), só para de ler
+            pending = self.proxy.tap.offer(self.direction, chunk, self.facades)
+            self._forward(buffer, chunk)
+            if pending is not None:
+                self.pause()
+                self.proxy.event_loop.create_task(self._resume_after(pending))
+            return
+
+        pending = self.proxy._inspect(self.direction, chunk, self.facades)
+        if pending is None:
+            self._forward(buffer, chunk)
+            return
+        # Facade assíncrona: o pedaço só segue depois dela, sem ler mais nada enquanto isso
+        self.pause()
+        self.proxy.event_loop.create_task(self._forward_after(pending, buffer, chunk))
+
+    async def _resume_after(self, pending):
+        try:
+            await pending
+        except Exception as e:
+            print(f"Facade error ({self.direction}): {e}")
+        finally:
+            # Mesmo com erro ou cancelamento na facade a leitura precisa voltar
+            self.resume()
+
+    async def _forward_after(self, pending, buffer, chunk):
+        try:
+            await pending
+        except Exception as e:
+            print(f"Facade error ({self.direction}): {e}")
+        if not self.peer.transport.is_closing():
+            self._forward(buffer, chunk)
+        self.resume()
+
+    def _forward(self, buffer, chunk):
+        self.peer.transport.write(chunk)
+        if self.peer.transport.get_write_buffer_size():
+            self.buffers.retire(buffer)
+        else:
+            self.buffers.recycle(buffer)
+
+    def pause_writing(self):
+        # Meu buffer de escrita encheu: para de ler do outro lado
+        self.peer.pause()
+
+    def resume_writing(self):
+        # Abaixo do low watermark ainda pode haver bytes dos buffers do outro lado no
+        # transporte: eles só voltam ao pool quando o buffer de escrita esvazia de vez
+        if not self.transport.get_write_buffer_size():
+            self.peer.buffers.release_in_flight()
+        self.peer.resume()
+
+    def eof_received(self):
+        if self.peer and self.peer.transport and self.peer.transport.can_write_eof():
+            self.eof = True
+            self.peer.transport.write_eof()
+            if self.peer.eof:
+                # Os dois sentidos terminaram: close() ainda esvazia o que falta escrever
+                self.transport.close()
+                self.peer.transport.close()
+            return True  # meia conexão: o outro sentido continua
+        return False
+
+    def connection_lost(self, exc):
+        if self.proxy.tap is not None:
+            self.proxy.tap.forget(self.facades)
+        if self.peer and self.peer.transport:
+            self.peer.transport.close()
+        if not self.closed.done():
+            self.closed.set_result(exc)
+
+
+class FacadeTap:
+    """
+    Inspeção fora do caminho dos dados: as facades rodam numa tarefa de fundo.
+
+    Cada pedaço repassado pelo proxy é copiado para uma fila limitada (`maxsize`) e
+    segue imediatamente para o destino. Com a fila cheia, a política "drop" descarta o
+    pedaço (contado em `dropped`/`dropped_bytes`) e "block" faz o relay parar de ler até
+    haver espaço (backpressure, sem atrasar o que já foi lido). Facades com
+    `on_data_dropped(direction, nbytes)` são avisadas das lacunas antes do pedaço seguinte.
+    Cada pedaço leva as facades da sua conexão; as lacunas são contadas por conexão.
+    Facades com `timestamped = True` recebem também `received_at` (time.perf_counter()
+    de quando o proxy leu o pedaço), já que a tarefa de fundo pode processá-lo depois.
+    """
+    def __init__(self, facades, maxsize: int = 1024, policy: str = "drop"):
+        if policy not in ("drop", "block"):
+            raise ValueError(f"Política de tap inválida: {policy!r}")
+        self.facades = facades
+        self.policy = policy
+        self.queue = asyncio.Queue(maxsize)
+        self.enqueued = 0
+        self.processed = 0
+        self.dropped = 0
+        self.dropped_bytes = 0
+        self.errors = 0
+        self.max_depth = 0
+        self._gaps: dict[tuple, int] = {}   # (facades, direção) -> bytes descartados
+        self._worker = None
+
+    def start(self):
+        if self._worker is None:
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._worker:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    def offer(self, direction: str, chunk, facades=None):
+        """
+        Enfileira uma cópia do pedaço. Devolve None, ou (política "block" com a fila
+        cheia) um awaitable que termina quando o pedaço entrar na fila.
+        """
+        facades = tuple(self.facades if facades is None else facades)
+        key = (facades, direction)
+        item = (facades, direction, bytes(chunk), self._gaps.get(key, 0), time.perf_counter())
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            if self.policy == "block":
+                self._gaps.pop(key, None)
+                return self._put(item)
+            self.dropped += 1
+            self.dropped_bytes += len(item[2])
+            self._gaps[key] = item[3] + len(item[2])
+            return None
+        self._gaps.pop(key, None)
+        self._enqueued()
+        return None
+
+    def forget(self, facades):
+        """Descarta as lacunas pendentes de uma conexão encerrada."""
+        facades = tuple(facades)
+        for direction in ("client", "server"):
+            self._gaps.pop((facades, direction), None)
+
+    async def _put(self, item):
+        await self.queue.put(item)
+        self._enqueued()
+
+    def _enqueued(self):
+        self.enqueued += 1
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+
+    async def _run(self):
+        while True:
+            facades, direction, data, gap, received_at = await self.queue.get()
+            for facade in facades:
+                try:
+                    if gap and hasattr(facade, "on_data_dropped"):
+                        facade.on_data_dropped(direction, gap)
+                    handler = (facade.on_client_data_received if direction == "client"
+                               else facade.on_server_data_received)
+                    if getattr(facade, "timestamped", False):
+                        result = handler(data, received_at=received_at)
+                    else:
+                        result = handler(data)
+                    if inspect.isawaitable(result):
+                        await result
+                except Exception as e:
+                    self.errors += 1
+                    print(f"Facade error ({direction}): {e}")
+            self.processed += 1
+
+    def stats(self) -> dict:
+        return {
+            "policy": self.policy,
+            "depth": self.queue.qsize(),
+            "max_depth": self.max_depth,
+            "enqueued": self.enqueued,
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "dropped_bytes": self.dropped_bytes,
+            "errors": self.errors,
+        }
+
+
+# os.splice só existe no Linux (Python >= 3.10)
+SPLICE_AVAILABLE = sys.platform.startswith("linux") and hasattr(os, "splice")
+
+
 class ProxyServer:
-    def __init__(self, original_port, mirror_host, mirror_port, binary_facades=None, original_host="localhost"):
+    def __init__(self, original_port, mirror_host, mirror_port, binary_facades=None, original_host="localhost",
+                 relay="auto", buffer_size=64 * 1024, buffer_count=4,
+                 high_watermark=None, low_watermark=None,
+                 facade_mode="inline", tap_queue_size=1024, tap_policy="drop"):
+        """
+        Proxy TCP entre `original_host:original_port` e `mirror_host:mirror_port`.
+
+        Args:
+            binary_facades (list): Objetos com on_client_data_received/on_server_data_received
+                (síncronos ou async) chamados com cada pedaço antes de ele ser repassado. No
+                relay "buffered" recebem um memoryview válido só durante a chamada: quem
+                precisar guardar os bytes deve copiá-los (bytes(chunk)). Uma classe é
+                instanciada com (origem, destino) a cada conexão, e um objeto com
+                `for_connection(origem, destino)` é trocado pelo que ele devolver, para
+                facades que guardam estado por conexão (ex.: handler.PostgresFacade).
+            relay (str): "buffered" (BufferedProtocol com buffers reaproveitados),
+                "stream" (StreamReader/StreamWriter, implementação original), "splice"
+                (os.splice via pipe: o kernel copia entre os sockets, sem passar pelo Python;
+                só Linux e sem facades) ou "auto" (splice quando possível, senão buffered).
+            buffer_size (int): Tamanho de cada buffer de leitura do relay "buffered" e do
+                pipe usado pelo "splice".
+            buffer_count (int): Buffers pré-alocados por sentido.
+            high_watermark / low_watermark (int): Limites do buffer de escrita que pausam e
+                retomam a leitura do outro lado (padrão: 4 e 1 buffers).
+            facade_mode (str): "inline" espera as facades antes de repassar cada pedaço;
+                "tap" repassa na hora e entrega cópias às facades numa tarefa de fundo
+                (ver FacadeTap), com fila de `tap_queue_size` pedaços e política
+                `tap_policy` ("drop" ou "block") quando ela enche.
+        """
         self.original_port = original_port
         self.mirror_host = mirror_host
         self.mirror_port = mirror_port
         self.binary_facades = binary_facades or []
-        self.host = host
+        self.original_host = original_host
+        if facade_mode not in ("inline", "tap"):
+            raise ValueError(f"Modo de facade inválido: {facade_mode!r}")
+        self.tap = (FacadeTap(self.binary_facades, tap_queue_size, tap_policy)
+                    if facade_mode == "tap" and self.binary_facades else None)
+        if relay not in ("auto", "buffered", "stream", "splice"):
+            raise ValueError(f"Relay inválido: {relay!r}")
+        if relay == "auto":
+            relay = "splice" if SPLICE_AVAILABLE and not self.binary_facades else "buffered"
+        elif relay == "splice" and self.binary_facades:
+            # Facades precisam ver os bytes: volta para o relay em espaço de usuário
+            relay = "buffered"
+        elif relay == "splice" and not SPLICE_AVAILABLE:
+            raise ValueError("relay='splice' exige Linux e Python >= 3.10")
+        self.relay = relay
+        self.buffer_size = buffer_size
+        self.buffer_count = buffer_count
+        self.high_watermark = high_watermark if high_watermark is not None else buffer_size * 4
+        self.low_watermark = low_watermark if low_watermark is not None else buffer_size
+        self.server = None
+        self.listener = None
+        self._stopping = None
         self.event_loop = asyncio.get_running_loop()
 
     async def stop(self):
-        self.server_socket.close()
+        if self.tap:
+            await self.tap.stop()
+        if self.server:
+            self.server.close()
+        if self._stopping and not self._stopping.done():
+            # O _serve_splice para de aceitar, fecha o listener e o start() retorna
+            self._stopping.set_result(None)
 
     async def start(self):
         ensure_port_is_free(self.original_port, self.original_host)
-        server = await asyncio.start_server(
-            self.handle_client,
-            host=self.original_host,
-            port=self.original_port
-        )
+        if self.relay == "splice":
+            await self._serve_splice()
+            return
+        if self.tap:
+            self.tap.start()
+        if self.relay == "buffered":
+            server = await self.event_loop.create_server(
+                lambda: _RelayProtocol(self, "client"),
+                host=self.original_host,
+                port=self.original_port,
+            )
+        else:
+            server = await asyncio.start_server(
+                self.handle_client,
+                host=self.original_host,
+                port=self.original_port
+            )
+        self.server = server
 
         addrs = ', '.join(str(sock.getsockname()) for sock in server.sockets)
         print(f"Serving on {addrs}")
@@ -65,6 +407,146 @@ class ProxyServer:
         async with server:
             await server.serve_forever()
 
+    def _connection_facades(self, peername) -> tuple:
+        """Facades de uma nova conexão (ver binary_facades)."""
+        src, dst = peername, (self.mirror_host, self.mirror_port)
+        facades = []
+        for facade in self.binary_facades:
+            if isinstance(facade, type):
+                facade = facade(src, dst)
+            elif hasattr(facade, "for_connection"):
+                facade = facade.for_connection(src, dst)
+            facades.append(facade)
+        return tuple(facades)
+
+    def _inspect(self, direction: str, data, facades=None):
+        """Entrega o pedaço às facades; devolve um awaitable se alguma for assíncrona."""
+        pending = []
+        for facade in self.binary_facades if facades is None else facades:
+            if direction == "client":
+                result = facade.on_client_data_received(data)
+            else:
+                result = facade.on_server_data_received(data)
+            if inspect.isawaitable(result):
+                pending.append(result)
+        if not pending:
+            return None
+        return asyncio.gather(*pending)
+
+    async def _connect_upstream(self, client: _RelayProtocol):
+        try:
+            _, upstream = await self.event_loop.create_connection(
+                lambda: _RelayProtocol(self, "server"),
+                self.mirror_host,
+                self.mirror_port,
+            )
+        except OSError as e:
+            print(f"Error in handle_client: {e}")
+            client.transport.close()
+            return
+        client.peer, upstream.peer = upstream, client
+        upstream.facades = client.facades
+        if client.transport.is_closing():
+            upstream.transport.close()
+            return
+        client.resume()
+        upstream.resume()
+
+    # --- relay "splice" ---------------------------------------------------------
+    async def _serve_splice(self):
+        self.listener = socket.create_server((self.original_host, self.original_port))
+        self.listener.setblocking(False)
+        self._stopping = self.event_loop.create_future()
+        print(f"Serving on {self.listener.getsockname()} (splice)")
+        with self.listener:
+            while True:
+                accept = asyncio.ensure_future(self.event_loop.sock_accept(self.listener))
+                await asyncio.wait((accept, self._stopping), return_when=asyncio.FIRST_COMPLETED)
+                if self._stopping.done():
+                    accept.cancel()
+                    return
+                client, _ = accept.result()
+                self.event_loop.create_task(self._handle_splice(client))
+
+    async def _open_upstream(self) -> socket.socket:
+        """Conecta ao mirror sem bloquear o loop, tentando cada endereço resolvido (IPv4 ou IPv6)."""
+        addresses = await self.event_loop.getaddrinfo(self.mirror_host, self.mirror_port, type=socket.SOCK_STREAM)
+        error = None
+        for family, type_, proto, _, address in addresses:
+            upstream = socket.socket(family, type_, proto)
+            upstream.setblocking(False)
+            try:
+                await self.event_loop.sock_connect(upstream, address)
+                return upstream
+            except OSError as e:
+                upstream.close()
+                error = e
+        raise error or OSError(f"Endereço não encontrado: {self.mirror_host}")
+
+    async def _handle_splice(self, client: socket.socket):
+        upstream = None
+        try:
+            client.setblocking(False)
+            upstream = await self._open_upstream()
+            await asyncio.gather(self._splice(client, upstream), self._splice(upstream, client))
+        except Exception as e:
+            print(f"Error in handle_client: {e}")
+        finally:
+            client.close()
+            if upstream is not None:
+                upstream.close()
+
+    def _wait_fd(self, fd: int, writable: bool):
+        future = self.event_loop.create_future()
+        add, remove = ((self.event_loop.add_writer, self.event_loop.remove_writer) if writable
+                       else (self.event_loop.add_reader, self.event_loop.remove_reader))
+        add(fd, lambda: future.done() or future.set_result(None))
+        future.add_done_callback(lambda _: remove(fd))
+        return future
+
+    async def _splice(self, src: socket.socket, dst: socket.socket):
+        """Move os bytes de src para dst dentro do kernel: socket -> pipe -> socket."""
+        read_end, write_end = os.pipe2(os.O_NONBLOCK)
+        flags = os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK
+        try:
+            try:
+                import fcntl
+                fcntl.fcntl(write_end, fcntl.F_SETPIPE_SZ, self.buffer_size)
+            except (ImportError, AttributeError, OSError):
+                pass  # fica com o tamanho padrão do pipe
+
+            src_fd, dst_fd = src.fileno(), dst.fileno()
+            while True:
+                try:
+                    n = os.splice(src_fd, write_end, self.buffer_size, flags=flags)
+                except BlockingIOError:
+                    await self._wait_fd(src_fd, writable=False)
+                    continue
+                if n == 0:
+                    # EOF: repassa o meio-fechamento e deixa o outro sentido terminar
+                    try:
+                        dst.shutdown(socket.SHUT_WR)
+                    except OSError:
+                        pass
+                    return
+
+                while n:
+                    try:
+                        n -= os.splice(read_end, dst_fd, n, flags=flags)
+                    except BlockingIOError:
+                        await self._wait_fd(dst_fd, writable=True)
+        except OSError:
+            # Reset ou erro num sentido: derruba os dois sockets para o outro sentido
+            # não ficar esperando para sempre (ele vê EOF/EPIPE e termina)
+            for sock in (src, dst):
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+        finally:
+            os.close(read_end)
+            os.close(write_end)
+
     async def handle_client(self, client_reader: asyncio.StreamReader, client_writer: asyncio.StreamWriter):
         try:
             # Conectando ao servidor destino
@@ -74,8 +556,9 @@ class ProxyServer:
             )
 
             # Cria pipes bidirecionais
-            client_to_server = asyncio.create_task(self.pipe(client_reader, server_writer, "client"))
-            server_to_client = asyncio.create_task(self.pipe(server_reader, client_writer, "server"))
+            facades = self._connection_facades(client_writer.get_extra_info("peername"))
+            client_to_server = asyncio.create_task(self.pipe(client_reader, server_writer, "client", facades))
+            server_to_client = asyncio.create_task(self.pipe(server_reader, client_writer, "server", facades))
 
             # Espera terminar uma direção (por exemplo, conexão fechada)
             await asyncio.wait(
@@ -86,6 +569,8 @@ class ProxyServer:
         except Exception as e:
             print(f"Error in handle_client: {e}")
         finally:
+            if self.tap is not None and 'facades' in locals():
+                self.tap.forget(facades)
             client_writer.close()
             try:
                 await client_writer.wait_closed()
@@ -98,7 +583,8 @@ class ProxyServer:
                 except Exception:
                     pass
 
-    async def pipe(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, direction: str):
+    async def pipe(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, direction: str,
+                   facades=None):
         try:
             while True:
                 data = await reader.read(4096)
@@ -106,11 +592,17 @@ class ProxyServer:
                     break
 
                 # Intercepta o binário
-                for facade in self.binary_facades:
-                    if direction == "client":
-                        await facade.on_client_data_received(data)
-                    else:
-                        await facade.on_server_data_received(data)
+                if self.tap is not None:
+                    pending = self.tap.offer(direction, data, facades)
+                    writer.write(data)
+                    if pending is not None:
+                        await pending
+                    await writer.drain()
+                    continue
+
+                pending = self._inspect(direction, data, facades)
+                if pending is not None:
+                    await pending
 
                 writer.write(data)
                 await writer.drain()
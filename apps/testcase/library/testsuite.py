@@ -108,6 +108,21 @@ class Suite:
         self.console = rich.get_console()
         self.data_inputs = []
         self.execution_times = self._load_execution_times()
+        self.finish_callbacks = []
+
+    def on_finish(self, callback: Callable):
+        """Registra uma função (síncrona ou async) chamada quando run_all termina, com ou sem falha."""
+        self.finish_callbacks.append(callback)
+        return callback
+
+    async def _finish(self):
+        for callback in self.finish_callbacks:
+            try:
+                result = callback()
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                self.console.print(f"[red]Error in finish callback {getattr(callback, '__name__', callback)}: {e}[/]")
 
     def step(self, descr: str, method: Callable):
         self.steps.append(Step(descr, method))
@@ -139,31 +154,34 @@ class Suite:
     async def run_all(self, arguments):
         from library import cmd
         
-        for idx, step in enumerate(self.steps, start=1):
-            self.actual_step = idx
-            text, filtered_args = interpolate_data(step.descr, arguments)
-            self.console.print(f"[bold cyan]{text}[/]")
+        try:
+            for idx, step in enumerate(self.steps, start=1):
+                self.actual_step = idx
+                text, filtered_args = interpolate_data(step.descr, arguments)
+                self.console.print(f"[bold cyan]{text}[/]")
             
-            method_name = step.method.__name__
-            start_time = time.time()
-            try:
-                if inspect.iscoroutinefunction(step.method):
-                    executed_method = step.method(**filtered_args)
-                    await executed_method
-                else:
-                    step.method(**filtered_args)
-            except cmd.FailTest as e:
-                self.console.print(f"[red]Error in {method_name} {e.title}(): {e}[/]")
-                execution_time = time.time() - start_time
-                for line in e.log_message.splitlines():
-                    self.console.print(f"  [red]{line}[/]")
-                self.console.print(f"  [red]x[/] {method_name}() failed in {execution_time:.2f}s")
-                return
+                method_name = step.method.__name__
+                start_time = time.time()
+                try:
+                    if inspect.iscoroutinefunction(step.method):
+                        executed_method = step.method(**filtered_args)
+                        await executed_method
+                    else:
+                        step.method(**filtered_args)
+                except cmd.FailTest as e:
+                    self.console.print(f"[red]Error in {method_name} {e.title}(): {e}[/]")
+                    execution_time = time.time() - start_time
+                    for line in e.log_message.splitlines():
+                        self.console.print(f"  [red]{line}[/]")
+                    self.console.print(f"  [red]x[/] {method_name}() failed in {execution_time:.2f}s")
+                    return
 
-            execution_time = time.time() - start_time
-            self._save_execution_time(method_name, execution_time)
+                execution_time = time.time() - start_time
+                self._save_execution_time(method_name, execution_time)
             
-            self.console.print(f"  [green]✓[/] {method_name}() completed in {execution_time:.2f}s")
+                self.console.print(f"  [green]✓[/] {method_name}() completed in {execution_time:.2f}s")
+        finally:
+            await self._finish()
 
         return
 
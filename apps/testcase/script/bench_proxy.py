@@ -0,0 +1,130 @@
+"""
+Benchmark de vazão do ProxyServer.
+
+Sobe um servidor "sink" (lê e descarta, respondendo quando recebe tudo) e um ProxyServer
+na frente dele, cada um no seu processo, e mede quanto tempo o cliente leva para
+empurrar N MB pelo proxy até o sink confirmar o recebimento.
+
+Uso (a partir de apps/testcase):
+    python -m script.bench_proxy --mb 2048 --relays stream buffered splice
+"""
+import argparse
+import asyncio
+import multiprocessing
+import socket
+import struct
+import time
+
+SINK_PORT = 19100
+PROXY_PORT = 19101
+
+
+def _sink(port: int, ready):
+    with socket.create_server(("127.0.0.1", port)) as server:
+        ready.set()
+        while True:
+            conn, _ = server.accept()
+            with conn:
+                # O cliente manda o total esperado antes dos dados; a resposta sai ao completar
+                header = conn.recv(8, socket.MSG_WAITALL)
+                if len(header) < 8:
+                    continue
+                expected = struct.unpack("!Q", header)[0]
+                buffer = bytearray(1024 * 1024)
+                total = 0
+                while total < expected:
+                    n = conn.recv_into(buffer)
+                    if not n:
+                        break
+                    total += n
+                conn.sendall(struct.pack("!Q", total))
+
+
+def _proxy(relay: str, buffer_size: int, ready):
+    from library.proxyer import ProxyServer
+
+    async def main():
+        proxy = ProxyServer(PROXY_PORT, "127.0.0.1", SINK_PORT, original_host="127.0.0.1",
+                            relay=relay, buffer_size=buffer_size)
+        ready.set()
+        await proxy.start()
+
+    asyncio.run(main())
+
+
+def _wait_port(port: int, timeout: float = 10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise TimeoutError(f"Porta {port} não abriu")
+
+
+def _push(port: int, total_bytes: int, chunk_size: int = 1024 * 1024) -> float:
+    chunk = memoryview(b"x" * chunk_size)
+    start = time.perf_counter()
+    with socket.create_connection(("127.0.0.1", port)) as conn:
+        conn.sendall(struct.pack("!Q", total_bytes))
+        sent = 0
+        while sent < total_bytes:
+            size = min(chunk_size, total_bytes - sent)
+            conn.sendall(chunk[:size])
+            sent += size
+        received = struct.unpack("!Q", conn.recv(8, socket.MSG_WAITALL))[0]
+    elapsed = time.perf_counter() - start
+    if received != total_bytes:
+        raise RuntimeError(f"Sink recebeu {received} de {total_bytes} bytes")
+    return elapsed
+
+
+def run(relays, megabytes: int, buffer_size: int, repeat: int = 3) -> dict:
+    total = megabytes * 1024 * 1024
+    results = {}
+
+    ready = multiprocessing.Event()
+    sink = multiprocessing.Process(target=_sink, args=(SINK_PORT, ready), daemon=True)
+    sink.start()
+    ready.wait()
+
+    try:
+        for relay in relays:
+            ready = multiprocessing.Event()
+            proxy = multiprocessing.Process(target=_proxy, args=(relay, buffer_size, ready), daemon=True)
+            proxy.start()
+            ready.wait()
+            _wait_port(PROXY_PORT)
+            try:
+                _push(PROXY_PORT, 16 * 1024 * 1024)  # aquecimento
+                best = min(_push(PROXY_PORT, total) for _ in range(repeat))
+            finally:
+                proxy.terminate()
+                proxy.join()
+            results[relay] = {
+                "seconds": best,
+                "mb_per_second": megabytes / best,
+                "gbit_per_second": total * 8 / best / 1e9,
+            }
+            print(f"{relay:>9}: {megabytes / best:9.1f} MB/s  {total * 8 / best / 1e9:6.2f} Gbit/s")
+    finally:
+        sink.terminate()
+        sink.join()
+
+    if "stream" in results:
+        base = results["stream"]["mb_per_second"]
+        for relay, result in results.items():
+            if relay != "stream":
+                print(f"{relay} vs stream: {result['mb_per_second'] / base:.2f}x")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Vazão do ProxyServer por tipo de relay")
+    parser.add_argument("--mb", type=int, default=1024, help="MB enviados por medição")
+    parser.add_argument("--buffer-size", type=int, default=64 * 1024)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--relays", nargs="+", default=["stream", "buffered", "splice"])
+    args = parser.parse_args()
+    run(args.relays, args.mb, args.buffer_size, args.repeat)
@@ -1,4 +1,4 @@
-from library import testsuite, proxyer, handler
+from library import testsuite, proxyer, pg_stats
 import tracemalloc
 
 tracemalloc.start(25)
@@ -29,7 +29,7 @@ async def open_service(self, url):
             mirror_port='8080',
             mirror_host='localhost',
             original_host='localhost',
-            binary_facades=[handler.PostgresFacade],
+            binary_facades=[pg_queries.facade()],
         )
 
         await self.pg_proxy.start()
@@ -49,7 +49,10 @@ async def close_service(self, url):
 import asyncio
 
 
+pg_queries = pg_stats.PgStatsCollector()
+
 ts = testsuite.actor("PostgreSQL Application")
+ts.on_finish(lambda: pg_queries.dump("pg_stats.json"))
 ts.step("use {{url}} to get data", open_service)
 ts.step("close service at {{url}}", close_service)
 